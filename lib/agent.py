@@ -0,0 +1,368 @@
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+
+# The client half of this module (request() and the get/search/list/unlock
+# commands) only needs the standard library, so a lookup through a running
+# agent does not pay for importing SQLAlchemy, cryptography or bcrypt. The
+# server imports those inside serve().
+
+IDLE_TIMEOUT = int(os.environ.get('ENCRYPTO_AGENT_TIMEOUT', 900))
+LIST_PAGE_SIZE = 1000
+
+
+def fallback_dir():
+    """Socket directory used when XDG_RUNTIME_DIR is not set."""
+    return f"/tmp/encrypto-{os.getuid()}"
+
+
+def default_socket_path():
+    if 'ENCRYPTO_AGENT_SOCKET' in os.environ:
+        return os.environ['ENCRYPTO_AGENT_SOCKET']
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or fallback_dir()
+    return os.path.join(runtime_dir, 'encrypto-agent.sock')
+
+
+class AgentError(Exception):
+    pass
+
+
+class Locked(AgentError):
+    pass
+
+
+class AgentClient:
+    """Connection to a running agent; one JSON object per line each way."""
+
+    def __init__(self, path=None, timeout=30):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        path = path or default_socket_path()
+        try:
+            self.sock.connect(path)
+            # The unlock command sends the account password, so only talk to
+            # an agent run by this user.
+            owner = _peer_uid(self.sock)
+            if owner is None:
+                owner = os.lstat(path).st_uid
+        except OSError:
+            self.sock.close()
+            raise
+        if owner != os.getuid():
+            self.sock.close()
+            raise AgentError(f"{path} belongs to another user; refusing to use it")
+        self.stream = self.sock.makefile('rwb')
+
+    def request(self, op, **params):
+        self.stream.write(json.dumps(dict(params, op=op)).encode('utf-8') + b'\n')
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise AgentError("Agent closed the connection")
+        response = json.loads(line)
+        if not response['ok']:
+            raise (Locked if response.get('locked') else AgentError)(response['error'])
+        return response['result']
+
+    def list_all(self, page_size=LIST_PAGE_SIZE):
+        """Yield every entry, fetching a page per request from where the last one ended."""
+        after = None
+        while True:
+            page = self.request('list', after=after, limit=page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = [page[-1]['website_key'], page[-1]['id']]
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def request(op, path=None, **params):
+    with AgentClient(path) as client:
+        return client.request(op, **params)
+
+
+class Agent:
+    """Holds one unlocked user and the warmed engine between requests.
+
+    Each request runs in its own thread with its own Session from the shared
+    engine. The agent locks itself (forgetting the user and clearing the
+    decryption cache) after timeout seconds without a request.
+    """
+
+    def __init__(self, timeout=IDLE_TIMEOUT, clock=time.monotonic):
+        from db.database import Session, init_db
+
+        init_db()
+        self.sessions = Session
+        self.timeout = timeout
+        self.clock = clock
+        self.user_id = None
+        self.username = None
+        self.last_used = clock()
+        self._lock = threading.Lock()
+
+    def lock(self):
+        from cache import decryption_cache, key_cache
+
+        with self._lock:
+            self.user_id = self.username = None
+        decryption_cache.clear()
+        key_cache.clear()
+
+    def lock_if_idle(self):
+        with self._lock:
+            idle = self.user_id is not None and self.clock() - self.last_used > self.timeout
+        if idle:
+            self.lock()
+        return idle
+
+    def _current_user(self):
+        with self._lock:
+            if self.user_id is None:
+                raise Locked("Agent is locked; run: python agent.py unlock <username>")
+            self.last_used = self.clock()
+            return self.user_id
+
+    def handle(self, message):
+        op = message.get('op')
+        if op == 'status':
+            with self._lock:
+                return {'unlocked': self.user_id is not None, 'username': self.username, 'timeout': self.timeout}
+        if op == 'unlock':
+            return self.unlock(message['username'], message['password'])
+        if op == 'lock':
+            self.lock()
+            return None
+        if op in ('get', 'search', 'list'):
+            from cache import KeyLocked
+            from db import shards
+
+            user_id = self._current_user()
+            with shards.open_session(user_id) as session:
+                try:
+                    return getattr(self, op)(session, user_id, message)
+                except KeyLocked:
+                    # The data key outlived its ENCRYPTO_KEY_TTL.
+                    self.lock()
+                    raise Locked("Agent is locked; run: python agent.py unlock <username>")
+        raise AgentError(f"Unknown operation: {op}")
+
+    def unlock(self, username, password):
+        from db import shards
+        from db.models import User
+        from userkeys import unlock
+
+        with self.sessions() as session:
+            user = session.query(User).filter_by(username=username).first()
+            if user is None or not user.check_password(password):
+                raise AgentError("Invalid username or password")
+            if user.needs_rehash():
+                user.set_password(password)
+                session.commit()
+            user_id = user.id
+            with shards.open_session(user_id) as entries:
+                unlock(session, user, password, entries)
+        with self._lock:
+            self.user_id = user_id
+            self.username = username
+            self.last_used = self.clock()
+        return None
+
+    def get(self, session, user_id, message):
+        from db.models import Password, normalize_website
+        from search import search_passwords
+
+        key = normalize_website(message['website'])
+        entries = session.query(Password).filter_by(user_id=user_id, website_key=key).order_by(Password.id).all()
+        if not entries:
+            # Accept an unambiguous prefix, e.g. "git" for "github.com".
+            entries = search_passwords(session, user_id, key, 'prefix')
+            if len({entry.website_key for entry in entries}) > 1:
+                raise AgentError(f"{message['website']} matches several websites: "
+                                 + ', '.join(sorted({entry.website for entry in entries})))
+        if message.get('username'):
+            entries = [entry for entry in entries if entry.username == message['username']]
+        return [_entry(entry, entry.get_decrypted_password()) for entry in entries]
+
+    def search(self, session, user_id, message):
+        from search import search_passwords
+
+        entries = search_passwords(session, user_id, message['query'], message.get('mode', 'substring'), message.get('limit'))
+        return [_entry(entry) for entry in entries]
+
+    def list(self, session, user_id, message):
+        from vault import PAGE_SIZE, password_page
+
+        after = message.get('after')
+        entries = password_page(session, user_id, tuple(after) if after else None, message.get('limit') or PAGE_SIZE)
+        return [_entry(entry) for entry in entries]
+
+
+def _entry(entry, password=None):
+    result = {'id': entry.id, 'website': entry.website, 'website_key': entry.website_key, 'username': entry.username}
+    if password is not None:
+        result['password'] = password
+    return result
+
+
+def _peer_uid(sock):
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    import struct
+
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def _check_private_dir(directory):
+    """Refuse a socket directory that another user owns or can get into.
+
+    /tmp/encrypto-<uid> is predictable, so another user could create it
+    first and plant a listener there.
+    """
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+        raise AgentError(f"{directory} must be a directory owned by you with mode 0700; refusing to use it")
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    try:
+        request('status', path)
+    except (OSError, AgentError):
+        os.unlink(path)
+    else:
+        raise AgentError(f"An agent is already listening on {path}")
+
+
+def serve(path=None, timeout=IDLE_TIMEOUT, ready=None):
+    import signal
+    import socketserver
+
+    path = path or default_socket_path()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if directory == fallback_dir():
+        _check_private_dir(directory)
+    _remove_stale_socket(path)
+    agent = Agent(timeout)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            uid = _peer_uid(self.request)
+            if uid is not None and uid != os.getuid():
+                return
+            for line in self.rfile:
+                try:
+                    response = {'ok': True, 'result': agent.handle(json.loads(line))}
+                except Locked as exc:
+                    response = {'ok': False, 'error': str(exc), 'locked': True}
+                except (AgentError, KeyError, ValueError) as exc:
+                    response = {'ok': False, 'error': str(exc) if not isinstance(exc, KeyError) else f"Missing field: {exc}"}
+                self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                self.wfile.flush()
+
+    class Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    # Create the socket with no group/other permissions from the start
+    # rather than chmod-ing it after it is already reachable.
+    umask = os.umask(0o177)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(umask)
+
+    def watch_idle():
+        while True:
+            time.sleep(min(5, max(timeout / 10, 0.05)))
+            agent.lock_if_idle()
+
+    threading.Thread(target=watch_idle, name='agent-idle', daemon=True).start()
+    if threading.current_thread() is threading.main_thread():
+        # Exit through the finally below on kill as well as Ctrl-C.
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Encrypto agent listening on {path} (locks after {timeout}s idle)", flush=True)
+    if ready is not None:
+        ready.set()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the vault unlocked in a background agent for fast lookups.")
+    parser.add_argument('--socket', default=None, help="socket path (default $ENCRYPTO_AGENT_SOCKET or $XDG_RUNTIME_DIR/encrypto-agent.sock)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('--timeout', type=int, default=IDLE_TIMEOUT, help="seconds idle before locking")
+    unlock_parser = commands.add_parser('unlock')
+    unlock_parser.add_argument('username')
+    commands.add_parser('lock')
+    commands.add_parser('status')
+    get_parser = commands.add_parser('get', help="print the password for a website")
+    get_parser.add_argument('website')
+    get_parser.add_argument('--username')
+    search_parser = commands.add_parser('search')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--mode', default='substring', choices=('substring', 'prefix', 'fuzzy'))
+    commands.add_parser('list')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'serve':
+            if os.environ.get('ENCRYPTO_PROFILE'):
+                import metrics
+                metrics.enable_from_env()
+            serve(args.socket, args.timeout)
+        elif args.command == 'unlock':
+            import getpass
+
+            request('unlock', args.socket, username=args.username, password=getpass.getpass("Password: "))
+        elif args.command in ('lock', 'status'):
+            result = request(args.command, args.socket)
+            if result is not None:
+                print(json.dumps(result))
+        elif args.command == 'get':
+            entries = request('get', args.socket, website=args.website, username=args.username)
+            if not entries:
+                sys.exit(f"No password stored for {args.website}")
+            if len(entries) > 1:
+                sys.exit(f"Several accounts for {args.website}; pick one with --username: "
+                         + ', '.join(entry['username'] for entry in entries))
+            print(entries[0]['password'])
+        elif args.command == 'search':
+            for entry in request('search', args.socket, query=args.query, mode=args.mode):
+                print(f"{entry['id']}\t{entry['website']}\t{entry['username']}")
+        else:
+            with AgentClient(args.socket) as client:
+                for entry in client.list_all():
+                    print(f"{entry['id']}\t{entry['website']}\t{entry['username']}")
+    except FileNotFoundError:
+        sys.exit("No agent running; start one with: python agent.py serve")
+    except AgentError as exc:
+        sys.exit(str(exc))
+
+
+if __name__ == '__main__':
+    main()
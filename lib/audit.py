@@ -0,0 +1,283 @@
+import argparse
+import collections
+import hashlib
+import hmac
+import json
+import math
+import mmap
+import os
+import string
+import struct
+
+import pwinput
+
+import crypto
+from db import shards
+from db.database import Session, init_db
+from db.models import Password, User
+from userkeys import unlock
+from workers import chunks, ordered_pool_map
+
+BATCH_SIZE = 1000
+
+# Breach index file: a sorted table of SHA-1 hashes, built once from a
+# Have I Been Pwned download. After the header comes a table of 65537
+# record numbers, one per 16-bit hash prefix (plus an end marker), then one
+# record per hash: the next 64 bits of the hash and its breach count. A
+# lookup jumps to its prefix's slice of the table and binary searches it on
+# the memory-mapped file, so about 14 probes find a hash among a billion
+# without loading the file. Keeping 80 bits of each hash makes a false
+# match about one in a trillion even at a billion hashes, at 12 bytes per
+# hash (roughly 10 GB for the full HIBP set).
+INDEX_MAGIC = b'ENCHIBP1'
+INDEX_HEADER = struct.Struct('<8sQ')
+PREFIXES = 1 << 16
+PREFIX_TABLE = struct.Struct(f'<{PREFIXES + 1}Q')
+RECORD = struct.Struct('>QI')  # hash bytes 2..10 (big-endian so they sort as bytes), breach count
+
+COMMON_PATTERNS = ('password', 'passw0rd', 'qwerty', 'letmein', 'welcome', 'admin', 'iloveyou', 'monkey', 'dragon', 'abc123', '1234')
+SEQUENCES = (string.ascii_lowercase, string.digits, 'qwertyuiopasdfghjklzxcvbnm')
+STRENGTH_LABELS = ('very weak', 'weak', 'fair', 'strong', 'very strong')
+
+
+class BreachIndex:
+    """Read-only view of a breach index file built by build_breach_index()."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = INDEX_HEADER.unpack_from(self.map)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a breach index")
+        self.prefixes = PREFIX_TABLE.unpack_from(self.map, INDEX_HEADER.size)
+        self.records = INDEX_HEADER.size + PREFIX_TABLE.size
+
+    def count_for(self, sha1_digest):
+        """How many times the password with this SHA-1 digest appears in the corpus (0 if never)."""
+        prefix = int.from_bytes(sha1_digest[:2], 'big')
+        key = int.from_bytes(sha1_digest[2:10], 'big')
+        low, high = self.prefixes[prefix], self.prefixes[prefix + 1]
+        while low < high:
+            middle = (low + high) // 2
+            found, count = RECORD.unpack_from(self.map, self.records + middle * RECORD.size)
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return count
+        return 0
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def _iter_hash_counts(source):
+    """(40-hex SHA-1, count) pairs from a sorted HIBP dump or a directory of range files."""
+    if os.path.isdir(source):
+        # One file per 5-hex-digit prefix, as written by the HIBP downloader;
+        # lines hold the remaining 35 hex digits.
+        for name in sorted(os.listdir(source)):
+            prefix = os.path.splitext(name)[0].upper()
+            if len(prefix) != 5:
+                continue
+            with open(os.path.join(source, name), encoding='ascii') as range_file:
+                for suffix, count in sorted(_split_lines(range_file)):
+                    yield prefix + suffix, count
+    else:
+        with open(source, encoding='ascii') as dump:
+            yield from _split_lines(dump)
+
+
+def _split_lines(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            digest, _, count = line.partition(':')
+            yield digest.upper(), int(count or 1)
+
+
+def build_breach_index(source, path):
+    """Write a breach index at path from source; returns the number of hashes."""
+    starts = [0] * (PREFIXES + 1)
+    count = 0
+    previous = None
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(b'\0' * (INDEX_HEADER.size + PREFIX_TABLE.size))
+        buffer = bytearray()
+        for digest, breaches in _iter_hash_counts(source):
+            if previous is not None and digest <= previous:
+                if digest == previous:
+                    continue
+                raise ValueError(f"{source} is not sorted by hash (use the ordered-by-hash download)")
+            previous = digest
+            raw = bytes.fromhex(digest)
+            starts[int.from_bytes(raw[:2], 'big') + 1] += 1
+            buffer += RECORD.pack(int.from_bytes(raw[2:10], 'big'), min(breaches, 0xFFFFFFFF))
+            count += 1
+            if len(buffer) >= 1 << 20:
+                out.write(buffer)
+                buffer.clear()
+        out.write(buffer)
+        for prefix in range(PREFIXES):
+            starts[prefix + 1] += starts[prefix]
+        out.seek(0)
+        out.write(INDEX_HEADER.pack(INDEX_MAGIC, count))
+        out.write(PREFIX_TABLE.pack(*starts))
+    os.replace(tmp_path, path)
+    return count
+
+
+def strength(password):
+    """Estimated entropy in bits and a 0-4 score."""
+    pool = 0
+    for char_class, size in ((string.ascii_lowercase, 26), (string.ascii_uppercase, 26), (string.digits, 10), (string.punctuation, 33)):
+        if any(char in char_class for char in password):
+            pool += size
+    if any(not char.isascii() for char in password):
+        pool += 100
+    # Count only distinct characters' worth of length, then take off what
+    # guessable runs and well-known words contribute.
+    effective = min(len(password), len(set(password)) * 2)
+    lowered = password.lower()
+    for pattern in COMMON_PATTERNS:
+        if pattern in lowered:
+            effective -= len(pattern) - 1
+    for sequence in SEQUENCES:
+        for start in range(len(sequence) - 3):
+            if sequence[start:start + 4] in lowered:
+                effective -= 2
+    bits = max(0, effective) * math.log2(pool) if pool else 0.0
+    score = sum(bits >= threshold for threshold in (28, 36, 60, 80))
+    return bits, score
+
+
+_worker = {}
+
+
+def _init_worker(vault_keys, reuse_key):
+    _worker['cipher'] = crypto.build_cipher(vault_keys)
+    _worker['reuse_key'] = reuse_key
+
+
+def _audit_batch(rows):
+    """Decrypt a batch and reduce each password to the facts the audit needs.
+
+    Plaintexts stay in the worker; only keyed hashes, SHA-1 digests and
+    scores come back.
+    """
+    cipher, reuse_key = _worker['cipher'], _worker['reuse_key']
+    results = []
+    for entry_id, website, username, token in rows:
+        password = cipher.decrypt(token.encode('utf-8'))
+        bits, score = strength(password.decode('utf-8'))
+        results.append((
+            entry_id, website, username,
+            hmac.new(reuse_key, password, hashlib.sha256).digest(),
+            hashlib.sha1(password).digest(),
+            bits, score,
+        ))
+    return results
+
+
+AuditReport = collections.namedtuple('AuditReport', 'entries reused weak breached')
+
+
+def audit_passwords(session, user_id, breach_index=None, min_score=2, batch_size=BATCH_SIZE, workers=None):
+    """Stream user_id's entries through the worker pool and collect reuse, weak and breached findings."""
+    query = (
+        session.query(Password.id, Password.website, Password.username, Password.password_hash)
+        .filter(Password.user_id == user_id)
+        .order_by(Password.id)
+        .yield_per(batch_size)
+    )
+    # A fresh random key per audit: equal passwords get equal HMACs within
+    # this run, but the digests mean nothing outside it.
+    reuse_key = os.urandom(32)
+    groups = collections.defaultdict(list)
+    weak = []
+    breached = []
+    entries = 0
+    rows = (tuple(row) for row in query)
+    batches = ordered_pool_map(_audit_batch, chunks(rows, batch_size), workers, _init_worker, (crypto.keys_for(user_id), reuse_key))
+    for batch in batches:
+        for entry_id, website, username, reuse_digest, sha1_digest, bits, score in batch:
+            entries += 1
+            entry = {'id': entry_id, 'website': website, 'username': username}
+            groups[reuse_digest].append(entry)
+            if score < min_score:
+                weak.append(dict(entry, bits=round(bits, 1), strength=STRENGTH_LABELS[score]))
+            if breach_index is not None:
+                count = breach_index.count_for(sha1_digest)
+                if count:
+                    breached.append(dict(entry, breaches=count))
+    reused = [group for group in groups.values() if len(group) > 1]
+    reused.sort(key=len, reverse=True)
+    return AuditReport(entries, reused, weak, breached)
+
+
+def print_report(report):
+    print(f"Audited {report.entries} passwords.")
+    print(f"\n{len(report.breached)} found in known breaches:")
+    for entry in report.breached:
+        print(f"  {entry['website']} ({entry['username']}): seen {entry['breaches']} times")
+    print(f"\n{len(report.reused)} passwords used for more than one entry:")
+    for group in report.reused:
+        print("  " + ", ".join(f"{entry['website']} ({entry['username']})" for entry in group))
+    print(f"\n{len(report.weak)} weak passwords:")
+    for entry in report.weak:
+        print(f"  {entry['website']} ({entry['username']}): {entry['strength']}, ~{entry['bits']:.0f} bits")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find reused, weak and breached passwords.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="audit a user's passwords")
+    run_parser.add_argument('--user', required=True)
+    run_parser.add_argument('--breach-index', help="index built with the build-index command")
+    run_parser.add_argument('--min-score', type=int, default=2, help="flag passwords scoring below this (0-4)")
+    run_parser.add_argument('--json', action='store_true')
+    run_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    run_parser.add_argument('--workers', type=int, default=None, help="decryption processes (0 to decrypt in this process)")
+    build_parser = commands.add_parser('build-index', help="build a breach index from a Have I Been Pwned SHA-1 download")
+    build_parser.add_argument('source', help="ordered-by-hash dump (HASH:COUNT lines) or a directory of range files")
+    build_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'build-index':
+        count = build_breach_index(args.source, args.path)
+        print(f"Indexed {count} hashes in {args.path}.")
+        return
+
+    init_db()
+    session = Session()
+    user = session.query(User).filter_by(username=args.user).first()
+    password = pwinput.pwinput("Password: ")
+    if not user or not user.check_password(password):
+        parser.exit(1, "Invalid username or password.\n")
+    entries = shards.open_session(user.id)
+    unlock(session, user, password, entries)
+    breach_index = BreachIndex(args.breach_index) if args.breach_index else None
+    try:
+        report = audit_passwords(entries, user.id, breach_index, args.min_score, args.batch_size, args.workers)
+    finally:
+        if breach_index is not None:
+            breach_index.close()
+    if args.json:
+        print(json.dumps(report._asdict(), indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
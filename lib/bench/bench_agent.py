@@ -0,0 +1,124 @@
+# lib/bench/bench_agent.py
+#
+# Lookup latency of a cold CLI run (new process, engine set-up, key load and
+# bcrypt login before the search) versus asking a running agent, over a
+# fresh connection, a kept-open connection, and from the `agent.py get` thin
+# client as a new process. Also measures throughput with concurrent clients.
+# Run from the lib directory:
+#
+#   python -m bench.bench_agent --entries 1000 --lookups 200 --clients 8
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERNAME = 'bench_user'
+PASSWORD = 'Abcd12345'
+
+
+def seed(tmp, entries):
+    script = (
+        "from db.database import Session, init_db\n"
+        "from db.models import User\n"
+        "from userkeys import unlock\n"
+        "from vault import WriteBatch\n"
+        "init_db()\n"
+        "session = Session()\n"
+        f"user = User(username={USERNAME!r})\n"
+        f"user.set_password({PASSWORD!r})\n"
+        "session.add(user)\n"
+        "session.commit()\n"
+        f"unlock(session, user, {PASSWORD!r})\n"
+        "with WriteBatch(session) as batch:\n"
+        f"    for i in range({entries}):\n"
+        f"        batch.create(user.id, f'site{{i}}.com', f'me{{i}}', f'pw{{i}}')\n"
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=tmp, env=environment(tmp), check=True)
+
+
+def environment(tmp):
+    return dict(os.environ, PYTHONPATH=LIB_DIR, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+
+
+def timed_runs(fn, count):
+    samples = []
+    for i in range(count):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{label:<28} median {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms   ({len(samples)} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--cold-runs', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=8)
+    args = parser.parse_args()
+
+    sys.path.insert(0, LIB_DIR)
+    from agent import AgentClient, request
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = environment(tmp)
+        seed(tmp, args.entries)
+        socket_path = os.path.join(tmp, 'agent.sock')
+
+        def cold(i):
+            lines = ['2', USERNAME, PASSWORD, '2', '4', f"site{i % args.entries}.com", '1', '']
+            subprocess.run([sys.executable, '-c', f"import cli; cli.run_script({lines!r})"],
+                           cwd=tmp, env=env, stdout=subprocess.DEVNULL, check=True)
+
+        report('cold CLI lookup', timed_runs(cold, args.cold_runs))
+
+        server = subprocess.Popen([sys.executable, os.path.join(LIB_DIR, 'agent.py'), '--socket', socket_path, 'serve'],
+                                  cwd=tmp, env=env, stdout=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+            request('unlock', socket_path, username=USERNAME, password=PASSWORD)
+
+            def thin_client(i):
+                subprocess.run([sys.executable, os.path.join(LIB_DIR, 'agent.py'), '--socket', socket_path,
+                                'get', f"site{i % args.entries}.com"], cwd=tmp, env=env, stdout=subprocess.DEVNULL, check=True)
+
+            report('agent, thin client process', timed_runs(thin_client, args.cold_runs * 4))
+            report('agent, new connection', timed_runs(
+                lambda i: request('get', socket_path, website=f"site{i % args.entries}.com"), args.lookups))
+            with AgentClient(socket_path) as client:
+                report('agent, open connection', timed_runs(
+                    lambda i: client.request('get', website=f"site{i % args.entries}.com"), args.lookups))
+
+            def worker(number):
+                with AgentClient(socket_path) as client:
+                    for i in range(args.lookups):
+                        client.request('get', website=f"site{(number * args.lookups + i) % args.entries}.com")
+
+            threads = [threading.Thread(target=worker, args=(number,)) for number in range(args.clients)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            print(f"{args.clients} concurrent clients: {args.clients * args.lookups / elapsed:.0f} lookups/sec")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
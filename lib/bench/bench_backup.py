@@ -0,0 +1,95 @@
+# lib/bench/bench_backup.py
+#
+# Time and bytes written by db.backup against copying the whole database.
+# Builds a synthetic vault with bench.synth, takes a first snapshot, then
+# re-encrypts --change percent of the entries (as a key rotation or mass
+# password change would) and takes a second. The full copy uses SQLite's
+# online backup API, the safe way to copy a live vault. Also times a
+# streaming restore and a verify of the latest snapshot. Run from the lib
+# directory:
+#
+#   python -m bench.bench_backup --entries 1000000 --users 1000 --change 1
+
+import argparse
+import contextlib
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from bench.synth import synthesize
+
+
+def full_copy(source, target):
+    started = time.perf_counter()
+    with contextlib.closing(sqlite3.connect(source)) as conn, contextlib.closing(sqlite3.connect(target)) as copy:
+        conn.backup(copy)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(target)
+    os.remove(target)
+    return elapsed, size
+
+
+def change_entries(percent, seed=1):
+    from sqlalchemy import bindparam, select, update
+
+    import crypto
+    from db.database import get_engine
+    from db.models import Password
+
+    table = Password.__table__
+    with get_engine().begin() as conn:
+        ids = list(conn.scalars(select(table.c.id)))
+        picked = random.Random(seed).sample(ids, max(1, len(ids) * percent // 100))
+        conn.execute(
+            update(table).where(table.c.id == bindparam('row_id')).values(password_hash=bindparam('new_hash')),
+            [{'row_id': row_id, 'new_hash': crypto.encrypt(b'changed password').decode('utf-8')} for row_id in picked],
+        )
+    return len(picked)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--change', type=int, default=1, help="percent of entries changed between snapshots")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vault_dir = os.path.join(tmp, 'vault')
+        synthesize(vault_dir, args.entries, args.users, report=lambda message: None)
+
+        from db import backup
+
+        database = os.path.join(vault_dir, 'passwords.db')
+        copy_path = os.path.join(tmp, 'copy.db')
+        repository = backup.Repository.init(os.path.join(tmp, 'repository'), 'bench passphrase')
+        rows = []
+        first = repository.backup()
+        rows.append(('full copy', *full_copy(database, copy_path)))
+        rows.append(('first snapshot', first.seconds, first.bytes_written))
+        changed = change_entries(args.change)
+        rows.append((f"full copy after {args.change}%", *full_copy(database, copy_path)))
+        second = repository.backup()
+        rows.append((f"snapshot after {args.change}%", second.seconds, second.bytes_written))
+
+        started = time.perf_counter()
+        repository.restore(second.snapshot, os.path.join(tmp, 'restored'))
+        restored = time.perf_counter() - started
+        started = time.perf_counter()
+        problems = repository.verify(second.snapshot)
+        verified = time.perf_counter() - started
+        repository.close()
+        assert not problems, problems
+
+        print(f"{args.entries} entries, {os.path.getsize(database) / 1e6:.0f} MB database, {changed} entries changed "
+              f"({second.new_chunks} of {second.chunks} pages)")
+        print(f"{'':<24}{'seconds':>9}{'MB written':>12}")
+        for label, seconds, size in rows:
+            print(f"{label:<24}{seconds:>9.2f}{size / 1e6:>12.2f}")
+        print(f"restore {restored:.2f}s, verify {verified:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
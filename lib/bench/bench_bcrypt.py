@@ -0,0 +1,40 @@
+# lib/bench/bench_bcrypt.py
+#
+# Measures login throughput with password checks run one after another on the
+# calling thread versus spread over the hashing thread pool. Run from the lib
+# directory:
+#
+#   python -m bench.bench_bcrypt --logins 64 --rounds 10
+
+import argparse
+import os
+import time
+
+import hashing
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=hashing.BCRYPT_ROUNDS)
+    args = parser.parse_args()
+
+    stored = hashing.hash_password('Abcd12345', args.rounds)
+
+    started = time.perf_counter()
+    for _ in range(args.logins):
+        hashing.check_password('Abcd12345', stored)
+    serial = time.perf_counter() - started
+
+    started = time.perf_counter()
+    futures = [hashing.submit_check('Abcd12345', stored) for _ in range(args.logins)]
+    assert all(future.result() for future in futures)
+    pooled = time.perf_counter() - started
+
+    print(f"cost {args.rounds}, {args.logins} logins, {os.cpu_count()} cores")
+    print(f"serial:      {args.logins / serial:8.1f} logins/sec")
+    print(f"thread pool: {args.logins / pooled:8.1f} logins/sec ({serial / pooled:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
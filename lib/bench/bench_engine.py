@@ -0,0 +1,101 @@
+# lib/bench/bench_engine.py
+#
+# Insert and read throughput of a stock create_engine() against the tuned
+# engine from db.database (WAL, synchronous=NORMAL, mmap and cache pragmas).
+# Run from the lib directory:
+#
+#   python -m bench.bench_engine --commits 2000 --rows 100000
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from db.database import init_db, make_engine
+from db.models import User, Password
+
+
+def row(i):
+    return {'website': f"site{i}.com", 'website_key': f"site{i}.com", 'username': f"user{i}", 'password_hash': 'x' * 120, 'user_id': 1}
+
+
+def run(engine, commits, rows, reads):
+    init_db(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(User(id=1, username='bench', password_hash=''))
+    session.commit()
+    results = {}
+
+    # One transaction per entry, the way the CLI stores passwords.
+    started = time.perf_counter()
+    for i in range(commits):
+        session.execute(insert(Password), [row(i)])
+        session.commit()
+    results['single-row commits/sec'] = commits / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for start in range(0, rows, 1000):
+        session.execute(insert(Password), [row(i) for i in range(start, min(start + 1000, rows))])
+        session.commit()
+    results['bulk rows/sec'] = rows / (time.perf_counter() - started)
+
+    total = commits + rows
+    ids = [random.randint(1, total) for _ in range(reads)]
+    started = time.perf_counter()
+    for password_id in ids:
+        session.execute(select(Password.password_hash).where(Password.id == password_id)).first()
+    results['point reads/sec'] = reads / (time.perf_counter() - started)
+
+    # Readers on other connections while a writer commits continuously.
+    stop = threading.Event()
+
+    def writer():
+        writer_session = sessionmaker(bind=engine)()
+        i = total
+        while not stop.is_set():
+            writer_session.execute(insert(Password), [row(i)])
+            writer_session.commit()
+            i += 1
+        writer_session.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    reader_session = sessionmaker(bind=engine)()
+    started = time.perf_counter()
+    for password_id in ids:
+        reader_session.execute(select(Password.password_hash).where(Password.id == password_id)).first()
+        reader_session.commit()
+    results['reads/sec during writes'] = reads / (time.perf_counter() - started)
+    stop.set()
+    thread.join()
+
+    reader_session.close()
+    session.close()
+    engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commits', type=int, default=2000)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--reads', type=int, default=10000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        default = run(create_engine(f"sqlite:///{os.path.join(tmp, 'default.db')}"), args.commits, args.rows, args.reads)
+        tuned = run(make_engine(f"sqlite:///{os.path.join(tmp, 'tuned.db')}"), args.commits, args.rows, args.reads)
+
+    print(f"{'':<26} {'default':>10} {'tuned':>10}")
+    for metric in default:
+        print(f"{metric:<26} {default[metric]:>10.0f} {tuned[metric]:>10.0f}  ({tuned[metric] / default[metric]:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
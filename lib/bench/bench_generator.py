@@ -0,0 +1,66 @@
+# lib/bench/bench_generator.py
+#
+# Compares password generation throughput of the old per-character
+# secrets.choice loop (retrying until every character class appears) with
+# the batched generator. Run from the lib directory:
+#
+#   python -m bench.bench_generator --count 100000 --length 12
+
+import argparse
+import secrets
+import string
+import time
+
+import generator
+
+
+def legacy_generate_random_password(length=12):
+    alphabet = string.ascii_letters + string.digits + string.punctuation
+    while True:
+        password = ''.join(secrets.choice(alphabet) for _ in range(length))
+        if (any(c.islower() for c in password)
+                and any(c.isupper() for c in password)
+                and any(c.isdigit() for c in password)
+                and any(c in string.punctuation for c in password)):
+            return password
+
+
+def covers_classes(password):
+    return all(any(c in char_class for c in password) for char_class in generator.DEFAULT_CLASSES)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--length', type=int, default=12)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    for _ in range(args.count):
+        legacy_generate_random_password(args.length)
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    passwords = generator.generate_passwords(args.count, args.length)
+    batched = time.perf_counter() - started
+    assert len(passwords) == args.count and all(map(covers_classes, passwords))
+
+    started = time.perf_counter()
+    for _ in range(args.count // 10):
+        generator.generate_password(args.length)
+    single = (time.perf_counter() - started) * 10
+
+    wordlist = generator.load_wordlist()
+    started = time.perf_counter()
+    generator.generate_passphrases(args.count, wordlist=wordlist)
+    phrases = time.perf_counter() - started
+
+    print(f"{args.count} passwords of length {args.length}")
+    print(f"secrets.choice loop: {args.count / legacy:12.0f} passwords/sec")
+    print(f"one at a time:       {args.count / single:12.0f} passwords/sec ({legacy / single:.1f}x)")
+    print(f"batched:             {args.count / batched:12.0f} passwords/sec ({legacy / batched:.1f}x)")
+    print(f"passphrases:         {args.count / phrases:12.0f} phrases/sec ({len(wordlist)} words)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# lib/bench/bench_ownership.py
+#
+# Per-user query latency as the shared database grows. Users are added in
+# stages (by default 100, 1,000 and 10,000 users of 1,000 entries each) and
+# after each stage a random sample of users time a first page of their
+# entries, an exact website lookup and a prefix search. With entries owned
+# through the indexed integer user id, the timings should stay flat while
+# the database grows a hundredfold. The same queries are then timed against
+# per-user shard files (ENCRYPTO_SHARD_DIR), built for the sampled users
+# only, since a shard's latency depends on nothing but its own user. Run
+# from the lib directory:
+#
+#   python -m bench.bench_ownership --stages 100 1000 10000 --entries 1000
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
+
+import crypto
+from db.database import init_db, make_engine
+from db.models import User, Password, normalize_website
+from db.shards import ShardRouter
+from search import search_passwords
+from vault import password_page
+
+WORDS = ['mail', 'bank', 'cloud', 'shop', 'news', 'video', 'social', 'games', 'travel', 'music']
+BATCH_SIZE = 20000
+
+
+def entry_rows(user_id, entries, token):
+    for i in range(entries):
+        website = f"{WORDS[i % len(WORDS)]}{i}.com"
+        yield {'website': website, 'website_key': normalize_website(website), 'username': f"me{i}",
+               'password_hash': token, 'user_id': user_id}
+
+
+def add_users(engine, first, count, entries, token):
+    """Insert users first..first+count-1 with entries each; returns their ids."""
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'username': f"user{number}", 'password_hash': ''} for number in range(first, first + count)])
+        user_ids = list(conn.scalars(select(User.id).where(User.id > first).order_by(User.id)))
+    batch = []
+    for user_id in user_ids:
+        batch.extend(entry_rows(user_id, entries, token))
+        if len(batch) >= BATCH_SIZE:
+            with engine.begin() as conn:
+                conn.execute(insert(Password), batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(insert(Password), batch)
+    return user_ids
+
+
+def measure(session_for, user_ids, entries, repeat):
+    """Median milliseconds per page, exact lookup and prefix search over user_ids."""
+    samples = {'page': [], 'lookup': [], 'prefix': []}
+    rng = random.Random(1)
+    for _ in range(repeat):
+        for user_id in user_ids:
+            session = session_for(user_id)
+            key = f"{rng.choice(WORDS)}{rng.randrange(entries)}.com"
+            for name, query in (
+                ('page', lambda: password_page(session, user_id)),
+                ('lookup', lambda: session.query(Password).filter_by(user_id=user_id, website_key=key).all()),
+                ('prefix', lambda: search_passwords(session, user_id, key[:-5], 'prefix', 10)),
+            ):
+                started = time.perf_counter()
+                query()
+                samples[name].append((time.perf_counter() - started) * 1000)
+            session.close()
+    return {name: statistics.median(values) for name, values in samples.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stages', type=int, nargs='+', default=[100, 1000, 10000], help="total users after each stage")
+    parser.add_argument('--entries', type=int, default=1000, help="entries per user")
+    parser.add_argument('--sample', type=int, default=50, help="users timed per stage")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    token = crypto.encrypt(b'benchmarkPass1').decode('utf-8')
+    print(f"{'users':>7} {'entries':>11} {'db MB':>8}  {'page ms':>8} {'lookup ms':>10} {'prefix ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'shared.db')
+        engine = make_engine(f"sqlite:///{path}")
+        init_db(engine)
+        sessions = sessionmaker(bind=engine)
+        user_ids = []
+        for total in args.stages:
+            user_ids += add_users(engine, len(user_ids), total - len(user_ids), args.entries, token)
+            with engine.connect() as conn:
+                conn.exec_driver_sql("ANALYZE")
+            sample = random.Random(total).sample(user_ids, min(args.sample, len(user_ids)))
+            result = measure(lambda user_id: sessions(), sample, args.entries, args.repeat)
+            size = os.path.getsize(path) / 1e6
+            print(f"{total:>7} {total * args.entries:>11} {size:>8.0f}  {result['page']:>8.3f} {result['lookup']:>10.3f} {result['prefix']:>10.3f}")
+        engine.dispose()
+
+        router = ShardRouter(os.path.join(tmp, 'shards'))
+        sample = user_ids[:args.sample]
+        for user_id in sample:
+            engine = router.engine_for(user_id)
+            with engine.begin() as conn:
+                conn.execute(insert(Password), list(entry_rows(user_id, args.entries, token)))
+        result = measure(router.session_for, sample, args.entries, args.repeat)
+        print(f"{'shards':>7} {args.entries:>11} {'':>8}  {result['page']:>8.3f} {result['lookup']:>10.3f} {result['prefix']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# lib/bench/bench_search.py
+#
+# Compares the old decrypt-everything scan in search_password against the
+# indexed search path. Run from the lib directory:
+#
+#   python -m bench.bench_search --sizes 1000 10000 100000
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import crypto
+from db.models import Base, User, Password, normalize_website
+from search import ensure_search_schema, search_passwords
+
+WORDS = ['mail', 'bank', 'cloud', 'shop', 'news', 'video', 'social', 'games', 'travel', 'music']
+SUFFIXES = ['.com', '.net', '.org', '.io', '.co.ke']
+
+
+def populate(session, username, size):
+    token = crypto.encrypt(b'benchmarkPass1').decode('utf-8')
+    user = User(username=username, password_hash='')
+    session.add(user)
+    session.flush()
+    rows = []
+    for i in range(size):
+        website = f"{random.choice(WORDS)}{i}{random.choice(SUFFIXES)}"
+        rows.append({
+            'website': website,
+            'website_key': normalize_website(website),
+            'username': f"user{i}@example.com",
+            'password_hash': token,
+            'user_id': user.id,
+        })
+    session.execute(insert(Password), rows)
+    session.commit()
+    return user.id
+
+
+def legacy_search(session, user_id, website):
+    website_lower = website.lower()
+    found = []
+    for password in session.query(Password).filter_by(user_id=user_id).all():
+        if website_lower in password.website.lower():
+            found.append(password.get_decrypted_password())
+    return found
+
+
+def indexed_search(session, user_id, website, mode):
+    return [password.get_decrypted_password() for password in search_passwords(session, user_id, website, mode=mode)]
+
+
+def timed(fn, queries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            fn(query)
+    return (time.perf_counter() - start) / (repeat * len(queries)) * 1000
+
+
+def run(size, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        ensure_search_schema(engine)
+        session = sessionmaker(bind=engine)()
+        user_id = populate(session, 'bench_user', size)
+
+        # Selective queries: a single entry by its number, plus a short prefix.
+        queries = [f"{random.choice(WORDS)}{random.randrange(size)}." for _ in range(5)]
+        results = {
+            'legacy scan': timed(lambda q: legacy_search(session, user_id, q), queries, repeat),
+            'substring': timed(lambda q: indexed_search(session, user_id, q, 'substring'), queries, repeat),
+            'prefix': timed(lambda q: indexed_search(session, user_id, q, 'prefix'), queries, repeat),
+            'fuzzy': timed(lambda q: indexed_search(session, user_id, q, 'fuzzy'), queries, 1),
+        }
+        session.close()
+        engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(1)
+    print(f"{'entries':>8}  {'mode':<12} {'ms/query':>10}")
+    for size in args.sizes:
+        for mode, ms in run(size, args.repeat).items():
+            print(f"{size:>8}  {mode:<12} {ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# lib/bench/bench_startup.py
+#
+# Start-up budget check. Measures the cumulative import time of cli (from
+# python -X importtime) and the wall time from launching cli.py to its first
+# prompt, and exits non-zero if either is over budget. Run from the lib
+# directory:
+#
+#   python -m bench.bench_startup
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Budgets in milliseconds. Importing SQLAlchemy or cryptography up front
+# costs several hundred, so either budget catches that regression with room
+# to spare for noisy machines.
+IMPORT_BUDGET_MS = 50
+FIRST_PROMPT_BUDGET_MS = 100
+
+
+def import_time_ms(cwd):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import cli'],
+        cwd=cwd, env=dict(os.environ, PYTHONPATH=LIB_DIR), capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| cli$', line)
+        if match:
+            return int(match.group(1)) / 1000
+    raise RuntimeError("cli missing from -X importtime output")
+
+
+def first_prompt_ms(cwd):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(LIB_DIR, 'cli.py')],
+        cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    output = ''
+    while 'Please select an option' not in output:
+        char = process.stdout.read(1)
+        if not char:
+            break
+        output += char
+    elapsed = (time.perf_counter() - started) * 1000
+    process.communicate('3\n')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        imports = min(import_time_ms(tmp) for _ in range(args.runs))
+        prompt = min(first_prompt_ms(tmp) for _ in range(args.runs))
+
+    over = False
+    for label, value, budget in [('import cli', imports, IMPORT_BUDGET_MS), ('first prompt', prompt, FIRST_PROMPT_BUDGET_MS)]:
+        status = 'ok' if value <= budget else 'OVER BUDGET'
+        over = over or value > budget
+        print(f"{label:<14} {value:7.1f} ms (budget {budget} ms) {status}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
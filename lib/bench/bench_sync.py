@@ -0,0 +1,111 @@
+# lib/bench/bench_sync.py
+#
+# Time sync.py between two copies of one user's vault. Device A starts with
+# --entries entries and B with none; the first sync copies everything. Then
+# each round both devices edit --edits entries (half of them the same
+# entries, so they conflict) and delete a few, and the devices sync in turn
+# (A, B, A) until both hold the same entries at the same versions. Rounds
+# should stay well under a second however large the vault, since only the
+# changes since the last acknowledged checkpoint travel. Run from the lib
+# directory:
+#
+#   python -m bench.bench_sync --entries 100000 --edits 100 --rounds 5
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.orm import sessionmaker
+
+import crypto
+from db.database import init_db, make_engine
+from db.models import Password, User
+from sync import FileTransport, sync_user
+
+BATCH_SIZE = 20000
+
+
+def open_device(path):
+    engine = make_engine(f"sqlite:///{path}")
+    init_db(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(username='alice', password_hash=''))
+    return engine, sessionmaker(bind=engine)()
+
+
+def fill(engine, entries):
+    token = crypto.encrypt(b'benchmarkPass1').decode('utf-8')
+    for start in range(0, entries, BATCH_SIZE):
+        with engine.begin() as conn:
+            conn.execute(insert(Password), [
+                {'website': f"site{i}.com", 'website_key': f"site{i}.com", 'username': f"me{i}", 'password_hash': token, 'user_id': 1}
+                for i in range(start, min(entries, start + BATCH_SIZE))
+            ])
+
+
+def edit(engine, sync_ids, label, deletes):
+    table = Password.__table__
+    token = crypto.encrypt(f"changed on {label}".encode('utf-8')).decode('utf-8')
+    with engine.begin() as conn:
+        conn.execute(
+            update(table).where(table.c.sync_id == bindparam('key')).values(username=bindparam('new_username'), password_hash=token),
+            [{'key': sync_id, 'new_username': f"{label}-{sync_id[:6]}"} for sync_id in sync_ids],
+        )
+        conn.execute(delete(table).where(table.c.sync_id.in_(deletes)))
+
+
+def snapshot(engine):
+    with engine.connect() as conn:
+        return set(conn.execute(select(Password.sync_id, Password.website, Password.username, Password.hlc, Password.origin)))
+
+
+def timed_sync(session, transport):
+    return sync_user(session, 1, 'bench', transport, 'bench passphrase')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--edits', type=int, default=100, help="entries edited on each device per round")
+    parser.add_argument('--deletes', type=int, default=10, help="entries deleted on each device per round")
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        transport = FileTransport(os.path.join(tmp, 'shared'))
+        engine_a, device_a = open_device(os.path.join(tmp, 'a.db'))
+        engine_b, device_b = open_device(os.path.join(tmp, 'b.db'))
+        # Both devices run in this process under user id 1, so they share one
+        # stand-in data key rather than deriving one from a password each.
+        crypto.unlock_user(1, Fernet.generate_key())
+        started = time.perf_counter()
+        fill(engine_a, args.entries)
+        print(f"Filled A with {args.entries} entries in {time.perf_counter() - started:.2f}s.")
+
+        first = timed_sync(device_a, transport)
+        second = timed_sync(device_b, transport)
+        print(f"Initial sync: A sent {first.sent} in {first.seconds:.2f}s, B applied {second.applied} in {second.seconds:.2f}s.")
+
+        print(f"{'round':>5} {'A ms':>8} {'B ms':>8} {'A ms':>8} {'sent':>6} {'applied':>8}  converged")
+        for number in range(1, args.rounds + 1):
+            live = sorted(row[0] for row in snapshot(engine_a) & snapshot(engine_b))
+            picked = rng.sample(live, 2 * args.edits + 2 * args.deletes)
+            shared = picked[:args.edits // 2]
+            edit(engine_a, shared + picked[args.edits:args.edits + args.edits // 2], 'A', picked[2 * args.edits:2 * args.edits + args.deletes])
+            edit(engine_b, shared + picked[args.edits + args.edits // 2:2 * args.edits], 'B', picked[2 * args.edits + args.deletes:])
+            runs = [timed_sync(device_a, transport), timed_sync(device_b, transport), timed_sync(device_a, transport)]
+            converged = snapshot(engine_a) == snapshot(engine_b)
+            print(f"{number:>5} " + ' '.join(f"{run.seconds * 1000:>8.1f}" for run in runs)
+                  + f" {sum(run.sent for run in runs):>6} {sum(run.applied for run in runs):>8}  {converged}")
+            assert converged, f"devices differ after round {number}"
+        device_a.close()
+        device_b.close()
+
+
+if __name__ == '__main__':
+    main()
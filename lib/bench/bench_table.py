@@ -0,0 +1,86 @@
+# lib/bench/bench_table.py
+#
+# Time listing --rows entries with table.TableRenderer against Texttable,
+# which the app drew its listings with before. Texttable is timed both as
+# a single draw() and the way classes/display_table.py used to call it,
+# redrawing after every added row (only up to --redraw-rows, as it grows
+# quadratically). Output goes to an in-memory buffer, so the numbers are
+# rendering cost alone. Run from the lib directory:
+#
+#   python -m bench.bench_table --rows 10000
+
+import argparse
+import io
+import random
+import time
+
+from texttable import Texttable
+
+from table import FORMATS, TableRenderer
+
+HEADERS = ['#', 'Website', 'Username', 'Password']
+WORDS = ['mail', 'bank', 'cloud', 'shop', 'news', 'video', 'social', 'games', 'travel', 'music']
+
+
+def make_rows(count, seed=1):
+    rng = random.Random(seed)
+    return [[number, f"{rng.choice(WORDS)}{rng.randrange(10 ** rng.randrange(1, 8))}.example.com",
+             f"user{rng.randrange(1000)}@mail.com", '********'] for number in range(1, count + 1)]
+
+
+def texttable_once(rows):
+    table = Texttable()
+    table.header(HEADERS)
+    for row in rows:
+        table.add_row(row)
+    return table.draw()
+
+
+def texttable_per_row(rows):
+    table = Texttable()
+    table.header(HEADERS)
+    out = io.StringIO()
+    for row in rows:
+        table.add_row(row)
+        out.write(table.draw())
+    return out.getvalue()
+
+
+def renderer(fmt):
+    def render(rows):
+        out = io.StringIO()
+        TableRenderer(HEADERS, out, fmt).render(rows)
+        return out.getvalue()
+    return render
+
+
+def best_of(function, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--redraw-rows', type=int, default=200, help="rows for the redraw-per-row Texttable case")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    baseline = best_of(texttable_once, rows, args.repeat)
+    print(f"{args.rows} rows")
+    print(f"{'renderer':<28}{'ms':>10}{'speed-up':>10}")
+    print(f"{'Texttable draw()':<28}{baseline * 1000:>10.1f}{1:>9.1f}x")
+    for fmt in FORMATS:
+        seconds = best_of(renderer(fmt), rows, args.repeat)
+        print(f"{'TableRenderer ' + fmt:<28}{seconds * 1000:>10.1f}{baseline / seconds:>9.1f}x")
+    redraw = best_of(texttable_per_row, rows[:args.redraw_rows], 1)
+    print(f"{args.redraw_rows} rows, Texttable redrawn per row: {redraw * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
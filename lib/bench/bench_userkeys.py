@@ -0,0 +1,87 @@
+# lib/bench/bench_userkeys.py
+#
+# Measure what per-user data keys cost. Login is timed as the bcrypt check
+# plus unwrapping the data key, for each --kdf spec. Decrypting --entries
+# entries is timed three ways: with the user's cipher from the key cache,
+# with the shared key.key keyring as before, and deriving the key again for
+# every entry, which is what the cache saves. Run from the lib directory:
+#
+#   python -m bench.bench_userkeys --entries 2000
+
+import argparse
+import os
+import statistics
+import time
+
+from cryptography.fernet import Fernet
+
+import crypto
+import hashing
+import userkeys
+from cache import key_cache
+
+KDFS = ['scrypt:n=16384,r=8,p=1', 'scrypt:n=32768,r=8,p=1', 'scrypt:n=131072,r=8,p=1']
+PASSWORD = 'Abcd12345'
+USER_ID = 1
+
+
+class Account:
+    """Just the columns userkeys and bcrypt need, so no database is involved."""
+
+    def __init__(self, spec):
+        self.id = USER_ID
+        self.password_hash = hashing.hash_password(PASSWORD)
+        for column, value in userkeys.wrap_key(Fernet.generate_key(), PASSWORD, spec).items():
+            setattr(self, column, value)
+
+
+def time_login(spec, samples):
+    account = Account(spec)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hashing.check_password(PASSWORD, account.password_hash)
+        crypto.unlock_user(account.id, userkeys.unwrap_key(account, PASSWORD))
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def per_entry(function, tokens):
+    started = time.perf_counter()
+    for token in tokens:
+        function(token)
+    return (time.perf_counter() - started) / len(tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--samples', type=int, default=5, help="logins timed per KDF spec")
+    parser.add_argument('--derive-entries', type=int, default=20, help="entries for the derive-per-decrypt case")
+    parser.add_argument('--kdf', nargs='+', default=KDFS)
+    args = parser.parse_args()
+
+    print(f"bcrypt cost {hashing.BCRYPT_ROUNDS}")
+    print(f"{'login':<32}{'median ms':>10}")
+    for spec in args.kdf:
+        print(f"{spec:<32}{time_login(spec, args.samples) * 1000:>10.1f}")
+
+    account = Account(userkeys.KDF)
+    data_key = userkeys.unwrap_key(account, PASSWORD)
+    crypto.unlock_user(USER_ID, data_key)
+    secrets = [os.urandom(12).hex().encode() for _ in range(args.entries)]
+    user_tokens = [crypto.encrypt_for(USER_ID, secret) for secret in secrets]
+    keyring_tokens = [crypto.encrypt(secret) for secret in secrets]
+
+    def derive_each(token):
+        return Fernet(userkeys.unwrap_key(account, PASSWORD)).decrypt(token)
+
+    print(f"\n{'decrypt':<32}{'us/entry':>10}")
+    print(f"{'cached user key':<32}{per_entry(lambda token: crypto.decrypt_for(USER_ID, token), user_tokens) * 1e6:>10.1f}")
+    print(f"{'shared keyring':<32}{per_entry(crypto.decrypt, keyring_tokens) * 1e6:>10.1f}")
+    print(f"{'derive per decrypt':<32}{per_entry(derive_each, user_tokens[:args.derive_entries]) * 1e6:>10.1f}")
+    key_cache.clear()
+
+
+if __name__ == '__main__':
+    main()
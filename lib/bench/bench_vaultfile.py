@@ -0,0 +1,96 @@
+# lib/bench/bench_vaultfile.py
+#
+# Compares the single-file vault with the SQLite + Fernet store: size on
+# disk, time to open, and latency of lookups by id and by website (each
+# including decryption). Builds a synthetic vault with bench.synth and
+# converts it. Run from the lib directory:
+#
+#   python -m bench.bench_vaultfile --entries 100000 --users 100 --lookups 2000
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from bench.synth import synthesize
+
+
+def timed(fn, items):
+    samples = []
+    for item in items:
+        started = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples), sorted(samples)[int(len(samples) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthesize(tmp, args.entries, args.users, report=lambda message: None)
+
+        import crypto
+        import vaultfile
+        from db.database import Session
+        from db.models import Password, User, normalize_website
+
+        vault_path = os.path.join(tmp, 'passwords.vault')
+        with Session() as session:
+            started = time.perf_counter()
+            vaultfile.from_sqlite(session, vault_path, 'master password').close()
+            converted = time.perf_counter() - started
+            session.connection().exec_driver_sql("VACUUM")
+            rows = session.query(Password.id, Password.user_id, User.username.label('owner'), Password.website).join(User).all()
+
+        rng = random.Random(0)
+        picks = [rng.choice(rows) for _ in range(args.lookups)]
+        cipher = crypto.get_cipher()
+
+        def sqlite_by_id(row):
+            password = session.get(Password, row.id)
+            cipher.decrypt(password.password_hash.encode('utf-8'))
+
+        def sqlite_by_website(row):
+            for password in session.query(Password).filter_by(user_id=row.user_id, website_key=normalize_website(row.website)):
+                cipher.decrypt(password.password_hash.encode('utf-8'))
+
+        session = Session()
+        started = time.perf_counter()
+        session.get(Password, picks[0].id)
+        sqlite_open = time.perf_counter() - started
+        sqlite_results = timed(sqlite_by_id, picks), timed(sqlite_by_website, picks)
+        session.close()
+
+        started = time.perf_counter()
+        vault = vaultfile.VaultFile.open(vault_path, 'master password')
+        vault_open = time.perf_counter() - started
+        vault_results = (timed(lambda row: vault.get(row.id), picks),
+                         timed(lambda row: vault.find(row.owner, row.website), picks))
+        vault.close()
+
+        # The database runs in WAL mode, so VACUUM's output sits in the -wal
+        # file until a checkpoint copies it back. Count whatever is left there.
+        with Session() as session:
+            session.connection().exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        database_path = os.path.join(tmp, 'passwords.db')
+        sqlite_size = sum(os.path.getsize(path) for path in (database_path, database_path + '-wal') if os.path.exists(path))
+        vault_size = os.path.getsize(vault_path)
+        print(f"{args.entries} entries, {args.users} users (converted in {converted:.1f}s)")
+        print(f"{'':<22}{'size MB':>9}{'open ms':>10}{'by id us':>11}{'p99':>8}{'by site us':>12}{'p99':>8}")
+        for name, size, opened, ((id_median, id_p99), (site_median, site_p99)) in (
+            ('SQLite + Fernet', sqlite_size, sqlite_open, sqlite_results),
+            ('vault file', vault_size, vault_open, vault_results),
+        ):
+            print(f"{name:<22}{size / 1e6:>9.1f}{opened * 1000:>10.1f}{id_median:>11.1f}{id_p99:>8.1f}{site_median:>12.1f}{site_p99:>8.1f}")
+        print("vault file open time includes deriving the key with scrypt")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# lib/bench/bench_writes.py
+#
+# Wall time and commits (journal syncs) per 1k password mutations: one
+# commit per change, as the CLI screens used to do, against a WriteBatch,
+# plus a username change that rewrites every entry's owner, as renames did
+# while entries referenced the username, against rename_user. Run from the
+# lib directory:
+#
+#   python -m bench.bench_writes --mutations 1000
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+from sqlalchemy import event, update
+from sqlalchemy.orm import sessionmaker
+
+import crypto
+from db.database import SQLITE_PRAGMAS, init_db, make_engine
+from db.models import User, Password
+from vault import WriteBatch, rename_user
+
+
+def setup(path, mutations):
+    engine = make_engine(f"sqlite:///{path}")
+    init_db(engine)
+    counter = {'commits': 0}
+    event.listen(engine, 'commit', lambda conn: counter.__setitem__('commits', counter['commits'] + 1))
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    user = User(username='bench', password_hash='')
+    session.add(user)
+    session.commit()
+    # The bench user has no password to derive a data key from; use a stand-in.
+    crypto.unlock_user(user.id, Fernet.generate_key())
+    with WriteBatch(session) as batch:
+        for i in range(mutations):
+            batch.create(user.id, f"site{i}.com", f"user{i}", f"pw{i}")
+    counter['commits'] = 0
+    return engine, session, user, counter
+
+
+def plan(session, mutations):
+    ids = [password_id for (password_id,) in session.query(Password.id)]
+    random.shuffle(ids)
+    changes = []
+    for i in range(mutations):
+        kind = ('create', 'update', 'delete')[i % 3]
+        changes.append((kind, ids.pop() if kind != 'create' else None, i))
+    return changes
+
+
+def per_commit(session, user_id, changes):
+    for kind, entry_id, i in changes:
+        if kind == 'create':
+            password = Password(website=f"new{i}.com", username='me', user_id=user_id)
+            password.set_password(f"new{i}")
+            session.add(password)
+        elif kind == 'update':
+            session.get(Password, entry_id).set_password(f"changed{i}")
+        else:
+            session.delete(session.get(Password, entry_id))
+        session.commit()
+
+
+def batched(session, user_id, changes):
+    with WriteBatch(session) as batch:
+        for kind, entry_id, i in changes:
+            if kind == 'create':
+                batch.create(user_id, f"new{i}.com", 'me', f"new{i}")
+            elif kind == 'update':
+                batch.update_password(user_id, entry_id, f"changed{i}")
+            else:
+                batch.delete(user_id, entry_id)
+
+
+def legacy_rename(session, user, new_username):
+    user.username = new_username
+    session.commit()
+    for (password_id,) in session.query(Password.id).filter_by(user_id=user.id).all():
+        session.execute(update(Password).where(Password.id == password_id).values(user_id=user.id))
+    session.commit()
+
+
+def measure(label, mutations, fn):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, session, user, counter = setup(os.path.join(tmp, 'bench.db'), mutations)
+        started = time.perf_counter()
+        fn(session, user)
+        elapsed = time.perf_counter() - started
+        session.close()
+        engine.dispose()
+    print(f"{label:<28} {elapsed * 1000:>10.1f} {counter['commits']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mutations', type=int, default=1000)
+    parser.add_argument('--synchronous', default=SQLITE_PRAGMAS['synchronous'], help="SQLite synchronous pragma, e.g. FULL to make every commit fsync")
+    args = parser.parse_args()
+    SQLITE_PRAGMAS['synchronous'] = args.synchronous
+
+    random.seed(1)
+    print(f"{args.mutations} mutations, synchronous={args.synchronous}")
+    print(f"{'':<28} {'ms':>10} {'commits':>8}")
+    measure('commit per mutation', args.mutations, lambda session, user: per_commit(session, user.id, plan(session, args.mutations)))
+    measure('WriteBatch', args.mutations, lambda session, user: batched(session, user.id, plan(session, args.mutations)))
+    measure('rename, row by row', args.mutations, lambda session, user: legacy_rename(session, user, 'renamed'))
+    measure('rename_user', args.mutations, lambda session, user: rename_user(session, user, 'renamed'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# lib/bench/load_service.py
+#
+# Load test for the asyncio VaultService: many concurrent clients, each with
+# its own account, run a mix of create/get/list/search/update/delete against
+# one SQLite database. Reports ops/sec and latency percentiles per operation.
+# Run from the lib directory:
+#
+#   python -m bench.load_service --clients 50 --ops 200
+
+import argparse
+import asyncio
+import collections
+import os
+import random
+import tempfile
+import time
+
+import hashing
+from service import VaultService
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def client(service, number, ops, latencies):
+    username = f"client{number}"
+    await service.sign_up(username, 'Abcd12345')
+    user_id = await service.authenticate(username, 'Abcd12345')
+    ids = []
+    rng = random.Random(number)
+    for i in range(ops):
+        operation = rng.choices(['create', 'get', 'list', 'search', 'update', 'delete'], [30, 25, 15, 15, 10, 5])[0]
+        if operation != 'create' and not ids:
+            operation = 'create'
+        started = time.perf_counter()
+        if operation == 'create':
+            ids.append(await service.create_password(user_id, f"site{number}-{i}.com", f"me{i}", f"pw{i}"))
+        elif operation == 'get':
+            await service.get_password(user_id, rng.choice(ids))
+        elif operation == 'list':
+            await service.list_passwords(user_id)
+        elif operation == 'search':
+            await service.search_passwords(user_id, f"site{number}-{rng.randrange(i + 1)}")
+        elif operation == 'update':
+            await service.update_password(user_id, rng.choice(ids), password=f"new{i}")
+        else:
+            await service.delete_password(user_id, ids.pop(rng.randrange(len(ids))))
+        latencies[operation].append(time.perf_counter() - started)
+
+
+async def run(clients, ops):
+    with tempfile.TemporaryDirectory() as tmp:
+        service = await VaultService.create(f"sqlite:///{os.path.join(tmp, 'load.db')}")
+        latencies = collections.defaultdict(list)
+        started = time.perf_counter()
+        await asyncio.gather(*(client(service, number, ops, latencies) for number in range(clients)))
+        elapsed = time.perf_counter() - started
+        await service.close()
+
+    total = sum(len(samples) for samples in latencies.values())
+    everything = [sample for samples in latencies.values() for sample in samples]
+    print(f"{clients} clients x {ops} ops: {total / elapsed:.0f} ops/sec, p50 {percentile(everything, 0.5) * 1000:.1f} ms, p99 {percentile(everything, 0.99) * 1000:.1f} ms")
+    print(f"{'operation':<10} {'count':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for operation, samples in sorted(latencies.items()):
+        print(f"{operation:<10} {len(samples):>7} {percentile(samples, 0.5) * 1000:>8.1f} {percentile(samples, 0.99) * 1000:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--ops', type=int, default=200)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help="cost for the test accounts; sign-up is not what is measured")
+    args = parser.parse_args()
+    hashing.BCRYPT_ROUNDS = args.bcrypt_rounds
+    asyncio.run(run(args.clients, args.ops))
+
+
+if __name__ == '__main__':
+    main()
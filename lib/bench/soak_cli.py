@@ -0,0 +1,96 @@
+# lib/bench/soak_cli.py
+#
+# Replays a long scripted session through the CLI screens (create, view,
+# search, edit, delete, help, invalid input, in rotation) and checks that
+# stack depth and traced memory stay flat. Exits non-zero if either grows.
+# Run from the lib directory:
+#
+#   python -m bench.soak_cli --actions 100000
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cli
+import hashing
+from db.database import Session, init_db, make_engine
+
+
+def cycle(i):
+    """Menu-level actions for one round, as the answers to each prompt."""
+    website = f"site{i}.com"
+    return [
+        ['1', website, 'me', '2', f"pw{i}", ''],
+        ['2', '1', 'q', '', '7'],
+        ['2', '4', website, '1', '', '7'],
+        ['2', '2', website, f"new{i}", '', '7'],
+        ['2', '3', website, '', '7'],
+        ['0', ''],
+        ['9'],
+    ]
+
+
+def script(actions, samples, sample_every):
+    yield from ['1', 'soak_user', 'Abcd12345', 'Abcd12345', '2', 'soak_user', 'Abcd12345']
+    done = 0
+    i = 0
+    while done < actions:
+        for answers in cycle(i):
+            yield from answers
+            done += 1
+            if done % sample_every == 0:
+                depth = 0
+                frame = sys._getframe()
+                while frame:
+                    depth += 1
+                    frame = frame.f_back
+                samples.append((done, depth, tracemalloc.get_traced_memory()[0]))
+            if done >= actions:
+                break
+        i += 1
+    yield '5'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--actions', type=int, default=100000)
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--max-growth-kb', type=int, default=512, help="allowed traced memory growth after warm-up")
+    args = parser.parse_args()
+    hashing.BCRYPT_ROUNDS = 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'soak.db')}")
+        init_db(engine)
+        Session.configure(bind=engine)
+        cli.session = Session()
+
+        samples = []
+        tracemalloc.start()
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            cli.run_script(script(args.actions, samples, max(1, args.actions // args.samples)))
+        elapsed = time.perf_counter() - started
+        tracemalloc.stop()
+        cli.session.close()
+        engine.dispose()
+
+    print(f"{args.actions} actions in {elapsed:.1f}s")
+    print(f"{'action':>8} {'stack':>6} {'traced KiB':>11}")
+    for done, depth, traced in samples:
+        print(f"{done:>8} {depth:>6} {traced / 1024:>11.0f}")
+
+    depths = {depth for _, depth, _ in samples}
+    baseline = samples[len(samples) // 4][2]
+    growth = (samples[-1][2] - baseline) / 1024
+    print(f"stack depths seen: {sorted(depths)}, memory growth after warm-up: {growth:.0f} KiB")
+    if len(depths) > 1 or growth > args.max_growth_kb:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
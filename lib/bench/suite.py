@@ -0,0 +1,197 @@
+# lib/bench/suite.py
+#
+# End-to-end benchmark suite. For each vault size it synthesizes a vault
+# with bench.synth (cached between runs), copies it, and times sign-up,
+# login, create, view, search, edit, delete and username change by driving
+# the CLI screens through cli.run_script. Each size runs in a fresh process
+# so nothing is shared between them. Results go to a JSON file tagged with
+# the git commit; compare two result files to spot regressions. Run from
+# the lib directory:
+#
+#   python -m bench.suite run --sizes 1000 10000 --output results.json
+#   python -m bench.suite compare base.json results.json --threshold 10
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'encrypto-bench')
+VAULT_FILES = ('passwords.db', 'key.key', 'vault.json')
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=LIB_DIR, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'median_ms': statistics.median(samples),
+        'mean_ms': statistics.mean(samples),
+        'min_ms': samples[0],
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+def run_operations(repeat):
+    """Time each operation repeat times in the vault in the current directory."""
+    import cli
+    from cache import decryption_cache
+    from db.models import User
+
+    with open('vault.json') as file:
+        vault = json.load(file)
+    password = vault['password']
+    websites = vault['sample_websites']
+    session = cli.db_session()
+    user = session.query(User).filter_by(username=vault['usernames'][0]).one()
+
+    def scripted(screen, *args):
+        return lambda i: cli.run_script(args[-1](i), screen, *args[:-1])
+
+    operations = [
+        ('sign_up', scripted(cli.sign_up, lambda i: [f"bench_new_{i}", password, password])),
+        ('login', scripted(cli.login, lambda i: [user.username, password])),
+        ('create', scripted(cli.create_password, user, lambda i: [f"bench{i}.example", 'me', '2', 'Pw12345678', ''])),
+        ('view', scripted(cli.view_passwords, user, lambda i: ['a', 'q', ''])),
+        ('search', scripted(cli.search_password, user, lambda i: [websites[i % len(websites)][:6], '1', ''])),
+        ('search_fuzzy', scripted(cli.search_password, user, lambda i: [websites[i % len(websites)], '3', ''])),
+        ('edit', scripted(cli.edit_password, user, lambda i: [f"bench{i}.example", 'Pw87654321', ''])),
+        ('delete', scripted(cli.delete_password, user, lambda i: [f"bench{i}.example", ''])),
+        ('rename', scripted(cli.edit_username, user, lambda i: [f"bench_rename_{i}", ''])),
+    ]
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, operation in operations:
+            samples = []
+            for i in range(repeat):
+                # Measure each run without earlier runs' decryptions cached.
+                decryption_cache.clear()
+                started = time.perf_counter()
+                operation(i)
+                samples.append((time.perf_counter() - started) * 1000)
+            results[name] = summarize(samples)
+    return results
+
+
+def ensure_vault(entries, users, seed):
+    import hashing
+
+    # Keyed by bcrypt cost too, or the first login would pay for a rehash.
+    directory = os.path.join(CACHE_DIR, f"vault-{entries}-{users}-s{seed}-r{hashing.BCRYPT_ROUNDS}")
+    if not os.path.exists(os.path.join(directory, 'vault.json')):
+        shutil.rmtree(directory, ignore_errors=True)
+        print(f"synthesizing {entries} entries for {users} users in {directory}", file=sys.stderr)
+        subprocess.run([sys.executable, '-m', 'bench.synth', '--dir', directory, '--entries', str(entries),
+                        '--users', str(users), '--seed', str(seed)], cwd=LIB_DIR, check=True, stdout=sys.stderr)
+    return directory
+
+
+def run_size(entries, users, seed, repeat):
+    source = ensure_vault(entries, users, seed)
+    with tempfile.TemporaryDirectory() as work:
+        # The operations write to the vault, so work on a copy.
+        for name in VAULT_FILES:
+            shutil.copy(os.path.join(source, name), work)
+        env = dict(os.environ, PYTHONPATH=LIB_DIR, DATABASE_URL=f"sqlite:///{os.path.join(work, 'passwords.db')}")
+        result = subprocess.run([sys.executable, '-m', 'bench.suite', 'worker', '--repeat', str(repeat)],
+                                cwd=work, env=env, capture_output=True, text=True)
+        if result.returncode:
+            sys.exit(result.stderr)
+        return json.loads(result.stdout.splitlines()[-1])
+
+
+def compare(base, new, threshold, min_ms=0.5):
+    """Print the change in median per operation; return the regressions beyond threshold percent.
+
+    Slowdowns smaller than min_ms are ignored, since sub-millisecond
+    operations swing by more than any sensible threshold between runs.
+    """
+    regressions = []
+    print(f"{'size':>9}  {'operation':<14}{'base ms':>11}{'new ms':>11}{'change':>9}")
+    for size, operations in new['sizes'].items():
+        for name, stats in operations['operations'].items():
+            before = base['sizes'].get(size, {}).get('operations', {}).get(name)
+            if before is None:
+                continue
+            change = (stats['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+            flag = ''
+            if change > threshold and stats['median_ms'] - before['median_ms'] > min_ms:
+                flag = '  REGRESSION'
+                regressions.append((size, name, change))
+            print(f"{size:>9}  {name:<14}{before['median_ms']:>11.2f}{stats['median_ms']:>11.2f}{change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    run_parser.add_argument('--users', type=int, default=None, help="users per vault (default: one per 1000 entries, at least 10)")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--repeat', type=int, default=20)
+    run_parser.add_argument('--output', default=None, help="results file (default bench-<commit>.json)")
+    run_parser.add_argument('--baseline', default=None, help="results file to compare against when done")
+    run_parser.add_argument('--threshold', type=float, default=10.0)
+    run_parser.add_argument('--min-ms', type=float, default=0.5)
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help="percent slowdown in median counted as a regression")
+    compare_parser.add_argument('--min-ms', type=float, default=0.5, help="ignore slowdowns smaller than this")
+    worker_parser = commands.add_parser('worker')
+    worker_parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        print(json.dumps(run_operations(args.repeat)))
+        return
+    if args.command == 'compare':
+        with open(args.base) as base, open(args.new) as new:
+            regressions = compare(json.load(base), json.load(new), args.threshold, args.min_ms)
+        sys.exit(1 if regressions else 0)
+
+    import hashing
+
+    results = dict(git_revision())
+    results.update({
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'bcrypt_rounds': hashing.BCRYPT_ROUNDS,
+        'repeat': args.repeat,
+        'sizes': {},
+    })
+    for entries in args.sizes:
+        users = args.users or max(10, entries // 1000)
+        operations = run_size(entries, users, args.seed, args.repeat)
+        results['sizes'][str(entries)] = {'users': users, 'operations': operations}
+        for name, stats in operations.items():
+            print(f"{entries:>9}  {name:<14} median {stats['median_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms")
+
+    output = args.output or f"bench-{(results['commit'] or 'unknown')[:10]}.json"
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {output}")
+    if args.baseline:
+        with open(args.baseline) as base:
+            regressions = compare(json.load(base), results, args.threshold, args.min_ms)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
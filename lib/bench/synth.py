@@ -0,0 +1,118 @@
+# lib/bench/synth.py
+#
+# Synthesizes a vault with Faker: --users accounts sharing one password and
+# entries spread evenly across them, encrypted in a process pool and bulk
+# inserted. The same --seed always gives the same users, websites and
+# account names. Writes passwords.db, key.key and vault.json (the
+# usernames, password and a few known websites) into --dir. Run from the
+# lib directory:
+#
+#   python -m bench.synth --dir /tmp/vault-100k --entries 100000 --users 100
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+PASSWORD = 'Abcd12345'
+POOL_SIZE = 5000
+BATCH_SIZE = 5000
+
+
+def fake_pools(seed, pool_size=POOL_SIZE):
+    # Faker is slow per call, so build pools once and combine them at random.
+    from faker import Faker
+
+    fake = Faker('en_US')
+    fake.seed_instance(seed)
+    websites = [fake.domain_name() for _ in range(pool_size)]
+    accounts = [fake.email() if i % 2 else fake.user_name() for i in range(pool_size)]
+    return websites, accounts, fake.user_name
+
+
+def synthesize(directory, entries, users, seed=0, workers=None, report=print):
+    """Build the vault in directory (created if missing) and return its description."""
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'passwords.db')}"
+
+    from sqlalchemy import insert
+
+    import generator
+    import hashing
+    from db.database import Session, init_db
+    from db.models import Password, User, normalize_website
+    from vault_io import _encrypt_batch, _init_worker
+    from workers import chunks, ordered_pool_map
+    import crypto
+
+    init_db()
+    session = Session()
+    websites, accounts, fake_username = fake_pools(seed)
+    rng = random.Random(seed)
+    # Kept to the characters and length cli.validate_username allows.
+    usernames = [f"{fake_username()[:12].replace('.', '_')}_{number}" for number in range(users)]
+    password_hash = hashing.hash_password(PASSWORD)
+    session.execute(insert(User), [{'username': username, 'password_hash': password_hash} for username in usernames])
+    session.commit()
+    user_ids = dict(session.query(User.username, User.id))
+
+    def records():
+        per_user, extra = divmod(entries, users)
+        for number, username in enumerate(usernames):
+            count = per_user + (number < extra)
+            for offset in range(0, count, BATCH_SIZE):
+                size = min(BATCH_SIZE, count - offset)
+                for secret in generator.generate_passwords(size, 16):
+                    yield {'user_id': user_ids[username], 'website': rng.choice(websites), 'username': rng.choice(accounts), 'password': secret}
+
+    started = time.perf_counter()
+    rows = 0
+    batches = ordered_pool_map(_encrypt_batch, chunks(records(), BATCH_SIZE), workers, _init_worker, (crypto.get_keys(),))
+    for batch in batches:
+        session.execute(insert(Password), [
+            {
+                'website': record['website'],
+                'website_key': normalize_website(record['website']),
+                'username': record['username'],
+                'password_hash': token,
+                'user_id': record['user_id'],
+            }
+            for record, token in batch
+        ])
+        session.commit()
+        rows += len(batch)
+        if rows % (BATCH_SIZE * 20) == 0:
+            report(f"{rows}/{entries} entries")
+
+    sample = [website for website, in session.query(Password.website).filter_by(user_id=user_ids[usernames[0]]).limit(5)]
+    session.close()
+    description = {
+        'entries': entries, 'users': users, 'seed': seed, 'password': PASSWORD,
+        'bcrypt_rounds': hashing.BCRYPT_ROUNDS, 'usernames': usernames, 'sample_websites': sample,
+        'build_seconds': time.perf_counter() - started,
+    }
+    with open(os.path.join(directory, 'vault.json'), 'w') as file:
+        json.dump(description, file, indent=2)
+    return description
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', required=True)
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.dir, 'passwords.db')):
+        sys.exit(f"{args.dir} already holds a vault")
+    description = synthesize(os.path.abspath(args.dir), args.entries, args.users, args.seed, args.workers)
+    print(f"{description['entries']} entries for {description['users']} users in {description['build_seconds']:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
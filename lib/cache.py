@@ -0,0 +1,151 @@
+import atexit
+import collections
+import os
+import threading
+import time
+
+MAX_SIZE = 1024
+TTL = 300
+# Unlocked data keys: at most KEY_CACHE_SIZE users, each dropped KEY_TTL
+# seconds after its last use.
+KEY_CACHE_SIZE = int(os.environ.get('ENCRYPTO_KEY_CACHE_SIZE', 64))
+KEY_TTL = int(os.environ.get('ENCRYPTO_KEY_TTL', 900))
+
+
+class DecryptionCache:
+    """LRU + TTL cache of decrypted passwords, keyed by (entry id, token).
+
+    Plaintexts are held in bytearrays and overwritten with zeros when they
+    leave the cache. Values handed back to callers are ordinary str copies,
+    which Python cannot wipe, so this limits exposure rather than ending it.
+    """
+
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, entry_id, password_hash):
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_hash, expires_at, plaintext = entry
+            if cached_hash != password_hash or expires_at <= self.clock():
+                self._evict(entry_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return plaintext.decode('utf-8')
+
+    def put(self, entry_id, password_hash, plaintext):
+        if entry_id is None or self.max_size <= 0:
+            return
+        with self._lock:
+            if entry_id in self._entries:
+                self._evict(entry_id)
+            self._entries[entry_id] = (password_hash, self.clock() + self.ttl, bytearray(plaintext.encode('utf-8')))
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+
+    def invalidate(self, entry_id):
+        with self._lock:
+            if entry_id in self._entries:
+                self._evict(entry_id)
+
+    def clear(self):
+        with self._lock:
+            for entry_id in list(self._entries):
+                self._evict(entry_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _evict(self, entry_id):
+        _, _, plaintext = self._entries.pop(entry_id)
+        plaintext[:] = bytes(len(plaintext))
+        self.evictions += 1
+
+
+class KeyLocked(Exception):
+    """A user's entries were needed while their data key was not unlocked."""
+
+
+class KeyCache:
+    """LRU + TTL cache of unlocked per-user data keys, keyed by user id.
+
+    Each use pushes a key's expiry back, so it stays unlocked while its user
+    is active. Keys are held in bytearrays and zeroed when they leave the
+    cache; the ciphers built from them keep copies Python cannot wipe.
+    """
+
+    def __init__(self, max_size=KEY_CACHE_SIZE, ttl=KEY_TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            self._evict(user_id)
+            return None
+        entry[0] = self.clock() + self.ttl
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def cipher(self, user_id):
+        with self._lock:
+            entry = self._live(user_id)
+            return entry[2] if entry else None
+
+    def key(self, user_id):
+        with self._lock:
+            entry = self._live(user_id)
+            return bytes(entry[1]) if entry else None
+
+    def put(self, user_id, key, cipher):
+        with self._lock:
+            if user_id in self._entries:
+                self._evict(user_id)
+            self._entries[user_id] = [self.clock() + self.ttl, bytearray(key), cipher]
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if user_id in self._entries:
+                self._evict(user_id)
+
+    def clear(self):
+        with self._lock:
+            for user_id in list(self._entries):
+                self._evict(user_id)
+
+    def _evict(self, user_id):
+        _, key, _ = self._entries.pop(user_id)
+        key[:] = bytes(len(key))
+
+
+decryption_cache = DecryptionCache()
+key_cache = KeyCache()
+atexit.register(decryption_cache.clear)
+atexit.register(key_cache.clear)
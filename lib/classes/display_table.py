@@ -1,31 +1,56 @@
-from sqlalchemy import (create_engine, Column, Integer, String)
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker
-from texttable import Texttable
-
-Base = declarative_base()
-
-class DisplayTable(Base):
-
-    __tablename__ = 'passwords'
-
-    id = Column(Integer, primary_key=True)
-    username = Column(String)
-    password = Column(String)
-
+import argparse
+import getpass
+import os
+import sys
+
+from db import shards
+from db.database import Session, init_db
+from db.models import User
+from table import FORMATS, render_table
+from userkeys import unlock
+from vault import MASK, iter_password_pages
+
+# Lists a user's entries in one go, for vaults too big to page through in
+# the app. Rows are printed as they are read, so output starts at once and
+# can be piped: --format tsv or jsonl for other programs. Passwords are
+# masked unless --reveal is given. Run from the lib directory:
+#
+#   python -m classes.display_table --user alice --format tsv | cut -f2
+
+PAGE_SIZE = 1000
+HEADERS = ['Website', 'Username', 'Password']
+
+
+def entry_rows(session, user_id, reveal=False):
+    for page in iter_password_pages(session, user_id, PAGE_SIZE):
+        for password in page:
+            yield [password.website, password.username, password.get_decrypted_password() if reveal else MASK]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List a user's stored passwords.")
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--format', choices=FORMATS, default='table')
+    parser.add_argument('--reveal', action='store_true', help="show passwords instead of masking them")
+    args = parser.parse_args()
+
+    init_db()
+    session = Session()
+    user = session.query(User).filter_by(username=args.user).first()
+    # getpass prompts on the terminal, not stdout, so piped output holds only
+    # the listing.
+    password = getpass.getpass("Password: ")
+    if not user or not user.check_password(password):
+        parser.exit(1, "Invalid username or password.\n")
+    entries = shards.open_session(user.id)
+    unlock(session, user, password, entries)
+    try:
+        render_table(HEADERS, entry_rows(entries, user.id, args.reveal), fmt=args.format)
+    except BrokenPipeError:
+        # The reader (head, less) stopped early; keep the interpreter from
+        # failing again when it flushes stdout on exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
 
-    def __repr__(self):
-        return f"Password(id={self.id}, username='{self.username}', password='{self.password}')"
 
 if __name__ == '__main__':
-
-    engine = create_engine('sqlite:///passwords.db')
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    data = session.query(DisplayTable).all()
-    textTable = Texttable()
-    textTable.header(['Username', 'Password'])
-    for datum in data:
-        textTable.add_row([datum.username, datum.password])
-        print(textTable.draw())
+    main()
@@ -1,72 +1,105 @@
-from sqlalchemy import Column, String, Integer, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, relationship, Session
-import bcrypt
+import importlib
 import re
-import pwinput
-from cryptography.fernet import Fernet
-from texttable import Texttable
-import string
-import secrets
-
-Base = declarative_base()
-
-# Generate the key only once and store it in a file
-try:
-    with open('key.key', 'rb') as key_file:
-        key = key_file.read()
-except FileNotFoundError:
-    key = Fernet.generate_key()
-    with open('key.key', 'wb') as key_file:
-        key_file.write(key)
-
-cipher_suite = Fernet(key)
-
-class User(Base):
-    __tablename__ = 'users'
-    username = Column(String, primary_key=True)
-    password_hash = Column(String)
-
-    def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-    def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
-
-class Password(Base):
-    __tablename__ = 'passwords'
-    id = Column(Integer, primary_key=True)
-    website = Column(String)
-    username = Column(String)
-    password_hash = Column(String)
-    user_id = Column(String, ForeignKey('users.username'))
-    user = relationship("User", backref="passwords")
-
-    def set_password(self, password):
-        encrypted_password = cipher_suite.encrypt(password.encode('utf-8'))
-        self.password_hash = encrypted_password.decode('utf-8')
-
-    def get_decrypted_password(self):
-        decrypted_password = cipher_suite.decrypt(self.password_hash.encode('utf-8'))
-        return decrypted_password.decode('utf-8')
+import threading
+
+from cache import KeyLocked, decryption_cache, key_cache
+
+# SQLAlchemy, cryptography, bcrypt and pwinput together take about half a
+# second to import, so they are imported inside the screens that need them
+# and warmed up in the background while the start screen waits for input.
+WARM_UP_MODULES = ['pwinput', 'table', 'search', 'vault', 'vault_io', 'userkeys']
+
+session = None
+_session_lock = threading.Lock()
+
+def db_session():
+    global session
+    with _session_lock:
+        if session is None:
+            from db.database import Session, init_db
+            init_db()
+            session = Session()
+    return session
+
+_vault_sessions = {}
+
+def vault_session(user):
+    # With ENCRYPTO_SHARD_DIR set a user's entries live in their own shard
+    # database; otherwise they share the accounts database.
+    from db import shards
+    if shards.router is None:
+        return db_session()
+    with _session_lock:
+        if user.id not in _vault_sessions:
+            _vault_sessions[user.id] = shards.open_session(user.id)
+        return _vault_sessions[user.id]
+
+def _warm_up():
+    db_session()
+    for name in WARM_UP_MODULES:
+        importlib.import_module(name)
+
+def warm_up():
+    threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+
+# Every prompt goes through these two, so run_script can answer them.
+read_line = input
+
+def read_secret(prompt=''):
+    import pwinput
+    return pwinput.pwinput(prompt)
+
+class ScriptEnded(Exception):
+    pass
+
+def run(screen, *args):
+    # Each screen returns the next screen and its arguments (or None to
+    # quit) instead of calling it, so the stack stays flat however long
+    # the session runs.
+    state = (screen,) + args
+    while state:
+        try:
+            state = state[0](*state[1:])
+        except KeyLocked:
+            # The data key unlocked at login expired while the app sat idle.
+            print("Your session has expired. Please log in again.")
+            state = (login,)
+
+def run_script(lines, screen=None, *args):
+    """Run the app non-interactively, answering each prompt with the next of lines."""
+    global read_line, read_secret
+    answers = iter(lines)
+
+    def answer(prompt=''):
+        for line in answers:
+            return line
+        raise ScriptEnded
+
+    saved = read_line, read_secret
+    read_line = read_secret = answer
+    try:
+        run(screen or start_screen, *args)
+    except ScriptEnded:
+        pass
+    finally:
+        read_line, read_secret = saved
 
 def start_screen():
     print('Welcome to Encrypto.')
     print('1. Sign Up')
     print('2. Login')
     print('3. Quit')
-    action = input("Please select an option: ")
+    action = read_line("Please select an option: ")
 
     if action == '1':
-        sign_up()
+        return sign_up,
     elif action == '2':
-        login()
+        return login,
     elif action == '3':
-        quit()
+        return None
     else:
         print('Invalid option. Please select a valid option.')
-        start_screen()
+        return start_screen,
 
 def validate_username(username):
     if not isinstance(username, str):
@@ -87,29 +120,31 @@ def validate_password(password):
     return True
 
 def sign_up():
+    from db.models import User
+    session = db_session()
     while True:
         print('Please enter your desired username (or "cancel" to go back):')
-        username = input("> ")
+        username = read_line("> ")
         if username.lower() == 'cancel':
-            start_screen()
+            return start_screen,
         elif validate_username(username):
             break
         print('Invalid username. Please try again.')
 
     while True:
         print('Please enter your desired password (or "cancel" to go back):')
-        password = pwinput.pwinput("> ")
+        password = read_secret("> ")
         if password.lower() == 'cancel':
-            start_screen()
+            return start_screen,
         elif validate_password(password):
             break
         print('Invalid password. Please try again.')
 
     while True:
         print('Confirm your password (or "cancel" to go back):')
-        confirm_password = pwinput.pwinput("> ")
+        confirm_password = read_secret("> ")
         if confirm_password.lower() == 'cancel':
-            start_screen()
+            return start_screen,
         elif password == confirm_password:
             break
         print("Passwords do not match! Please try again.")
@@ -117,19 +152,23 @@ def sign_up():
     user = session.query(User).filter_by(username=username).first()
     if user:
         print('Username already exists. Please choose a different username.')
-        sign_up()
+        return sign_up,
     else:
+        from userkeys import new_data_key
         new_user = User(username=username)
         new_user.set_password(password)
+        new_data_key(new_user, password)
         session.add(new_user)
         session.commit()
         print('Account created successfully.')
-        start_screen()
+        return start_screen,
 
 def login():
+    from db.models import User
+    session = db_session()
     while True:
         print('Please enter your username:')
-        username = input("> ")
+        username = read_line("> ")
         user = session.query(User).filter_by(username=username).first()
         if not user:
             print("Invalid username. Please try again.")
@@ -138,36 +177,58 @@ def login():
 
     while True:
         print('Please enter your password (or "reset" to reset your password):')
-        password = pwinput.pwinput("> ")
+        password = read_secret("> ")
         if password.lower() == 'reset':
-            reset_password(username)
+            return reset_password, username
         elif not user.check_password(password):
             print("Invalid password. Please try again.")
             continue
         break
 
+    if user.needs_rehash():
+        # Stored hash predates the current cost policy; upgrade it while we have the password.
+        user.set_password(password)
+        session.commit()
+    # Unwrap the user's data key once, so their entries cost one Fernet
+    # operation each from here on.
+    from userkeys import unlock
+    if user.data_key is None:
+        print("Setting up your encryption key...")
+    unlock(session, user, password, vault_session(user))
+
     print("Login successful!")
     current_user = user
-    menu(current_user)
+    return menu, current_user
 
 def reset_password(username):
+    from db.models import User
+    session = db_session()
     user = session.query(User).filter_by(username=username).first()
     if user:
         print("Reset password for", username)
-        new_password = pwinput.pwinput("Enter new password: ")
-        confirm_password = pwinput.pwinput("Confirm new password: ")
+        if user.data_key is not None:
+            # The stored passwords can only be decrypted with a key protected
+            # by the old password.
+            print("Your stored passwords are encrypted with a key that only your old password can unlock.")
+            print("Resetting deletes them from this device.")
+            if read_line("Type 'delete' to continue, or anything else to go back: ").strip().lower() != 'delete':
+                return login,
+        new_password = read_secret("Enter new password: ")
+        confirm_password = read_secret("Confirm new password: ")
 
         if new_password == confirm_password:
-            user.set_password(new_password)
-            session.commit()
+            from userkeys import reset_password as reset_account_password
+            lost = reset_account_password(session, user, new_password, vault_session(user))
+            if lost:
+                print(f"Deleted {lost} stored passwords.")
             print("Password reset successfully. Please login again.")
-            login()
+            return login,
         else:
             print("Passwords do not match. Please try again.")
-            reset_password(username)
+            return reset_password, username
     else:
         print("User not found. Please try again.")
-        login()
+        return login,
 
 def menu(current_user):
     print("Welcome to Encrypto. What would you like to do?:")
@@ -177,23 +238,27 @@ def menu(current_user):
     print("3. Manage Account.")
     print("4. Sign Out.")
     print("5. Quit.")
-    action = input("Please select an option: ")
+    action = read_line("Please select an option: ")
 
     if action == "0":
-        help_section(current_user)
+        return help_section, current_user
     elif action == "1":
-        create_password(current_user)
+        return create_password, current_user
     elif action == "2":
-        manage_passwords(current_user)
+        return manage_passwords, current_user
     elif action == "3":
-        manage_account(current_user)
+        return manage_account, current_user
     elif action == "4":
-        start_screen()
+        decryption_cache.clear()
+        key_cache.invalidate(current_user.id)
+        return start_screen,
     elif action == "5":
-        quit()
+        decryption_cache.clear()
+        key_cache.clear()
+        return None
     else:
         print("Invalid option. Please try again.")
-        menu(current_user)
+        return menu, current_user
 
 def help_section(current_user):
     print("Welcome to the Help Section!")
@@ -225,45 +290,45 @@ def help_section(current_user):
     print("Thank you for using Encrypto!")
 
     print("Press Enter to go back to the menu when you are done :D")
-    input()
-    menu(current_user)
+    read_line()
+    return menu, current_user
 
 def create_password(current_user):
+    from db.models import Password
+    session = vault_session(current_user)
     print("Welcome to the Create Password Section!")
-    website = input("Website/Application Name: ")
-    username = input("Username: ")
+    website = read_line("Website/Application Name: ")
+    username = read_line("Username: ")
     
     print("Do you want to:")
     print("1. Generate a random password")
     print("2. Input your own password")
-    action = input("Please select an option: ")
+    print("3. Generate a passphrase")
+    action = read_line("Please select an option: ")
     
     if action == "1":
         password = generate_random_password()
     elif action == "2":
-        password = pwinput.pwinput("Password: ")
+        password = read_secret("Password: ")
+    elif action == "3":
+        from generator import generate_passphrases
+        password = generate_passphrases(1)[0]
     else:
         print("Invalid option. Please try again.")
-        create_password(current_user)
+        return create_password, current_user
     
-    password_obj = Password(website=website, username=username, user_id=current_user.username)
+    password_obj = Password(website=website, username=username, user_id=current_user.id)
     password_obj.set_password(password)
     session.add(password_obj)
     session.commit()
     print("Password stored successfully!")
     print("Press Enter to go back to the menu when you are done.")
-    input()
-    menu(current_user)
+    read_line()
+    return menu, current_user
 
 def generate_random_password(length=12):
-    alphabet = string.ascii_letters + string.digits + string.punctuation
-    while True:
-        password = ''.join(secrets.choice(alphabet) for _ in range(length))
-        if (any(c.islower() for c in password) 
-                and any(c.isupper() for c in password) 
-                and any(c.isdigit() for c in password) 
-                and any(c in string.punctuation for c in password)):
-            return password
+    from generator import generate_password
+    return generate_password(length)
 
 def manage_passwords(current_user):
     print("Welcome to the Manage Passwords Section!")
@@ -272,82 +337,149 @@ def manage_passwords(current_user):
     print("2. Update stored passwords")
     print("3. Delete stored passwords")
     print("4. Search for passwords")
-    print("5. Back to menu")
-    action = input("Please select an option: ")
+    print("5. Import passwords from a file")
+    print("6. Export passwords to a file")
+    print("7. Back to menu")
+    action = read_line("Please select an option: ")
 
     if action == "1":
-        view_passwords(current_user)
+        return view_passwords, current_user
     elif action == "2":
-        edit_password(current_user)
+        return edit_password, current_user
     elif action == "3":
-        delete_password(current_user)
+        return delete_password, current_user
     elif action == "4":
-        search_password(current_user)
+        return search_password, current_user
     elif action == "5":
-        menu(current_user)
+        return import_file, current_user
+    elif action == "6":
+        return export_file, current_user
+    elif action == "7":
+        return menu, current_user
     else:
         print("Invalid option. Please try again.")
-        manage_passwords(current_user)
+        return manage_passwords, current_user
 
 def view_passwords(current_user):
+    from table import render_table
+    from vault import MASK, iter_password_pages
+    session = vault_session(current_user)
     print("Here are your stored passwords:")
-    passwords = session.query(Password).filter_by(user_id=current_user.username).all()
-    if not passwords:
+    shown = 0
+    for page in iter_password_pages(session, current_user.id):
+        revealed = {}
+        while True:
+            render_table(["#", "Website", "Username", "Password"],
+                         ([number, password.website, password.username, revealed.get(number, MASK)]
+                          for number, password in enumerate(page, start=shown + 1)))
+            action = read_line("Enter a row number to reveal it, 'a' to reveal this page, Enter for more or 'q' to stop: ").strip().lower()
+            if action == "a":
+                for number, password in enumerate(page, start=shown + 1):
+                    revealed[number] = password.get_decrypted_password()
+            elif action.isdigit() and shown < int(action) <= shown + len(page):
+                revealed[int(action)] = page[int(action) - shown - 1].get_decrypted_password()
+            else:
+                break
+        shown += len(page)
+        if action == "q":
+            break
+    if not shown:
         print("No passwords stored yet.")
-    else:
-        table = Texttable()
-        table.header(["Website", "Username", "Password"])
-        for password in passwords:
-            decrypted_password = password.get_decrypted_password()
-            table.add_row([password.website, password.username, decrypted_password])
-        print(table.draw())
     print("Press Enter to go back to the menu when you are done.")
-    input()
-    manage_passwords(current_user)
+    read_line()
+    return manage_passwords, current_user
 
 def edit_password(current_user):
+    from db.models import Password
+    session = vault_session(current_user)
     print("Edit Password Section!")
-    website = input("Enter the website of the password you want to edit: ")
-    password_obj = session.query(Password).filter_by(website=website, user_id=current_user.username).first()
+    website = read_line("Enter the website of the password you want to edit: ")
+    password_obj = session.query(Password).filter_by(website=website, user_id=current_user.id).first()
     if password_obj:
-        new_password = pwinput.pwinput("Enter the new password: ")
+        new_password = read_secret("Enter the new password: ")
         password_obj.set_password(new_password)
         session.commit()
         print("Password updated successfully!")
         print("Press Enter to go back to the menu when you are done.")
-        input()
-        manage_passwords(current_user)
+        read_line()
+        return manage_passwords, current_user
     else:
         print("Password not found. Please try again.")
-        edit_password(current_user)
+        return edit_password, current_user
 
 def delete_password(current_user):
+    from db.models import Password
+    session = vault_session(current_user)
     print("Delete Password Section!")
-    website = input("Enter the website of the password you want to delete: ")
-    password_obj = session.query(Password).filter_by(website=website, user_id=current_user.username).first()
+    website = read_line("Enter the website of the password you want to delete: ")
+    password_obj = session.query(Password).filter_by(website=website, user_id=current_user.id).first()
     if password_obj:
         session.delete(password_obj)
         session.commit()
         print("Password deleted successfully!")
         print("Press Enter to go back to the menu when you are done.")
-        input()
-        manage_passwords(current_user)
+        read_line()
+        return manage_passwords, current_user
     else:
         print("Password not found. Please try again.")
-        delete_password(current_user)
+        return delete_password, current_user
 
 def search_password(current_user):
+    from search import MODES, search_passwords
+    session = vault_session(current_user)
     print("Search Password Section!")
-    website = input("Enter the website of the password you want to search: ")
-    website_lower = website.lower() 
-    password_obj = session.query(Password).filter_by(user_id=current_user.username).all()
-    for password in password_obj:
-        if website_lower in password.website.lower(): 
-            decrypted_password = password.get_decrypted_password()
-            print(f"Website: {password.website}, Username: {password.username}, Password: {decrypted_password}")
+    website = read_line("Enter the website of the password you want to search: ")
+    print("Match mode:")
+    print("1. Contains (default)")
+    print("2. Starts with")
+    print("3. Fuzzy")
+    action = read_line("Please select an option: ")
+    mode = {"2": "prefix", "3": "fuzzy"}.get(action, MODES[0])
+    for password in search_passwords(session, current_user.id, website, mode=mode):
+        decrypted_password = password.get_decrypted_password()
+        print(f"Website: {password.website}, Username: {password.username}, Password: {decrypted_password}")
+    print("Press Enter to go back to the menu when you are done.")
+    read_line()
+    return manage_passwords, current_user
+
+def import_file(current_user):
+    import vault_io
+    session = vault_session(current_user)
+    print("Import Passwords Section!")
+    print("Supported files: CSV or JSON exports from browsers and password managers, or an Encrypto export.")
+    path = read_line("Path of the file to import: ")
+    passphrase = None
+    if path.endswith('.enc'):
+        passphrase = read_secret("Export passphrase: ")
+    try:
+        stats = vault_io.import_passwords(session, current_user.id, vault_io.read_records(path, passphrase))
+    except (OSError, ValueError) as e:
+        session.rollback()
+        print(f"Import failed: {e}")
+    else:
+        print(f"Imported {stats.rows} passwords in {stats.seconds:.2f}s ({vault_io.rows_per_second(stats):.0f} rows/sec).")
+    print("Press Enter to go back to the menu when you are done.")
+    read_line()
+    return manage_passwords, current_user
+
+def export_file(current_user):
+    import vault_io
+    session = vault_session(current_user)
+    print("Export Passwords Section!")
+    path = read_line("Path of the file to export to: ")
+    print("Enter a passphrase to encrypt the export, or leave it empty to write plain CSV.")
+    passphrase = read_secret("Export passphrase: ")
+    if passphrase and not path.endswith('.enc'):
+        path += '.enc'
+    try:
+        stats = vault_io.export_passwords(session, current_user.id, path, passphrase or None)
+    except OSError as e:
+        print(f"Export failed: {e}")
+    else:
+        print(f"Exported {stats.rows} passwords to {path} in {stats.seconds:.2f}s ({vault_io.rows_per_second(stats):.0f} rows/sec).")
     print("Press Enter to go back to the menu when you are done.")
-    input()
-    manage_passwords(current_user)
+    read_line()
+    return manage_passwords, current_user
 
 def manage_account(current_user):
     print("Manage Account Section!")
@@ -355,69 +487,92 @@ def manage_account(current_user):
     print("2. Change Password")
     print("3. Delete Account")
     print("4. Back to menu")
-    action = input("Please select an option: ")
+    action = read_line("Please select an option: ")
     if action == "1":
-        edit_username(current_user)
+        return edit_username, current_user
     elif action == "2":
-        change_password(current_user)
+        return change_password, current_user
     elif action == "3":
-        delete_account(current_user)
+        return delete_account, current_user
     elif action == "4":
-        menu(current_user)
+        return menu, current_user
     else:
         print("Invalid option. Please try again.")
+        return manage_account, current_user
 
 def edit_username(current_user):
+    from db.models import User
+    from vault import rename_user
+    session = db_session()
     print("Edit Username Section!")
-    old_username = current_user.username  # Store the old username
-    new_username = input("Enter your new username: ")
-    current_user.username = new_username
-    session.commit()  # Update the username in the users table
-
-    # Update the user_id in the passwords table
-    password_obj = session.query(Password).filter_by(user_id=old_username).all()
-    for password in password_obj:
-        password.user_id = new_username
-    session.commit() 
-
-    print("Username updated successfully!")
+    new_username = read_line("Enter your new username: ")
+    if not validate_username(new_username):
+        print("Invalid username. Please try again.")
+    elif session.query(User).filter_by(username=new_username).first():
+        print("Username already exists. Please choose a different username.")
+    else:
+        rename_user(session, current_user, new_username)
+        print("Username updated successfully!")
     print("Press Enter to go back to the menu when you are done.")
-    input()
-    manage_account(current_user)
+    read_line()
+    return manage_account, current_user
 
 def change_password(current_user):
-    old_password = pwinput.pwinput("Enter your current password: ")
+    session = db_session()
+    old_password = read_secret("Enter your current password: ")
     if current_user.check_password(old_password):
-        new_password = pwinput.pwinput("Enter your new password: ")
-        confirm_password = pwinput.pwinput("Confirm your new password: ")
+        new_password = read_secret("Enter your new password: ")
+        confirm_password = read_secret("Confirm your new password: ")
         if new_password == confirm_password:
-            current_user.set_password(new_password)
-            session.commit()
+            from userkeys import change_password as change_account_password
+            change_account_password(session, current_user, old_password, new_password)
             print("Password updated successfully!")
             print("Press Enter to go back when you are done.")
-            input()
-            manage_account(current_user)
+            read_line()
+            return manage_account, current_user
         else:
             print("Passwords do not match. Please try again.")
-            change_password(current_user)
+            return change_password, current_user
     else:
         print("Invalid password. Please try again.")
-        change_password(current_user)
+        return change_password, current_user
 
 def delete_account(current_user):
-    password = pwinput.pwinput("Enter your password to confirm: ")
+    session = db_session()
+    password = read_secret("Enter your password to confirm: ")
     if current_user.check_password(password):
+        from db import shards
+        from db.models import Password
+
+        session.query(Password).filter_by(user_id=current_user.id).delete(synchronize_session=False)
+        # A bulk delete skips the per-entry invalidation hook.
+        decryption_cache.clear()
         session.delete(current_user)
         session.commit()
+        key_cache.invalidate(current_user.id)
+        if shards.router is not None:
+            shard_session = _vault_sessions.pop(current_user.id, None)
+            if shard_session is not None:
+                shard_session.close()
+            shards.router.drop(current_user.id)
         print("Account deleted successfully!")
-        start_screen()
+        return start_screen,
     else:
         print("Invalid password. Please try again.")
-        delete_account(current_user)
+        return delete_account, current_user
 
 if __name__ == '__main__':
-    engine = create_engine('sqlite:///passwords.db')
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    start_screen()
\ No newline at end of file
+    import os
+    import sys
+    if '--profile' in sys.argv or os.environ.get('ENCRYPTO_PROFILE'):
+        import metrics
+        # --profile [PATH]: PATH ending in .json or .prom picks the dump format.
+        position = sys.argv.index('--profile') + 1 if '--profile' in sys.argv else None
+        if position is None:
+            output = os.environ['ENCRYPTO_PROFILE']
+        else:
+            output = sys.argv[position] if position < len(sys.argv) else None
+        metrics.enable(output)
+    warm_up()
+    run(start_screen)
+
@@ -0,0 +1,134 @@
+import hashlib
+import os
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+from cache import KeyLocked, key_cache
+
+KEY_FILE = 'key.key'
+
+# key.key holds one Fernet key per line. The first is the primary key used
+# for new encryptions; the rest are older keys kept so tokens written before
+# a rotation stay readable until they are re-encrypted.
+
+
+def load_keys(path=KEY_FILE):
+    try:
+        with open(path, 'rb') as key_file:
+            keys = [line.strip() for line in key_file.read().splitlines() if line.strip()]
+    except FileNotFoundError:
+        keys = []
+    if not keys:
+        keys = [Fernet.generate_key()]
+        save_keys(keys, path)
+    return keys
+
+
+def save_keys(keys, path=KEY_FILE):
+    # Write to a temporary file and rename so readers never see a partial keyring.
+    tmp_path = path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as key_file:
+        key_file.write(b'\n'.join(keys) + b'\n')
+        key_file.flush()
+        os.fsync(key_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def fingerprint(key):
+    return hashlib.sha256(key).hexdigest()[:16]
+
+
+def build_cipher(keys):
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+# The keyring is read on first use rather than at import, so importing
+# this module (or the models) never touches key.key.
+_keys = None
+_cipher = None
+_keys_mtime = None
+
+
+def reload_keys():
+    """(Re-)read key.key if it is not loaded or another process rotated it.
+
+    Returns True if the keyring changed.
+    """
+    global _keys, _cipher, _keys_mtime
+    mtime = os.stat(KEY_FILE).st_mtime_ns if _keys is not None else None
+    if _keys is not None and mtime == _keys_mtime:
+        return False
+    _keys = load_keys()
+    _cipher = build_cipher(_keys)
+    _keys_mtime = os.stat(KEY_FILE).st_mtime_ns
+    return True
+
+
+def get_keys():
+    if _keys is None:
+        reload_keys()
+    return _keys
+
+
+def get_cipher():
+    if _cipher is None:
+        reload_keys()
+    return _cipher
+
+
+def encrypt(data):
+    reload_keys()
+    return _cipher.encrypt(data)
+
+
+def decrypt(token):
+    try:
+        return get_cipher().decrypt(token)
+    except InvalidToken:
+        # A rotation in another process may have re-encrypted this entry
+        # under a key we have not loaded yet.
+        if not reload_keys():
+            raise
+        return _cipher.decrypt(token)
+
+
+# Per-user data keys (see userkeys.py). Once a user logs in, their entries
+# are encrypted with their own data key, held unlocked in key_cache; the
+# keyring is kept behind it to read entries written before the user had one.
+
+
+def unlock_user(user_id, data_key):
+    key_cache.put(user_id, data_key, MultiFernet([Fernet(data_key)] + [Fernet(key) for key in get_keys()]))
+
+
+def lock_user(user_id):
+    key_cache.invalidate(user_id)
+
+
+def keys_for(user_id):
+    """user_id's data key followed by the keyring, for building ciphers in worker processes."""
+    data_key = key_cache.key(user_id)
+    if data_key is None:
+        raise KeyLocked(f"The data key of user {user_id} is locked; log in again.")
+    return [data_key] + get_keys()
+
+
+def encrypt_for(user_id, data):
+    cipher = key_cache.cipher(user_id)
+    if cipher is None:
+        raise KeyLocked(f"The data key of user {user_id} is locked; log in again.")
+    return cipher.encrypt(data)
+
+
+def decrypt_for(user_id, token):
+    cipher = key_cache.cipher(user_id)
+    try:
+        return cipher.decrypt(token) if cipher is not None else decrypt(token)
+    except InvalidToken:
+        if cipher is None:
+            # Either encrypted with user_id's data key, which is not
+            # unlocked, or not a token of ours at all.
+            raise KeyLocked(f"Entry cannot be read without the data key of user {user_id}; log in again.")
+        # Written under a keyring key loaded after the user unlocked.
+        return decrypt(token)
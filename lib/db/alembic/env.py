@@ -0,0 +1,47 @@
+import os
+from logging.config import fileConfig
+
+from alembic import context
+
+from db.database import make_engine
+from db.models import Base
+
+config = context.config
+target_metadata = Base.metadata
+
+# init_db() runs migrations on a connection of its own engine and passes it
+# in here; the alembic command line opens one from DATABASE_URL or the url
+# in alembic.ini.
+connection = config.attributes.get('connection')
+
+if connection is None and config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+
+def database_url():
+    return os.environ.get('DATABASE_URL') or config.get_main_option('sqlalchemy.url')
+
+
+def run_migrations(connection):
+    # SQLite cannot alter most of a table in place; batch mode rebuilds it.
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline():
+    context.configure(url=database_url(), target_metadata=target_metadata, literal_binds=True, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif connection is not None:
+    run_migrations(connection)
+else:
+    engine = make_engine(database_url())
+    with engine.connect() as engine_connection:
+        run_migrations(engine_connection)
+        engine_connection.commit()
+    engine.dispose()
@@ -0,0 +1,52 @@
+"""Baseline: the schema as it was before migrations were tracked
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00
+
+Databases created by earlier versions of the app already have these
+tables; init_db() stamps them at this revision instead of running it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('username', sa.String(), primary_key=True),
+        sa.Column('password_hash', sa.String()),
+    )
+    op.create_table(
+        'passwords',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('website', sa.String()),
+        sa.Column('website_key', sa.String()),
+        sa.Column('username', sa.String()),
+        sa.Column('password_hash', sa.String()),
+        sa.Column('user_id', sa.String(), sa.ForeignKey('users.username')),
+    )
+    op.create_index('ix_passwords_user_id_website_key', 'passwords', ['user_id', 'website_key'])
+    op.create_table(
+        'key_rotations',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('key_fingerprint', sa.String(), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.Column('rows_rotated', sa.Integer(), nullable=False),
+        sa.Column('started_at', sa.DateTime()),
+        sa.Column('finished_at', sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table('key_rotations')
+    op.drop_index('ix_passwords_user_id_website_key', table_name='passwords')
+    op.drop_table('passwords')
+    op.drop_table('users')
@@ -0,0 +1,110 @@
+"""Integer surrogate user ids
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:30:00
+
+users gets an integer primary key and passwords.user_id points at it, so
+ownership lookups compare integers on the (user_id, website_key) index and
+renaming a user rewrites one row instead of all of their entries.
+
+Both tables are rebuilt: copied into new tables, the old ones dropped and
+the new ones renamed into place. Entry ids are kept, so any checkpoint in
+key_rotations stays valid; the FTS search index is rebuilt after the swap
+(its triggers come back with init_db).
+
+Entries whose owner no longer exists (the app never enforced the foreign
+key) are kept, moved to a placeholder account named orphaned-entries that
+nobody knows the password of. An administrator can rename it or move the
+entries to the right user.
+"""
+import logging
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+import hashing
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+log = logging.getLogger('alembic.runtime.migration')
+
+
+def _password_columns(user_id_type, user_id_target, nullable):
+    return [
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('website', sa.String()),
+        sa.Column('website_key', sa.String()),
+        sa.Column('username', sa.String()),
+        sa.Column('password_hash', sa.String()),
+        sa.Column('user_id', user_id_type, sa.ForeignKey(user_id_target), nullable=nullable),
+    ]
+
+
+def _swap_tables():
+    op.drop_index('ix_passwords_user_id_website_key', table_name='passwords')
+    op.drop_table('passwords')
+    op.drop_table('users')
+    op.rename_table('users_new', 'users')
+    op.rename_table('passwords_new', 'passwords')
+    op.create_index('ix_passwords_user_id_website_key', 'passwords', ['user_id', 'website_key'])
+    bind = op.get_bind()
+    if bind.execute(sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'passwords_fts'")).first():
+        op.execute("INSERT INTO passwords_fts(passwords_fts) VALUES ('rebuild')")
+
+
+def _adopt_orphans():
+    """Give entries without an existing owner to a placeholder account."""
+    bind = op.get_bind()
+    orphaned = "user_id IS NULL OR user_id NOT IN (SELECT username FROM users)"
+    count = bind.execute(sa.text(f"SELECT COUNT(*) FROM passwords WHERE {orphaned}")).scalar()
+    if not count:
+        return
+    taken = {row[0] for row in bind.execute(sa.text("SELECT username FROM users WHERE username LIKE 'orphaned-entries%'"))}
+    name = next(candidate for candidate in ('orphaned-entries', *(f"orphaned-entries-{n}" for n in range(2, len(taken) + 3)))
+                if candidate not in taken)
+    bind.execute(sa.text("INSERT INTO users (username, password_hash) VALUES (:name, :hash)"),
+                 {'name': name, 'hash': hashing.hash_password(os.urandom(32).hex())})
+    bind.execute(sa.text(f"UPDATE passwords SET user_id = :name WHERE {orphaned}"), {'name': name})
+    log.warning("Moved %d entries whose user no longer exists to the account %r", count, name)
+
+
+def upgrade():
+    _adopt_orphans()
+
+    op.create_table(
+        'users_new',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(), nullable=False, unique=True),
+        sa.Column('password_hash', sa.String()),
+    )
+    op.execute("INSERT INTO users_new (username, password_hash) SELECT username, password_hash FROM users ORDER BY username")
+    op.create_table('passwords_new', *_password_columns(sa.Integer(), 'users_new.id', False))
+    op.execute(
+        "INSERT INTO passwords_new (id, website, website_key, username, password_hash, user_id) "
+        "SELECT p.id, p.website, p.website_key, p.username, p.password_hash, u.id "
+        "FROM passwords p JOIN users_new u ON u.username = p.user_id"
+    )
+    _swap_tables()
+
+
+def downgrade():
+    op.create_table(
+        'users_new',
+        sa.Column('username', sa.String(), primary_key=True),
+        sa.Column('password_hash', sa.String()),
+    )
+    op.execute("INSERT INTO users_new (username, password_hash) SELECT username, password_hash FROM users")
+    op.create_table('passwords_new', *_password_columns(sa.String(), 'users_new.username', True))
+    op.execute(
+        "INSERT INTO passwords_new (id, website, website_key, username, password_hash, user_id) "
+        "SELECT p.id, p.website, p.website_key, p.username, p.password_hash, u.username "
+        "FROM passwords p JOIN users u ON u.id = p.user_id"
+    )
+    _swap_tables()
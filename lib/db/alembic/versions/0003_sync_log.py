@@ -0,0 +1,81 @@
+"""Sync ids, versions and change log
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00
+
+Entries get a sync id shared by their copies on every device, plus the
+hybrid logical clock reading and replica of their last change. sync_log
+records every change, sync_state holds this database's replica id, and
+sync_peers the checkpoints with other replicas (see sync.py). Existing
+entries are stamped as changed now by this replica and logged, so the
+first sync sends them all. The triggers that keep the log up to date are
+created by init_db.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+SYNC_TRIGGERS = ('passwords_sync_insert', 'passwords_sync_update', 'passwords_sync_delete')
+
+
+def upgrade():
+    op.create_table(
+        'sync_state',
+        sa.Column('key', sa.String(), primary_key=True),
+        sa.Column('value', sa.String()),
+    )
+    op.execute("INSERT INTO sync_state (key, value) VALUES ('replica_id', lower(hex(randomblob(8))))")
+    op.create_table(
+        'sync_log',
+        sa.Column('seq', sa.Integer(), primary_key=True),
+        sa.Column('sync_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('hlc', sa.BigInteger(), nullable=False),
+        sa.Column('origin', sa.String(), nullable=False),
+        sa.Column('deleted', sa.Boolean(), nullable=False),
+        sqlite_autoincrement=True,
+    )
+    op.create_index('ix_sync_log_user_id_seq', 'sync_log', ['user_id', 'seq'])
+    op.create_index('ix_sync_log_sync_id_seq', 'sync_log', ['sync_id', 'seq'])
+    op.create_index('ix_sync_log_hlc', 'sync_log', ['hlc'])
+    op.create_table(
+        'sync_peers',
+        sa.Column('peer_id', sa.String(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), primary_key=True),
+        sa.Column('received_seq', sa.Integer(), nullable=False),
+        sa.Column('acked_seq', sa.Integer(), nullable=False),
+    )
+
+    op.add_column('passwords', sa.Column('sync_id', sa.String()))
+    op.add_column('passwords', sa.Column('hlc', sa.BigInteger()))
+    op.add_column('passwords', sa.Column('origin', sa.String()))
+    op.execute(
+        "UPDATE passwords SET sync_id = lower(hex(randomblob(16))), "
+        "hlc = CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER) * 65536, "
+        "origin = (SELECT value FROM sync_state WHERE key = 'replica_id')"
+    )
+    op.create_index('ix_passwords_sync_id', 'passwords', ['sync_id'], unique=True)
+    op.execute(
+        "INSERT INTO sync_log (sync_id, user_id, hlc, origin, deleted) "
+        "SELECT sync_id, user_id, hlc, origin, 0 FROM passwords ORDER BY id"
+    )
+
+
+def downgrade():
+    for trigger in SYNC_TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.drop_index('ix_passwords_sync_id', table_name='passwords')
+    with op.batch_alter_table('passwords') as batch:
+        batch.drop_column('origin')
+        batch.drop_column('hlc')
+        batch.drop_column('sync_id')
+    op.drop_table('sync_peers')
+    op.drop_table('sync_log')
+    op.drop_table('sync_state')
@@ -0,0 +1,39 @@
+"""Per-user data keys
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 13:00:00
+
+Each user gets a data key of their own for their entries, stored wrapped
+under a key derived from their account password, with the salt and key
+derivation parameters used (see userkeys.py). Existing users have none
+until their next login, which creates it and re-encrypts their entries
+from key.key, so this migration only adds the columns.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('data_key', sa.String()))
+    op.add_column('users', sa.Column('key_salt', sa.String()))
+    op.add_column('users', sa.Column('key_kdf', sa.String()))
+
+
+def downgrade():
+    # Entries already moved to a data key cannot be read with key.key alone;
+    # dropping the wrapped keys would lose them.
+    bind = op.get_bind()
+    if bind.execute(sa.text("SELECT count(*) FROM users WHERE data_key IS NOT NULL")).scalar():
+        raise RuntimeError("Users have per-user data keys; their entries would become unreadable without them.")
+    with op.batch_alter_table('users') as batch:
+        batch.drop_column('key_kdf')
+        batch.drop_column('key_salt')
+        batch.drop_column('data_key')
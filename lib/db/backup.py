@@ -0,0 +1,483 @@
+import argparse
+import base64
+import collections
+import contextlib
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zlib
+
+import pwinput
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy.engine import make_url
+
+import crypto
+from db.database import DATABASE_URL
+from vault_io import SCRYPT_PARAMS
+from vaultfile import derive_keys
+
+# Incremental, deduplicated, encrypted backups.
+#
+#   config                  scrypt parameters and salt, and a passphrase check
+#   packs/<snapshot>.pack   the chunks first stored by that snapshot, each a
+#                           nonce and the AES-GCM ciphertext of the
+#                           zlib-compressed chunk, with the chunk id as
+#                           associated data
+#   packs/<snapshot>.idx    encrypted list of (chunk id, offset, length)
+#                           for the pack
+#   snapshots/<snapshot>    encrypted manifest: the size, SHA-256 and chunk
+#                           ids of every file backed up (the database,
+#                           key.key and any per-user shards)
+#
+# Databases are cut into chunks of one SQLite page, so a commit that
+# rewrites a few pages makes the next backup store just those pages. A
+# chunk's id is an HMAC of its contents under a key derived from the backup
+# passphrase: equal pages are stored once, and ids reveal nothing about
+# contents without the passphrase. A manifest lists only the chunks that
+# changed since its parent snapshot, with a full list every FULL_EVERY
+# snapshots so restores never walk a long chain. A snapshot exists once
+# its manifest is written, which happens last; an interrupted backup leaves
+# at most an unreferenced pack behind.
+#
+# Pages are read straight from the live database file while a read
+# transaction pins it (see _pinned), so a backup costs reading the vault
+# once and writing what changed, never a full copy.
+
+FORMAT_VERSION = 1
+INDEX_RECORD = struct.Struct('<32sQI')  # chunk id, offset in the pack, stored length
+CHANGE = struct.Struct('<I32s')  # chunk number, chunk id
+FULL_EVERY = 16
+COMPRESS_LEVEL = 1
+FILE_CHUNK = 4096  # chunk size for files that are not SQLite databases
+READ_CHUNKS = 256  # chunks per read from the source file
+PIN_ATTEMPTS = 5
+SQLITE_MAGIC = b'SQLite format 3\0'
+SNAPSHOT_TIME = '%Y%m%dT%H%M%S%fZ'  # sorts by time
+
+
+class BackupError(Exception):
+    pass
+
+
+BackupStats = collections.namedtuple('BackupStats', 'snapshot files chunks new_chunks bytes_read bytes_written seconds')
+
+
+def _write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _page_size(file):
+    """The page size of the SQLite database open in file, or None if it is not one."""
+    header = file.read(100)
+    file.seek(0)
+    if len(header) < 100 or not header.startswith(SQLITE_MAGIC):
+        return None
+    size = int.from_bytes(header[16:18], 'big')
+    return 65536 if size == 1 else size
+
+
+def _read_chunks(file, chunk_size):
+    while True:
+        block = file.read(chunk_size * READ_CHUNKS)
+        if not block:
+            return
+        for start in range(0, len(block), chunk_size):
+            yield block[start:start + chunk_size]
+
+
+def _wal_size(path):
+    try:
+        return os.path.getsize(path + '-wal')
+    except FileNotFoundError:
+        return 0
+
+
+@contextlib.contextmanager
+def _pinned(path):
+    """Yield the SQLite database at path opened for reading, held unchanged until the block exits.
+
+    In WAL mode the log is checkpointed into the database file and a read
+    transaction is begun on the empty log. A reader that needs nothing from
+    the log blocks every checkpoint from writing to the database file, so
+    writers carry on (into the log) while the file itself stays a
+    consistent snapshot. If writers keep the log from emptying, the
+    database is copied through SQLite's online backup API instead. In
+    rollback-journal mode the read transaction holds off writers until the
+    backup is done.
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        wal = conn.execute("PRAGMA journal_mode").fetchone()[0].lower() == 'wal'
+        for _ in range(PIN_ATTEMPTS):
+            if wal:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("BEGIN")
+            conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            if not wal or _wal_size(path) == 0:
+                with open(path, 'rb') as file:
+                    yield file
+                return
+            conn.execute("ROLLBACK")
+        with tempfile.TemporaryDirectory() as tmp:
+            copy_path = os.path.join(tmp, 'copy.db')
+            with contextlib.closing(sqlite3.connect(copy_path)) as copy:
+                conn.backup(copy)
+            with open(copy_path, 'rb') as file:
+                yield file
+    finally:
+        conn.close()
+
+
+def vault_files():
+    """(name, path) of every file a backup covers: the database, the keyring and any per-user shards."""
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise BackupError(f"Only SQLite database files can be backed up, not {DATABASE_URL}")
+    files = [(os.path.basename(url.database), url.database), (crypto.KEY_FILE, crypto.KEY_FILE)]
+    from db import shards
+
+    if shards.router:
+        for user_id in shards.router.user_ids():
+            path = shards.router.path_for(user_id)
+            files.append((f"shards/{os.path.basename(path)}", path))
+    return files
+
+
+def snapshot_time(snapshot_id):
+    return datetime.datetime.strptime(snapshot_id.split('-')[0], SNAPSHOT_TIME).replace(tzinfo=datetime.timezone.utc)
+
+
+class Repository:
+    """A backup repository directory; open with init() or open()."""
+
+    def __init__(self, path, aead_key, mac_key):
+        self.path = path
+        self.aead = AESGCM(aead_key)
+        self.mac_key = mac_key
+        self.index = {}
+        self._manifests = {}
+        self._packs = {}
+        self._load_index()
+
+    @classmethod
+    def init(cls, path, passphrase, n=SCRYPT_PARAMS['n'], r=SCRYPT_PARAMS['r'], p=SCRYPT_PARAMS['p']):
+        if os.path.exists(os.path.join(path, 'config')):
+            raise BackupError(f"{path} already holds a backup repository")
+        for directory in (path, os.path.join(path, 'packs'), os.path.join(path, 'snapshots')):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        salt = os.urandom(16)
+        aead_key, mac_key = derive_keys(passphrase, salt, n, r, p)
+        config = {'version': FORMAT_VERSION, 'n': n, 'r': r, 'p': p, 'salt': salt.hex(), 'check': cls._check(mac_key).hex()}
+        _write_atomic(os.path.join(path, 'config'), json.dumps(config).encode('utf-8'))
+        return cls(path, aead_key, mac_key)
+
+    @classmethod
+    def open(cls, path, passphrase):
+        try:
+            with open(os.path.join(path, 'config'), 'rb') as file:
+                config = json.load(file)
+        except FileNotFoundError:
+            raise BackupError(f"{path} is not a backup repository (run init first)")
+        if config.get('version') != FORMAT_VERSION:
+            raise BackupError(f"{path} uses an unsupported repository format")
+        aead_key, mac_key = derive_keys(passphrase, bytes.fromhex(config['salt']), config['n'], config['r'], config['p'])
+        if not hmac.compare_digest(bytes.fromhex(config['check']), cls._check(mac_key)):
+            raise BackupError("Wrong backup passphrase")
+        return cls(path, aead_key, mac_key)
+
+    @staticmethod
+    def _check(mac_key):
+        return hmac.new(mac_key, b'encrypto backup check', hashlib.sha256).digest()[:16]
+
+    def close(self):
+        for file in self._packs.values():
+            file.close()
+        self._packs.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _seal(self, data, associated):
+        nonce = os.urandom(12)
+        return nonce + self.aead.encrypt(nonce, data, associated)
+
+    def _unseal(self, blob, associated, what):
+        try:
+            return self.aead.decrypt(blob[:12], blob[12:], associated)
+        except InvalidTag:
+            raise BackupError(f"{what} is corrupt or has been tampered with")
+
+    def _read_sealed(self, path, associated):
+        with open(path, 'rb') as file:
+            return zlib.decompress(self._unseal(file.read(), associated, path))
+
+    def _load_index(self):
+        packs = os.path.join(self.path, 'packs')
+        for name in sorted(os.listdir(packs)):
+            if name.endswith('.idx'):
+                pack = name[:-len('.idx')]
+                for chunk_id, offset, length in INDEX_RECORD.iter_unpack(self._read_sealed(os.path.join(packs, name), b'index:' + pack.encode())):
+                    self.index[chunk_id] = (pack, offset, length)
+
+    def snapshots(self):
+        """Snapshot ids, oldest first."""
+        return sorted(name for name in os.listdir(os.path.join(self.path, 'snapshots')) if not name.endswith('.tmp'))
+
+    def find_snapshot(self, at=None):
+        """The latest snapshot taken at or before at (an aware datetime; default now)."""
+        candidates = [snapshot for snapshot in self.snapshots() if at is None or snapshot_time(snapshot) <= at]
+        if not candidates:
+            raise BackupError("No snapshot at or before that time" if at else "The repository holds no snapshots")
+        return candidates[-1]
+
+    def manifest(self, snapshot_id):
+        if snapshot_id not in self._manifests:
+            path = os.path.join(self.path, 'snapshots', snapshot_id)
+            if not os.path.exists(path):
+                raise BackupError(f"No snapshot {snapshot_id}")
+            self._manifests[snapshot_id] = json.loads(self._read_sealed(path, b'snapshot:' + snapshot_id.encode()))
+        return self._manifests[snapshot_id]
+
+    def chunk_ids(self, manifest, name):
+        """The chunk ids of file name in manifest, in order, or None if it does not hold the file."""
+        entry = next((entry for entry in manifest['files'] if entry['name'] == name), None)
+        if entry is None:
+            return None
+        if 'chunks' in entry:
+            raw = base64.b64decode(entry['chunks'])
+            return [raw[start:start + 32] for start in range(0, len(raw), 32)]
+        ids = self.chunk_ids(self.manifest(manifest['parent']), name)[:entry['count']]
+        for number, chunk_id in CHANGE.iter_unpack(base64.b64decode(entry['changes'])):
+            if number < len(ids):
+                ids[number] = chunk_id
+            else:
+                ids.append(chunk_id)
+        return ids
+
+    def read_chunk(self, chunk_id):
+        try:
+            pack, offset, length = self.index[chunk_id]
+        except KeyError:
+            raise BackupError(f"Chunk {chunk_id.hex()} is missing from the repository")
+        file = self._packs.get(pack)
+        if file is None:
+            file = self._packs[pack] = open(os.path.join(self.path, 'packs', pack + '.pack'), 'rb')
+        file.seek(offset)
+        data = zlib.decompress(self._unseal(file.read(length), chunk_id, f"Chunk {chunk_id.hex()}"))
+        if not hmac.compare_digest(hmac.digest(self.mac_key, data, 'sha256'), chunk_id):
+            raise BackupError(f"Chunk {chunk_id.hex()} does not match its id")
+        return data
+
+    def backup(self, files=None):
+        """Store a new snapshot of files ((name, path) pairs; default vault_files()) and return its stats."""
+        started = time.perf_counter()
+        files = vault_files() if files is None else files
+        snapshots = self.snapshots()
+        parent = self.manifest(snapshots[-1]) if snapshots else None
+        delta = parent is not None and parent['depth'] + 1 < FULL_EVERY
+        snapshot_id = f"{datetime.datetime.now(datetime.timezone.utc).strftime(SNAPSHOT_TIME)}-{os.urandom(3).hex()}"
+        pack_path = os.path.join(self.path, 'packs', snapshot_id + '.pack')
+        new = {}
+        entries = []
+        chunks = bytes_read = 0
+        with open(pack_path + '.tmp', 'wb') as pack:
+            for name, path in files:
+                with open(path, 'rb') as probe:
+                    database = _page_size(probe) is not None
+                with (_pinned(path) if database else open(path, 'rb')) as file:
+                    chunk_size = _page_size(file) or FILE_CHUNK
+                    digest = hashlib.sha256()
+                    ids = []
+                    size = 0
+                    for data in _read_chunks(file, chunk_size):
+                        digest.update(data)
+                        size += len(data)
+                        chunk_id = hmac.digest(self.mac_key, data, 'sha256')
+                        if chunk_id not in self.index and chunk_id not in new:
+                            blob = self._seal(zlib.compress(data, COMPRESS_LEVEL), chunk_id)
+                            new[chunk_id] = (pack.tell(), len(blob))
+                            pack.write(blob)
+                        ids.append(chunk_id)
+                entry = {'name': name, 'size': size, 'chunk_size': chunk_size, 'sha256': digest.hexdigest(), 'count': len(ids)}
+                previous = self.chunk_ids(parent, name) if delta else None
+                if previous is None:
+                    entry['chunks'] = base64.b64encode(b''.join(ids)).decode('ascii')
+                else:
+                    changes = b''.join(CHANGE.pack(number, chunk_id) for number, chunk_id in enumerate(ids)
+                                       if number >= len(previous) or previous[number] != chunk_id)
+                    entry['changes'] = base64.b64encode(changes).decode('ascii')
+                entries.append(entry)
+                chunks += len(ids)
+                bytes_read += size
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        bytes_written = 0
+        if new:
+            os.replace(pack_path + '.tmp', pack_path)
+            records = b''.join(INDEX_RECORD.pack(chunk_id, offset, length) for chunk_id, (offset, length) in new.items())
+            index = self._seal(zlib.compress(records), b'index:' + snapshot_id.encode())
+            _write_atomic(os.path.join(self.path, 'packs', snapshot_id + '.idx'), index)
+            self.index.update((chunk_id, (snapshot_id, offset, length)) for chunk_id, (offset, length) in new.items())
+            bytes_written += os.path.getsize(pack_path) + len(index)
+        else:
+            os.remove(pack_path + '.tmp')
+        manifest = {
+            'id': snapshot_id,
+            'parent': snapshots[-1] if delta else None,
+            'depth': parent['depth'] + 1 if delta else 0,
+            'files': entries,
+            'new_chunks': len(new),
+        }
+        sealed = self._seal(zlib.compress(json.dumps(manifest).encode('utf-8')), b'snapshot:' + snapshot_id.encode())
+        bytes_written += len(sealed)
+        _write_atomic(os.path.join(self.path, 'snapshots', snapshot_id), sealed)
+        self._manifests[snapshot_id] = manifest
+        return BackupStats(snapshot_id, len(entries), chunks, len(new), bytes_read, bytes_written, time.perf_counter() - started)
+
+    def _stream(self, manifest, entry, write):
+        """Feed file entry of manifest to write chunk by chunk; returns its SHA-256 hex digest."""
+        digest = hashlib.sha256()
+        for chunk_id in self.chunk_ids(manifest, entry['name']):
+            data = self.read_chunk(chunk_id)
+            digest.update(data)
+            write(data)
+        return digest.hexdigest()
+
+    def restore(self, snapshot_id, directory):
+        """Write every file of the snapshot under directory, which must not already hold them."""
+        manifest = self.manifest(snapshot_id)
+        targets = [os.path.join(directory, entry['name']) for entry in manifest['files']]
+        existing = [target for target in targets if os.path.exists(target)]
+        if existing:
+            raise BackupError(f"Refusing to overwrite {', '.join(existing)}")
+        for entry, target in zip(manifest['files'], targets):
+            os.makedirs(os.path.dirname(target) or '.', mode=0o700, exist_ok=True)
+            fd = os.open(target + '.partial', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as out:
+                digest = self._stream(manifest, entry, out.write)
+                out.flush()
+                os.fsync(out.fileno())
+            if digest != entry['sha256']:
+                os.remove(target + '.partial')
+                raise BackupError(f"{entry['name']} restored with the wrong checksum")
+            os.replace(target + '.partial', target)
+        return targets
+
+    def verify(self, snapshot_id, integrity=False):
+        """Check every chunk of the snapshot decrypts, matches its id and adds up to each file's checksum.
+
+        With integrity, also restore the snapshot to a temporary directory
+        and run SQLite's integrity check on its databases. Returns a list of
+        problems; empty means the snapshot is sound.
+        """
+        manifest = self.manifest(snapshot_id)
+        problems = []
+        for entry in manifest['files']:
+            try:
+                if self._stream(manifest, entry, lambda data: None) != entry['sha256']:
+                    problems.append(f"{entry['name']}: checksum mismatch")
+            except BackupError as exc:
+                problems.append(f"{entry['name']}: {exc}")
+        if integrity and not problems:
+            with tempfile.TemporaryDirectory() as tmp:
+                for path in self.restore(snapshot_id, tmp):
+                    with open(path, 'rb') as file:
+                        if _page_size(file) is None:
+                            continue
+                    with contextlib.closing(sqlite3.connect(path)) as conn:
+                        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+                    if result != 'ok':
+                        problems.append(f"{os.path.relpath(path, tmp)}: {result}")
+        return problems
+
+
+def _passphrase(confirm=False):
+    passphrase = os.environ.get('ENCRYPTO_BACKUP_PASSPHRASE')
+    if passphrase:
+        return passphrase
+    passphrase = pwinput.pwinput("Backup passphrase: ")
+    if confirm and pwinput.pwinput("Confirm backup passphrase: ") != passphrase:
+        raise BackupError("Passphrases do not match")
+    return passphrase
+
+
+def _parse_time(value):
+    # Times without a zone are local time, as typed.
+    moment = datetime.datetime.fromisoformat(value)
+    return moment.astimezone(datetime.timezone.utc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental encrypted backups of the vault.")
+    parser.add_argument('repository')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('init', help="create an empty repository")
+    commands.add_parser('create', help="back up the database, keyring and shards")
+    commands.add_parser('list', help="list snapshots")
+    restore_parser = commands.add_parser('restore', help="restore a snapshot into a directory")
+    restore_parser.add_argument('directory')
+    restore_parser.add_argument('--snapshot')
+    restore_parser.add_argument('--at', type=_parse_time, help="restore the last snapshot taken at or before this ISO 8601 time")
+    verify_parser = commands.add_parser('verify', help="check a snapshot (default: the latest) can be restored")
+    verify_parser.add_argument('--snapshot')
+    verify_parser.add_argument('--all', action='store_true', help="check every snapshot")
+    verify_parser.add_argument('--integrity', action='store_true', help="also restore to a temporary directory and run SQLite's integrity check")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'init':
+            Repository.init(args.repository, _passphrase(confirm=True)).close()
+            print(f"Created backup repository {args.repository}.")
+            return
+        with Repository.open(args.repository, _passphrase()) as repository:
+            if args.command == 'create':
+                stats = repository.backup()
+                print(f"Snapshot {stats.snapshot}: {stats.files} files, {stats.bytes_read / 1e6:.1f} MB read, "
+                      f"{stats.new_chunks} of {stats.chunks} chunks new, {stats.bytes_written / 1e6:.2f} MB written "
+                      f"in {stats.seconds:.2f}s.")
+            elif args.command == 'list':
+                for snapshot in repository.snapshots():
+                    manifest = repository.manifest(snapshot)
+                    size = sum(entry['size'] for entry in manifest['files'])
+                    print(f"{snapshot}  {snapshot_time(snapshot).astimezone():%Y-%m-%d %H:%M:%S}  "
+                          f"{len(manifest['files'])} files  {size / 1e6:.1f} MB  {manifest['new_chunks']} new chunks")
+            elif args.command == 'restore':
+                snapshot = args.snapshot or repository.find_snapshot(args.at)
+                for path in repository.restore(snapshot, args.directory):
+                    print(f"Restored {path}")
+                print(f"Snapshot {snapshot} restored. Point DATABASE_URL at the restored database and run from {args.directory}.")
+            else:
+                snapshots = repository.snapshots() if args.all else [args.snapshot or repository.find_snapshot()]
+                failed = False
+                for snapshot in snapshots:
+                    problems = repository.verify(snapshot, args.integrity)
+                    print(f"{snapshot}: {'ok' if not problems else 'FAILED'}")
+                    for problem in problems:
+                        print(f"  {problem}")
+                    failed = failed or bool(problems)
+                if failed:
+                    parser.exit(1)
+    except BackupError as exc:
+        parser.exit(1, f"{exc}\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import os
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.models import Base
+from search import ensure_search_schema
+from sync import ensure_sync_schema
+
+# Every entry point shares the engine built here. Point DATABASE_URL at
+# another database to move the vault, e.g. sqlite:////var/lib/encrypto/passwords.db
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///passwords.db')
+POOL_SIZE = int(os.environ.get('ENCRYPTO_POOL_SIZE', 5))
+
+DB_DIR = os.path.dirname(os.path.abspath(__file__))
+# Latest revision in db/alembic/versions. A database already at it skips
+# the (slow to import) Alembic machinery entirely.
+SCHEMA_REVISION = '0004'
+BASELINE_REVISION = '0001'
+
+# WAL lets readers keep going while a write is in progress, and with
+# synchronous=NORMAL a commit no longer waits for an fsync (only checkpoints
+# do), at the cost of possibly losing the last commits on power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative values are KiB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+Session = sessionmaker(expire_on_commit=False)
+
+_engine = None
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def make_engine(url=None, **kwargs):
+    """Create an engine for url (default DATABASE_URL) with the tuned SQLite settings."""
+    url = url or DATABASE_URL
+    if url.startswith('sqlite'):
+        kwargs.setdefault('connect_args', {'check_same_thread': False})
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            # Every connection to :memory: is a separate database, so share one.
+            kwargs.setdefault('poolclass', StaticPool)
+        else:
+            kwargs.setdefault('pool_size', POOL_SIZE)
+            kwargs.setdefault('max_overflow', POOL_SIZE * 2)
+    engine = create_engine(url, **kwargs)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _apply_pragmas)
+    return engine
+
+
+def async_url(url=None):
+    """Translate a database URL to its asyncio driver, e.g. sqlite:// -> sqlite+aiosqlite://."""
+    url = url or DATABASE_URL
+    if url.startswith('sqlite:'):
+        return 'sqlite+aiosqlite:' + url[len('sqlite:'):]
+    return url
+
+
+def make_async_engine(url=None, **kwargs):
+    """Async counterpart of make_engine, applying the same SQLite pragmas."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(async_url(url), **kwargs)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine.sync_engine, 'connect', _apply_pragmas)
+    return engine
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = make_engine()
+        Session.configure(bind=_engine)
+    return _engine
+
+
+def alembic_config(connection=None):
+    from alembic.config import Config
+
+    config = Config(os.path.join(DB_DIR, 'alembic.ini'))
+    config.attributes['connection'] = connection
+    return config
+
+
+def migrate(engine):
+    """Bring engine's schema to SCHEMA_REVISION with the Alembic migrations."""
+    with engine.connect() as conn:
+        tables = inspect(conn).get_table_names()
+        revision = None
+        if 'alembic_version' in tables:
+            revision = conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    if revision == SCHEMA_REVISION:
+        return
+
+    from alembic import command
+
+    if 'users' not in tables:
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            command.stamp(alembic_config(conn), 'head')
+        return
+    if revision is None:
+        # Made by create_all before migrations were tracked; the search
+        # columns it may lack are part of the baseline.
+        ensure_search_schema(engine)
+        with engine.begin() as conn:
+            command.stamp(alembic_config(conn), BASELINE_REVISION)
+    with engine.begin() as conn:
+        command.upgrade(alembic_config(conn), 'head')
+
+
+def init_db(engine=None):
+    """Migrate engine (default: the shared engine) to the current schema and set up search and sync."""
+    engine = engine or get_engine()
+    migrate(engine)
+    Base.metadata.create_all(engine)
+    ensure_search_schema(engine)
+    ensure_sync_schema(engine)
+    return engine
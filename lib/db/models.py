@@ -0,0 +1,136 @@
+import uuid
+
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, ForeignKey, Index, DateTime, event
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import backref, relationship, validates
+
+import crypto
+import hashing
+from cache import decryption_cache
+
+Base = declarative_base()
+
+
+def normalize_website(website):
+    return (website or '').strip().lower()
+
+
+class User(Base):
+    __tablename__ = 'users'
+    # Entries point at the surrogate id, so renaming a user touches one row.
+    id = Column(Integer, primary_key=True)
+    username = Column(String, unique=True, nullable=False)
+    password_hash = Column(String)
+    # The user's data key, wrapped under a key derived from their password
+    # with key_kdf's parameters and key_salt (see userkeys.py). None until
+    # their first login since per-user keys were introduced.
+    data_key = Column(String)
+    key_salt = Column(String)
+    key_kdf = Column(String)
+
+    def set_password(self, password):
+        self.password_hash = hashing.hash_password(password)
+
+    def check_password(self, password):
+        return hashing.check_password(password, self.password_hash)
+
+    def needs_rehash(self):
+        return hashing.needs_rehash(self.password_hash)
+
+class Password(Base):
+    __tablename__ = 'passwords'
+    __table_args__ = (
+        Index('ix_passwords_user_id_website_key', 'user_id', 'website_key'),
+        Index('ix_passwords_sync_id', 'sync_id', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    website = Column(String)
+    # Lowercased copy of website, kept in sync by the validator below so
+    # searches can use the (user_id, website_key) index.
+    website_key = Column(String)
+    username = Column(String)
+    password_hash = Column(String)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # Deleting a user deletes their entries in bulk (see cli.delete_account)
+    # rather than loading them all to null out their owner.
+    user = relationship("User", backref=backref("passwords", passive_deletes=True))
+    # Sync identity and version (see sync.py): an id shared by every copy of
+    # the entry across devices, and the hybrid logical clock reading and
+    # replica of its last change. The sync triggers stamp hlc and origin.
+    sync_id = Column(String, default=lambda: uuid.uuid4().hex)
+    hlc = Column(BigInteger)
+    origin = Column(String)
+
+    @validates('website')
+    def _sync_website_key(self, _, website):
+        self.website_key = normalize_website(website)
+        return website
+
+    def set_password(self, password):
+        encrypted_password = crypto.encrypt_for(self.user_id, password.encode('utf-8'))
+        self.password_hash = encrypted_password.decode('utf-8')
+        decryption_cache.invalidate(self.id)
+
+    def get_decrypted_password(self):
+        cached = decryption_cache.get(self.id, self.password_hash)
+        if cached is not None:
+            return cached
+        decrypted_password = crypto.decrypt_for(self.user_id, self.password_hash.encode('utf-8')).decode('utf-8')
+        decryption_cache.put(self.id, self.password_hash, decrypted_password)
+        return decrypted_password
+
+
+@event.listens_for(Password, 'after_delete')
+def _forget_deleted_password(mapper, connection, target):
+    decryption_cache.invalidate(target.id)
+
+class KeyRotation(Base):
+    __tablename__ = 'key_rotations'
+    id = Column(Integer, primary_key=True)
+    # Fingerprint of the key entries are being re-encrypted to.
+    key_fingerprint = Column(String, nullable=False)
+    # Highest passwords.id already re-encrypted; committed with each batch so
+    # an interrupted rotation resumes from here.
+    last_id = Column(Integer, nullable=False, default=0)
+    rows_rotated = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
+class SyncLog(Base):
+    """Append-only log of entry changes, one row per insert, update or delete.
+
+    seq never repeats (AUTOINCREMENT), since peers acknowledge changes by it.
+    Rows with deleted set are tombstones, kept so a delete wins over older
+    copies of the entry still on other devices.
+    """
+    __tablename__ = 'sync_log'
+    __table_args__ = (
+        Index('ix_sync_log_user_id_seq', 'user_id', 'seq'),
+        Index('ix_sync_log_sync_id_seq', 'sync_id', 'seq'),
+        Index('ix_sync_log_hlc', 'hlc'),
+        {'sqlite_autoincrement': True},
+    )
+    seq = Column(Integer, primary_key=True)
+    sync_id = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    hlc = Column(BigInteger, nullable=False)
+    origin = Column(String, nullable=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+
+
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+    key = Column(String, primary_key=True)
+    value = Column(String)
+
+
+class SyncPeer(Base):
+    """Checkpoints with another replica, per user."""
+    __tablename__ = 'sync_peers'
+    peer_id = Column(String, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    # Highest seq of the peer's log applied here without gaps.
+    received_seq = Column(Integer, nullable=False, default=0)
+    # Highest seq of this replica's log the peer reports having applied.
+    acked_seq = Column(Integer, nullable=False, default=0)
@@ -1,15 +1,9 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from lib.cli import Base, User, Password, cipher_suite
+from db.database import Session, init_db
+from db.models import User, Password
+from userkeys import unlock
 
-# Create a new SQLAlchemy engine instance
-engine = create_engine('sqlite:///passwords.db')
-
-# Create all tables in the engine
-Base.metadata.create_all(engine)
-
-# Create a configured "Session" class
-Session = sessionmaker(bind=engine)
+# Create all tables and indexes in the shared engine
+init_db()
 
 # Create a Session
 session = Session()
@@ -23,27 +17,33 @@ sample_users = [
 ]
 
 sample_passwords = [
-    {"website": "example.com", "username": "user2@example.com", "password": "examplePass1", "user_id": "stephy_kamau"},
-    {"website": "test.com", "username": "user3@test.com", "password": "testPass2", "user_id": "joseph_wanini"},
-    {"website": "demo.com", "username": "user4@demo.com", "password": "demoPass3", "user_id": "abdulbarik_mohamed"},
-    {"website": "facebook.com", "username": "user5@facebook.com", "password": "fbUser1Pass", "user_id": "victor_gachure"},
-    {"website": "twitter.com", "username": "user2@twitter.com", "password": "twUser2Pass", "user_id": "stephy_maina"},
-    {"website": "linkedin.com", "username": "user3@linkedin.com", "password": "lnUser3Pass", "user_id": "joseph_wanini"},
-    {"website": "github.com", "username": "user4@github.com", "password": "ghUser1Pass", "user_id": "abdulbarik_mohamed"},
-    {"website": "gmail.com", "username": "user5@gmail.com", "password": "gmailUser2Pass", "user_id": "victor_gachure"},
-    {"website": "yahoo.com", "username": "user2@yahoo.com", "password": "yahooUser3Pass", "user_id": "stephy_maina"},
+    {"website": "example.com", "username": "user2@example.com", "password": "examplePass1", "owner": "stephy_kamau"},
+    {"website": "test.com", "username": "user3@test.com", "password": "testPass2", "owner": "joseph_wanini"},
+    {"website": "demo.com", "username": "user4@demo.com", "password": "demoPass3", "owner": "abdulbarik_mohamed"},
+    {"website": "facebook.com", "username": "user5@facebook.com", "password": "fbUser1Pass", "owner": "victor_gachure"},
+    {"website": "twitter.com", "username": "user2@twitter.com", "password": "twUser2Pass", "owner": "stephy_kamau"},
+    {"website": "linkedin.com", "username": "user3@linkedin.com", "password": "lnUser3Pass", "owner": "joseph_wanini"},
+    {"website": "github.com", "username": "user4@github.com", "password": "ghUser1Pass", "owner": "abdulbarik_mohamed"},
+    {"website": "gmail.com", "username": "user5@gmail.com", "password": "gmailUser2Pass", "owner": "victor_gachure"},
+    {"website": "yahoo.com", "username": "user2@yahoo.com", "password": "yahooUser3Pass", "owner": "stephy_kamau"},
 ]
 
 # Insert sample data into the database
+users = {}
 for user_data in sample_users:
     user = User(username=user_data["username"])
     user.set_password(user_data["password"])
     session.add(user)
+    users[user.username] = user
 
 session.commit()
 
+# Give each user a data key and unlock it, so their entries can be encrypted
+for user_data in sample_users:
+    unlock(session, users[user_data["username"]], user_data["password"])
+
 for password_data in sample_passwords:
-    password = Password(website=password_data["website"], username=password_data["username"], user_id=password_data["user_id"])
+    password = Password(website=password_data["website"], username=password_data["username"], user_id=users[password_data["owner"]].id)
     password.set_password(password_data["password"])
     session.add(password)
 
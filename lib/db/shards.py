@@ -0,0 +1,80 @@
+import collections
+import os
+import re
+import threading
+
+from db.database import Session, get_engine, init_db, make_engine
+
+# Optional per-user partitioning. With ENCRYPTO_SHARD_DIR set, each user's
+# entries live in a SQLite file of their own in that directory, while
+# accounts stay in the shared database. A user's queries then only ever
+# touch their own file, so their latency does not grow with the number of
+# other users, and deleting an account deletes one file.
+SHARD_DIR = os.environ.get('ENCRYPTO_SHARD_DIR')
+MAX_OPEN_SHARDS = int(os.environ.get('ENCRYPTO_MAX_OPEN_SHARDS', 64))
+
+_SHARD_FILE = re.compile(r'^user-(\d+)\.db$')
+
+
+class ShardRouter:
+    """Maps user ids to shard engines, keeping at most max_open engines open."""
+
+    def __init__(self, directory, max_open=MAX_OPEN_SHARDS):
+        self.directory = directory
+        self.max_open = max_open
+        self._engines = collections.OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def path_for(self, user_id):
+        return os.path.join(self.directory, f"user-{int(user_id)}.db")
+
+    def engine_for(self, user_id):
+        with self._lock:
+            engine = self._engines.get(user_id)
+            if engine is not None:
+                self._engines.move_to_end(user_id)
+                return engine
+            engine = make_engine(f"sqlite:///{self.path_for(user_id)}", pool_size=2, max_overflow=2)
+            # Shards share the full schema (and its migrations) with the
+            # main database; only their passwords table is used.
+            init_db(engine)
+            self._engines[user_id] = engine
+            while len(self._engines) > self.max_open:
+                _, evicted = self._engines.popitem(last=False)
+                evicted.dispose()
+            return engine
+
+    def session_for(self, user_id):
+        return Session(bind=self.engine_for(user_id))
+
+    def user_ids(self):
+        """Ids of every user with a shard file, in id order."""
+        found = (_SHARD_FILE.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in found if match)
+
+    def drop(self, user_id):
+        with self._lock:
+            engine = self._engines.pop(user_id, None)
+            if engine is not None:
+                engine.dispose()
+        path = self.path_for(user_id)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+router = ShardRouter(SHARD_DIR) if SHARD_DIR else None
+
+
+def open_session(user_id):
+    """A new session for user_id's entries: on their shard when sharding is on, else the shared database."""
+    return router.session_for(user_id) if router else Session(bind=get_engine())
+
+
+def entry_sessions():
+    """Sessions covering every entry: the shared database and then each shard."""
+    yield Session(bind=get_engine())
+    if router:
+        for user_id in router.user_ids():
+            yield router.session_for(user_id)
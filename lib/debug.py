@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 # lib/debug.py
 
-from models.__init__ import CONN, CURSOR
+from db.database import Session, init_db
+from db.models import User, Password
 import ipdb
 
+init_db()
+session = Session()
 
 ipdb.set_trace()
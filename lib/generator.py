@@ -0,0 +1,166 @@
+import argparse
+import functools
+import math
+import os
+import string
+import sys
+
+DEFAULT_LENGTH = 12
+DEFAULT_CLASSES = (string.ascii_lowercase, string.ascii_uppercase, string.digits, string.punctuation)
+AMBIGUOUS = 'Il1O0|`\'"'
+PASSPHRASE_WORDS = 6
+
+# Random bytes are drawn from os.urandom in blocks of this size and shared
+# across every password in a batch instead of one syscall per character.
+BLOCK_SIZE = 1 << 16
+
+
+class RandomSource:
+    """Buffered os.urandom with unbiased draws."""
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.buffer = b''
+        self.position = 0
+
+    def take(self, count):
+        if self.position + count > len(self.buffer):
+            self.buffer = self.buffer[self.position:] + os.urandom(max(self.block_size, count))
+            self.position = 0
+        chunk = self.buffer[self.position:self.position + count]
+        self.position += count
+        return chunk
+
+    def below(self, bound):
+        """Uniform integer in [0, bound) by rejection sampling."""
+        width = max(1, math.ceil(bound.bit_length() / 8))
+        span = 256 ** width
+        limit = span - span % bound
+        while True:
+            value = int.from_bytes(self.take(width), 'big')
+            if value < limit:
+                return value % bound
+
+    def choices(self, alphabet, count):
+        """count characters drawn uniformly from alphabet."""
+        if len(alphabet) <= 256 and alphabet.isascii():
+            return self._ascii_choices(alphabet, count)
+        return ''.join(alphabet[self.below(len(alphabet))] for _ in range(count))
+
+    def _ascii_choices(self, alphabet, count):
+        # bytes.translate maps every accepted byte to its character and drops
+        # the bytes above the largest multiple of len(alphabet), all in C.
+        table, rejected = _translation(alphabet)
+        limit = 256 - len(rejected)
+        result = b''
+        while len(result) < count:
+            needed = count - len(result)
+            # Ask for enough bytes that rejections rarely force another pass.
+            result += self.take(needed * 256 // limit + 16).translate(table, rejected)
+        return result[:count].decode('ascii')
+
+
+@functools.lru_cache(maxsize=64)
+def _translation(alphabet):
+    size = len(alphabet)
+    limit = 256 - 256 % size
+    return bytes(ord(alphabet[value % size]) for value in range(256)), bytes(range(limit, 256))
+
+
+def build_alphabet(classes=DEFAULT_CLASSES, exclude=''):
+    seen = dict.fromkeys(''.join(classes))
+    return ''.join(char for char in seen if char not in exclude)
+
+
+def generate_passwords(count, length=DEFAULT_LENGTH, classes=DEFAULT_CLASSES, exclude='', require_each_class=True, source=None):
+    """Generate count passwords of length characters drawn from classes.
+
+    With require_each_class, every password contains at least one character
+    of each class: one character per class is placed at a random distinct
+    position and the remaining positions are drawn from the whole alphabet,
+    so no password is ever thrown away and regenerated.
+    """
+    # Size the first read to the batch so one-off calls don't pull a full block.
+    source = source or RandomSource(min(BLOCK_SIZE, 2 * count * (length + len(classes)) + 64))
+    classes = [''.join(char for char in char_class if char not in exclude) for char_class in classes]
+    classes = [char_class for char_class in classes if char_class]
+    alphabet = build_alphabet(classes)
+    if not alphabet:
+        raise ValueError("The password alphabet is empty.")
+    required = classes if require_each_class else []
+    if len(required) > length:
+        raise ValueError(f"A {length} character password cannot include all {len(required)} character classes.")
+
+    fill = source.choices(alphabet, count * length)
+    picks = [source.choices(char_class, count) for char_class in required]
+    passwords = []
+    for index in range(count):
+        chars = list(fill[index * length:(index + 1) * length])
+        positions = list(range(length))
+        for slot, pick in enumerate(picks):
+            # Partial Fisher-Yates: choose a distinct random position per class.
+            swap = slot + source.below(length - slot)
+            positions[slot], positions[swap] = positions[swap], positions[slot]
+            chars[positions[slot]] = pick[index]
+        passwords.append(''.join(chars))
+    return passwords
+
+
+def generate_password(length=DEFAULT_LENGTH, **policy):
+    return generate_passwords(1, length, **policy)[0]
+
+
+def load_wordlist(path=None):
+    """Words for passphrases: one per line from path, or Faker's English word list."""
+    if path:
+        with open(path, encoding='utf-8') as wordlist:
+            # Accept diceware-style lists ("11111\tword") as well as plain ones.
+            words = [line.split()[-1] for line in wordlist if line.strip()]
+    else:
+        from faker.providers.lorem.en_US import Provider
+        words = Provider.word_list
+    return list(dict.fromkeys(word.lower() for word in words))
+
+
+def generate_passphrases(count, words=PASSPHRASE_WORDS, separator='-', wordlist=None, capitalize=False, source=None):
+    source = source or RandomSource()
+    wordlist = wordlist or load_wordlist()
+    phrases = []
+    for _ in range(count):
+        chosen = [wordlist[source.below(len(wordlist))] for _ in range(words)]
+        if capitalize:
+            chosen = [word.capitalize() for word in chosen]
+        phrases.append(separator.join(chosen))
+    return phrases
+
+
+def entropy_bits(alphabet_size, length):
+    return length * math.log2(alphabet_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate random passwords or passphrases in bulk.")
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--length', type=int, default=DEFAULT_LENGTH)
+    parser.add_argument('--no-symbols', action='store_true')
+    parser.add_argument('--no-ambiguous', action='store_true', help=f"leave out look-alike characters ({AMBIGUOUS})")
+    parser.add_argument('--passphrase', action='store_true')
+    parser.add_argument('--words', type=int, default=PASSPHRASE_WORDS)
+    parser.add_argument('--wordlist', help="file with one word per line (e.g. the EFF long list)")
+    args = parser.parse_args()
+
+    if args.passphrase:
+        wordlist = load_wordlist(args.wordlist)
+        results = generate_passphrases(args.count, args.words, wordlist=wordlist)
+        bits = entropy_bits(len(wordlist), args.words)
+    else:
+        classes = DEFAULT_CLASSES[:3] if args.no_symbols else DEFAULT_CLASSES
+        exclude = AMBIGUOUS if args.no_ambiguous else ''
+        results = generate_passwords(args.count, args.length, classes, exclude)
+        bits = entropy_bits(len(build_alphabet(classes, exclude)), args.length)
+    print('\n'.join(results))
+    print(f"~{bits:.0f} bits of entropy each", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# Cost factor for new account password hashes; each step doubles the work.
+# Pick a value for this host with: python hashing.py calibrate
+DEFAULT_ROUNDS = 12
+BCRYPT_ROUNDS = int(os.environ.get('ENCRYPTO_BCRYPT_ROUNDS', DEFAULT_ROUNDS))
+
+_executor = None
+
+
+def hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def check_password(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def hash_rounds(password_hash):
+    # bcrypt hashes look like $2b$12$<salt+digest>
+    return int(password_hash.split('$')[2])
+
+
+def needs_rehash(password_hash, rounds=None):
+    return hash_rounds(password_hash) < (rounds or BCRYPT_ROUNDS)
+
+
+def executor():
+    """Shared thread pool for hashing. bcrypt releases the GIL, so hashes run in parallel."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='bcrypt')
+    return _executor
+
+
+def submit_hash(password, rounds=None):
+    return executor().submit(hash_password, password, rounds)
+
+
+def submit_check(password, password_hash):
+    return executor().submit(check_password, password, password_hash)
+
+
+async def hash_password_async(password, rounds=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor(), functools.partial(hash_password, password, rounds))
+
+
+async def check_password_async(password, password_hash):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor(), check_password, password, password_hash)
+
+
+def time_rounds(rounds, samples=3):
+    password = b'calibration-password'
+    best = None
+    for _ in range(samples):
+        salt = bcrypt.gensalt(rounds)
+        started = time.perf_counter()
+        bcrypt.hashpw(password, salt)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(target_ms=250, min_rounds=10, max_rounds=18):
+    """Return the highest cost factor whose hash time on this host stays within target_ms."""
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        elapsed_ms = time_rounds(rounds) * 1000
+        if elapsed_ms > target_ms:
+            break
+        chosen = rounds
+        # Each extra round doubles the cost, so skip timing one that will miss.
+        if elapsed_ms * 2 > target_ms:
+            break
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bcrypt cost factor tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help="pick the highest cost that meets a latency target")
+    calibrate_parser.add_argument('--target-ms', type=float, default=250)
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        rounds = calibrate(args.target_ms)
+        print(f"Cost {rounds} takes {time_rounds(rounds) * 1000:.0f} ms per hash on this host.")
+        print(f"export ENCRYPTO_BCRYPT_ROUNDS={rounds}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import atexit
+import bisect
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Profiling is opt-in: nothing in this module is imported, let alone wrapped,
+# unless ENCRYPTO_PROFILE is set or cli.py is started with --profile, so the
+# hot paths carry no instrumentation cost by default. enable() swaps timing
+# wrappers onto the measured methods at run time and hooks engine events.
+#
+#   ENCRYPTO_PROFILE=1               summary table on stderr at exit
+#   ENCRYPTO_PROFILE=profile.json    JSON file
+#   ENCRYPTO_PROFILE=profile.prom    Prometheus text exposition format
+PROFILE_ENV = 'ENCRYPTO_PROFILE'
+
+# Upper bounds in seconds, Prometheus style; the last bucket is +Inf.
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile (max for the +Inf bucket)."""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    """Latency histograms keyed by (metric, label value)."""
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, metric, label, seconds):
+        with self._lock:
+            histogram = self.histograms.get((metric, label))
+            if histogram is None:
+                histogram = self.histograms[metric, label] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(self.histograms.items())
+
+
+registry = Registry()
+_patched = []
+_output = None
+
+
+def timed(fn, label, metric='operation'):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            registry.observe(metric, label, time.perf_counter() - started)
+    return wrapper
+
+
+def instrument(owner, name, label):
+    original = owner.__dict__[name]
+    setattr(owner, name, timed(original, label))
+    _patched.append((owner, name, original))
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_started'].pop()
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    registry.observe('db_query', kind, time.perf_counter() - started)
+
+
+def enable(output=None):
+    """Start recording; output is where dump() writes at exit (see PROFILE_ENV)."""
+    global _output
+    if _patched:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    import crypto
+    import userkeys
+    from db.models import Password, User
+    from table import TableRenderer
+
+    instrument(Password, 'set_password', 'password_set')
+    instrument(Password, 'get_decrypted_password', 'password_decrypt')
+    instrument(User, 'set_password', 'user_set_password')
+    instrument(User, 'check_password', 'user_check_password')
+    instrument(crypto, 'encrypt', 'fernet_encrypt')
+    instrument(crypto, 'decrypt', 'fernet_decrypt')
+    instrument(crypto, 'encrypt_for', 'fernet_encrypt_for_user')
+    instrument(crypto, 'decrypt_for', 'fernet_decrypt_for_user')
+    instrument(userkeys, 'derive_wrapping_key', 'data_key_derive')
+    instrument(TableRenderer, 'render', 'table_draw')
+    event.listen(Engine, 'before_cursor_execute', _before_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_execute)
+    _output = output
+    atexit.register(dump)
+
+
+def enable_from_env():
+    if os.environ.get(PROFILE_ENV):
+        enable(os.environ[PROFILE_ENV])
+
+
+def disable():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    while _patched:
+        owner, name, original = _patched.pop()
+        setattr(owner, name, original)
+    event.remove(Engine, 'before_cursor_execute', _before_execute)
+    event.remove(Engine, 'after_cursor_execute', _after_execute)
+    atexit.unregister(dump)
+
+
+def _cache_stats():
+    from cache import decryption_cache
+    return decryption_cache.stats()
+
+
+def to_json():
+    return {
+        'metrics': [
+            {
+                'metric': metric, 'label': label, 'count': histogram.count, 'sum_seconds': histogram.sum,
+                'max_seconds': histogram.max, 'p50_seconds': histogram.quantile(0.5), 'p99_seconds': histogram.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts)),
+            }
+            for (metric, label), histogram in registry.snapshot()
+        ],
+        'decryption_cache': _cache_stats(),
+    }
+
+
+def to_prometheus():
+    label_names = {'operation': 'op', 'db_query': 'statement'}
+    lines = []
+    families = {}
+    for (metric, label), histogram in registry.snapshot():
+        families.setdefault(metric, []).append((label, histogram))
+    for metric, histograms in families.items():
+        name = f"encrypto_{metric}_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for label, histogram in histograms:
+            labels = f'{label_names[metric]}="{label}"'
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    stats = _cache_stats()
+    for key in ('hits', 'misses', 'evictions'):
+        lines.append(f"# TYPE encrypto_decryption_cache_{key}_total counter")
+        lines.append(f"encrypto_decryption_cache_{key}_total {stats[key]}")
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    lines = [f"{'metric':<32}{'count':>8}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for (metric, label), histogram in registry.snapshot():
+        lines.append(
+            f"{metric + ':' + label:<32}{histogram.count:>8}{histogram.sum * 1000:>12.2f}"
+            f"{histogram.sum / histogram.count * 1000:>10.3f}{histogram.quantile(0.5) * 1000:>10.3f}"
+            f"{histogram.quantile(0.99) * 1000:>10.3f}{histogram.max * 1000:>10.3f}"
+        )
+    stats = _cache_stats()
+    lines.append(f"decryption cache: {stats['hits']} hits, {stats['misses']} misses, hit rate {stats['hit_rate']:.1%}")
+    return '\n'.join(lines)
+
+
+def dump(output=None):
+    output = output or _output
+    if not output or output == '1':
+        print(summary(), file=sys.stderr)
+    elif output.endswith('.json'):
+        with open(output, 'w') as file:
+            json.dump(to_json(), file, indent=2)
+    else:
+        with open(output, 'w') as file:
+            file.write(to_prometheus())
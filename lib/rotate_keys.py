@@ -0,0 +1,190 @@
+import argparse
+import datetime
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import update, bindparam
+
+import crypto
+from db import shards
+from db.database import Session, init_db
+from db.models import Password, KeyRotation
+from sync import quiet
+from workers import chunks, ordered_pool_map
+
+BATCH_SIZE = 5000
+
+_worker_cipher = {}
+
+
+def _init_worker(keys):
+    _worker_cipher['rotate'] = crypto.build_cipher(keys)
+
+
+def _rotate_batch(rows):
+    """(last row id, updates) for rows, leaving out entries the keyring cannot read.
+
+    Those belong to users with a data key of their own (see userkeys.py),
+    which a keyring rotation does not touch.
+    """
+    cipher = _worker_cipher['rotate']
+    updates = []
+    for row_id, password_hash in rows:
+        try:
+            new_hash = cipher.rotate(password_hash.encode('utf-8'))
+        except InvalidToken:
+            continue
+        updates.append({'row_id': row_id, 'old_hash': password_hash, 'new_hash': new_hash.decode('utf-8')})
+    return rows[-1][0], updates
+
+
+def _read_rows(session, after_id, batch_size, user_id=None):
+    query = session.query(Password.id, Password.password_hash)
+    if user_id is not None:
+        query = query.filter(Password.user_id == user_id)
+    while True:
+        rows = (
+            query
+            .filter(Password.id > after_id)
+            .order_by(Password.id)
+            .limit(batch_size)
+            .all()
+        )
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1].id
+
+
+def start_rotation(session):
+    """Put a fresh primary key in front of the keyring and record the rotation.
+
+    Old keys stay in the keyring, so every entry remains readable while it
+    is being re-encrypted.
+    """
+    rotation = current_rotation(session)
+    if rotation:
+        return rotation
+    new_key = Fernet.generate_key()
+    crypto.save_keys([new_key] + crypto.load_keys())
+    crypto.reload_keys()
+    rotation = KeyRotation(key_fingerprint=crypto.fingerprint(new_key), started_at=datetime.datetime.utcnow())
+    session.add(rotation)
+    session.commit()
+    return rotation
+
+
+def current_rotation(session):
+    return session.query(KeyRotation).filter(KeyRotation.finished_at.is_(None)).order_by(KeyRotation.id.desc()).first()
+
+
+def shard_rotation(session, fingerprint):
+    """The record of the rotation to fingerprint in a shard, created on first use.
+
+    Each shard keeps its own checkpoint in its own key_rotations table; the
+    shared database's record is the one that starts and finishes the
+    rotation as a whole.
+    """
+    rotation = session.query(KeyRotation).filter_by(key_fingerprint=fingerprint).order_by(KeyRotation.id.desc()).first()
+    if rotation is None:
+        rotation = KeyRotation(key_fingerprint=fingerprint, started_at=datetime.datetime.utcnow())
+        session.add(rotation)
+        session.commit()
+    return rotation
+
+
+def run_rotation(session, rotation, batch_size=BATCH_SIZE, workers=None, report=print):
+    """Re-encrypt every entry with the primary key, resuming from the last checkpoint."""
+    if crypto.fingerprint(crypto.get_keys()[0]) != rotation.key_fingerprint:
+        raise RuntimeError("key.key no longer starts with the key this rotation was started for.")
+    statement = (
+        update(Password.__table__)
+        .where(Password.__table__.c.id == bindparam('row_id'))
+        # Entries rewritten since we read them were already encrypted with
+        # the new primary key, so a lost race here is harmless.
+        .where(Password.__table__.c.password_hash == bindparam('old_hash'))
+        .values(password_hash=bindparam('new_hash'))
+    )
+    started = time.perf_counter()
+    done = 0
+    rows = _read_rows(session, rotation.last_id, batch_size)
+    for last_id, batch in ordered_pool_map(_rotate_batch, chunks(rows, batch_size), workers, _init_worker, (crypto.get_keys(),)):
+        if batch:
+            # Same entries, same passwords: nothing for other devices to sync.
+            with quiet(session):
+                session.connection().execute(statement, batch)
+        rotation.last_id = last_id
+        rotation.rows_rotated += len(batch)
+        session.commit()
+        done += len(batch)
+        elapsed = time.perf_counter() - started
+        report(f"Re-encrypted {rotation.rows_rotated} entries (up to id {rotation.last_id}), {done / elapsed:.0f} rows/sec.")
+    rotation.finished_at = datetime.datetime.utcnow()
+    session.commit()
+    return done, time.perf_counter() - started
+
+
+def _readable(cipher, token):
+    try:
+        cipher.decrypt(token)
+    except InvalidToken:
+        return False
+    return True
+
+
+def retire_old_keys(batch_size=BATCH_SIZE):
+    """Drop every key but the primary once no entry depends on them."""
+    primary = Fernet(crypto.get_keys()[0])
+    old_keys = crypto.build_cipher(crypto.get_keys()[1:]) if len(crypto.get_keys()) > 1 else None
+    for entries in shards.entry_sessions():
+        with entries:
+            for row_id, password_hash in _read_rows(entries, 0, batch_size):
+                token = password_hash.encode('utf-8')
+                # Entries under a user's own data key read with no keyring key.
+                if not _readable(primary, token) and old_keys is not None and _readable(old_keys, token):
+                    raise RuntimeError(f"Entry {row_id} is not encrypted with the primary key; run the rotation again first.")
+    crypto.save_keys(crypto.get_keys()[:1])
+    crypto.reload_keys()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rotate the key stored passwords are encrypted with.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="encryption processes (0 to encrypt in this process)")
+    parser.add_argument('--retire', action='store_true', help="remove old keys after checking no entry still needs them")
+    args = parser.parse_args()
+
+    init_db()
+    session = Session()
+
+    if args.retire:
+        if current_rotation(session):
+            parser.exit(1, "A rotation is still in progress; finish it before retiring keys.\n")
+        retire_old_keys(args.batch_size)
+        print("Old keys removed from key.key.")
+        return
+
+    rotation = current_rotation(session)
+    if rotation:
+        print(f"Resuming rotation {rotation.id} from id {rotation.last_id}.")
+    else:
+        rotation = start_rotation(session)
+        print(f"Started rotation {rotation.id} to key {rotation.key_fingerprint}.")
+    done = seconds = 0
+    # Shards go first: the shared database's record finishing is what marks
+    # the whole rotation done, so an interrupted run resumes the same key.
+    if shards.router:
+        for user_id in shards.router.user_ids():
+            with shards.router.session_for(user_id) as shard:
+                shard_record = shard_rotation(shard, rotation.key_fingerprint)
+                if shard_record.finished_at is None:
+                    rows, elapsed = run_rotation(shard, shard_record, args.batch_size, args.workers)
+                    done, seconds = done + rows, seconds + elapsed
+    rows, elapsed = run_rotation(session, rotation, args.batch_size, args.workers)
+    done, seconds = done + rows, seconds + elapsed
+    rate = done / seconds if seconds else done
+    print(f"Rotation complete: {done} entries in {seconds:.2f}s ({rate:.0f} rows/sec). Run with --retire to drop the old keys.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import difflib
+import weakref
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import OperationalError
+
+from db.models import Password, normalize_website
+
+MODES = ('substring', 'prefix', 'fuzzy')
+
+# Trigram FTS5 index over passwords.website_key, kept in sync by triggers so
+# bulk inserts and raw SQL updates are covered as well as ORM writes.
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS passwords_fts USING fts5(
+        website_key, content='passwords', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS passwords_fts_ai AFTER INSERT ON passwords BEGIN
+        INSERT INTO passwords_fts(rowid, website_key) VALUES (new.id, new.website_key);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS passwords_fts_ad AFTER DELETE ON passwords BEGIN
+        INSERT INTO passwords_fts(passwords_fts, rowid, website_key) VALUES ('delete', old.id, old.website_key);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS passwords_fts_au AFTER UPDATE OF website_key ON passwords BEGIN
+        INSERT INTO passwords_fts(passwords_fts, rowid, website_key) VALUES ('delete', old.id, old.website_key);
+        INSERT INTO passwords_fts(rowid, website_key) VALUES (new.id, new.website_key);
+    END""",
+]
+
+_fts_available = weakref.WeakKeyDictionary()
+
+
+def ensure_search_schema(engine):
+    """Bring an existing passwords table up to date with the search columns and indexes."""
+    with engine.begin() as conn:
+        columns = {column['name'] for column in inspect(conn).get_columns('passwords')}
+        if 'website_key' not in columns:
+            # Every write sets website_key, so only rows from before the
+            # column existed need filling in.
+            conn.execute(text("ALTER TABLE passwords ADD COLUMN website_key VARCHAR"))
+            rows = conn.execute(text("SELECT id, website FROM passwords")).fetchall()
+            if rows:
+                conn.execute(
+                    text("UPDATE passwords SET website_key = :key WHERE id = :id"),
+                    [{'id': row.id, 'key': normalize_website(row.website)} for row in rows],
+                )
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_passwords_user_id_website_key ON passwords (user_id, website_key)"
+        ))
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'passwords_fts'"
+            )).first()
+            for statement in FTS_SCHEMA:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text("INSERT INTO passwords_fts(passwords_fts) VALUES ('rebuild')"))
+        _fts_available[engine] = True
+    except OperationalError:
+        # SQLite built without FTS5 or older than 3.34 (no trigram tokenizer);
+        # substring searches fall back to scanning the ownership index.
+        _fts_available[engine] = False
+
+
+def fts_enabled(session):
+    engine = session.get_bind()
+    if engine not in _fts_available:
+        with engine.connect() as conn:
+            found = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'passwords_fts'"
+            )).first()
+        _fts_available[engine] = found is not None
+    return _fts_available[engine]
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_statement(user_id, key, mode='substring', use_fts=False, limit=None):
+    """Build the select for a prefix or substring search on a normalized key."""
+    statement = select(Password).where(Password.user_id == user_id)
+    if mode == 'prefix':
+        statement = statement.where(Password.website_key >= key, Password.website_key < key + '\U0010ffff')
+    elif len(key) >= 3 and use_fts:
+        matches = text("SELECT rowid FROM passwords_fts WHERE passwords_fts MATCH :match")
+        matches = matches.bindparams(match='"' + key.replace('"', '""') + '"')
+        statement = statement.where(Password.id.in_(matches))
+    elif key:
+        statement = statement.where(Password.website_key.like(f"%{_escape_like(key)}%", escape='\\'))
+    statement = statement.order_by(Password.website_key, Password.id)
+    if limit:
+        statement = statement.limit(limit)
+    return statement
+
+
+def fuzzy_candidates_statement(user_id):
+    # Only (id, website_key) is read, which the ownership index covers, so
+    # ranking never touches the encrypted rows.
+    return select(Password.id, Password.website_key).where(Password.user_id == user_id)
+
+
+def rank_fuzzy(candidates, key, limit=10, cutoff=0.6):
+    """Return the ids of the best fuzzy matches for key among (id, website_key) pairs."""
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(key)
+    scored = []
+    for password_id, website_key in candidates:
+        website_key = website_key or ''
+        if key and key in website_key:
+            score = 1.0
+        else:
+            matcher.set_seq1(website_key)
+            if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                continue
+            score = matcher.ratio()
+            if score < cutoff:
+                continue
+        scored.append((score, password_id))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [password_id for _, password_id in scored[:limit]]
+
+
+def search_passwords(session, user_id, query, mode='substring', limit=None):
+    """Return the Password rows owned by user_id whose website matches query.
+
+    Only the returned rows are loaded, so callers decrypt nothing but the hits.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+    key = normalize_website(query)
+    if mode != 'fuzzy':
+        return session.scalars(search_statement(user_id, key, mode, fts_enabled(session), limit)).all()
+
+    ids = rank_fuzzy(session.execute(fuzzy_candidates_statement(user_id)), key, limit or 10)
+    if not ids:
+        return []
+    rows = {row.id: row for row in session.scalars(select(Password).where(Password.id.in_(ids)))}
+    return [rows[password_id] for password_id in ids if password_id in rows]
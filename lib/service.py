@@ -0,0 +1,221 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import Fernet
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import crypto
+import hashing
+import userkeys
+from cache import decryption_cache
+from db.database import init_db, make_async_engine, make_engine
+from db.models import User, Password, normalize_website
+from search import MODES, fuzzy_candidates_statement, rank_fuzzy, search_statement
+from vault import PAGE_SIZE, password_page_statement
+
+
+class ServiceError(Exception):
+    pass
+
+
+class NotFound(ServiceError):
+    pass
+
+
+class AuthenticationFailed(ServiceError):
+    pass
+
+
+class _NoLock:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def _entry(password, plaintext):
+    return {'id': password.id, 'website': password.website, 'username': password.username, 'password': plaintext}
+
+
+class VaultService:
+    """Asyncio API over the vault.
+
+    Database work goes through SQLAlchemy's asyncio engine (aiosqlite) and
+    every Fernet or bcrypt call runs in a thread pool, so the event loop is
+    never blocked on crypto. Methods take the owning user's id, as returned
+    by sign_up() or authenticate(). authenticate() also unlocks the user's
+    data key; once it expires from the key cache (ENCRYPTO_KEY_TTL seconds
+    after last use) their methods raise cache.KeyLocked until they
+    authenticate again. Per-user shards (ENCRYPTO_SHARD_DIR) are not
+    supported; the service works on a single database.
+    """
+
+    def __init__(self, engine, crypto_workers=None, use_fts=False, sync_engine=None):
+        self.engine = engine
+        self.sessions = async_sessionmaker(engine, expire_on_commit=False)
+        # Bulk work that mixes SQL with crypto (moving a user's entries to
+        # their data key) runs in the executor on a synchronous engine.
+        if sync_engine is None:
+            url = engine.url.set(drivername=engine.url.get_backend_name())
+            sync_engine = make_engine(url.render_as_string(hide_password=False))
+        self.sync_engine = sync_engine
+        self.sync_sessions = sessionmaker(sync_engine)
+        self.executor = ThreadPoolExecutor(max_workers=crypto_workers or os.cpu_count(), thread_name_prefix='vault-crypto')
+        self.use_fts = use_fts
+        # SQLite allows one writer at a time; queueing writers here instead of
+        # in SQLite's busy handler (which sleeps and retries) keeps write tail
+        # latency down under many concurrent clients.
+        self._write_lock = asyncio.Lock() if engine.dialect.name == 'sqlite' else _NoLock()
+
+    @classmethod
+    async def create(cls, url=None, **kwargs):
+        from db import shards
+
+        if shards.router is not None:
+            raise ServiceError("VaultService does not support ENCRYPTO_SHARD_DIR")
+        # Schema setup reuses the synchronous helpers; the service keeps the
+        # engine for its executor work.
+        sync_engine = make_engine(url)
+        init_db(sync_engine)
+        engine = make_async_engine(url)
+        async with engine.connect() as conn:
+            found = await conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'passwords_fts'"))
+            use_fts = found.first() is not None
+        return cls(engine, use_fts=use_fts, sync_engine=sync_engine, **kwargs)
+
+    async def close(self):
+        await self.engine.dispose()
+        self.sync_engine.dispose()
+        self.executor.shutdown(wait=False)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _encrypt(self, user_id, plaintext):
+        token = await self._run(crypto.encrypt_for, user_id, plaintext.encode('utf-8'))
+        return token.decode('utf-8')
+
+    async def _decrypt(self, password):
+        cached = decryption_cache.get(password.id, password.password_hash)
+        if cached is not None:
+            return cached
+        return await self._run(password.get_decrypted_password)
+
+    async def _entries(self, passwords):
+        plaintexts = await asyncio.gather(*(self._decrypt(password) for password in passwords))
+        return [_entry(password, plaintext) for password, plaintext in zip(passwords, plaintexts)]
+
+    async def _owned(self, session, user_id, entry_id):
+        password = await session.get(Password, entry_id)
+        if password is None or password.user_id != user_id:
+            raise NotFound(f"No entry {entry_id} for {user_id}")
+        return password
+
+    async def _user(self, session, username):
+        return await session.scalar(select(User).filter_by(username=username))
+
+    async def sign_up(self, username, password):
+        password_hash = await hashing.hash_password_async(password)
+        key_columns = await self._run(userkeys.wrap_key, Fernet.generate_key(), password)
+        async with self._write_lock, self.sessions() as session:
+            if await self._user(session, username) is not None:
+                raise ServiceError(f"Username {username} already exists")
+            user = User(username=username, password_hash=password_hash, **key_columns)
+            session.add(user)
+            await session.commit()
+            return user.id
+
+    async def authenticate(self, username, password):
+        async with self.sessions() as session:
+            user = await self._user(session, username)
+            if user is None or not await hashing.check_password_async(password, user.password_hash):
+                raise AuthenticationFailed(username)
+        if user.needs_rehash():
+            password_hash = await hashing.hash_password_async(password)
+            async with self._write_lock, self.sessions() as session:
+                (await session.get(User, user.id)).password_hash = password_hash
+                await session.commit()
+        await self._unlock(user, password)
+        return user.id
+
+    async def _unlock(self, user, password):
+        """Unlock user's data key, creating it (see userkeys.unlock) or rewrapping it as needed."""
+        if user.data_key is None:
+            async with self._write_lock:
+                await self._run(self._create_key, user.id, password)
+            return
+        data_key = await self._run(userkeys.unwrap_key, user, password)
+        if userkeys.needs_rewrap(user):
+            columns = await self._run(userkeys.wrap_key, data_key, password)
+            async with self._write_lock, self.sessions() as session:
+                stored = await session.get(User, user.id)
+                for column, value in columns.items():
+                    setattr(stored, column, value)
+                await session.commit()
+        crypto.unlock_user(user.id, data_key)
+
+    def _create_key(self, user_id, password):
+        """Runs in the executor: claim a data key for user_id and move their entries to it."""
+        with self.sync_sessions() as session:
+            user = session.get(User, user_id)
+            data_key, created = userkeys.claim_data_key(session, user, password)
+            crypto.unlock_user(user_id, data_key)
+            if created:
+                userkeys.migrate_entries(session, user_id, data_key)
+
+    async def create_password(self, user_id, website, username, password):
+        token = await self._encrypt(user_id, password)
+        async with self._write_lock, self.sessions() as session:
+            entry = Password(website=website, username=username, password_hash=token, user_id=user_id)
+            session.add(entry)
+            await session.commit()
+        return entry.id
+
+    async def get_password(self, user_id, entry_id):
+        async with self.sessions() as session:
+            password = await self._owned(session, user_id, entry_id)
+        return _entry(password, await self._decrypt(password))
+
+    async def list_passwords(self, user_id, after=None, limit=PAGE_SIZE):
+        """One keyset page of entries; pass the last entry's (website_key, id) as after."""
+        async with self.sessions() as session:
+            passwords = (await session.scalars(password_page_statement(user_id, after, limit))).all()
+        return await self._entries(passwords)
+
+    async def search_passwords(self, user_id, query, mode='substring', limit=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        key = normalize_website(query)
+        async with self.sessions() as session:
+            if mode == 'fuzzy':
+                candidates = (await session.execute(fuzzy_candidates_statement(user_id))).all()
+                ids = rank_fuzzy(candidates, key, limit or 10)
+                found = (await session.scalars(select(Password).where(Password.id.in_(ids)))).all() if ids else []
+                by_id = {password.id: password for password in found}
+                passwords = [by_id[password_id] for password_id in ids if password_id in by_id]
+            else:
+                passwords = (await session.scalars(search_statement(user_id, key, mode, self.use_fts, limit))).all()
+        return await self._entries(passwords)
+
+    async def update_password(self, user_id, entry_id, website=None, username=None, password=None):
+        token = await self._encrypt(user_id, password) if password is not None else None
+        async with self._write_lock, self.sessions() as session:
+            entry = await self._owned(session, user_id, entry_id)
+            if website is not None:
+                entry.website = website
+            if username is not None:
+                entry.username = username
+            if token is not None:
+                entry.password_hash = token
+                decryption_cache.invalidate(entry.id)
+            await session.commit()
+
+    async def delete_password(self, user_id, entry_id):
+        async with self._write_lock, self.sessions() as session:
+            entry = await self._owned(session, user_id, entry_id)
+            await session.delete(entry)
+            await session.commit()
@@ -0,0 +1,400 @@
+import argparse
+import base64
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from sqlalchemy import bindparam, delete, func, insert, select, text, update
+from sqlalchemy.exc import OperationalError
+
+from db.models import Password, SyncLog, SyncPeer, SyncState, normalize_website
+
+# Offline sync between copies of the vault on different devices.
+#
+# Every change to an entry is stamped with a hybrid logical clock (HLC): the
+# wall clock in milliseconds shifted left 16 bits, plus a counter, never
+# lower than any reading seen before, including those received from other
+# replicas. SQLite triggers do the stamping and append the change to
+# sync_log, so every writer (CLI screens, imports, the agent, the service)
+# is covered without knowing about sync. Concurrent edits to one entry are
+# settled by last writer wins on (hlc, replica id), which every replica
+# computes the same way; deletes are tombstones in the log and win over
+# older edits too.
+#
+# Replicas exchange bundles through a shared directory (a USB stick or any
+# synced folder): each replica writes one file per account holding its changes since
+# the lowest checkpoint any known peer has acknowledged, together with its
+# own acknowledgements. Only the latest change per entry is sent, and its
+# password travels in plaintext inside a bundle encrypted with a key
+# derived from the sync passphrase, since each device has its own key.key.
+# User ids differ between devices, so an account is identified across them
+# by its username: bundles are named after a hash of it and carry it inside,
+# and a bundle for another account is never applied.
+
+SYNC_FORMAT = 'encrypto-sync'
+BUNDLE_VERSION = 2
+LOOKUP_CHUNK = 500
+POOL_THRESHOLD = 5000  # changes below this are encrypted in-process rather than in a pool
+REPLICA_ID = "(SELECT value FROM sync_state WHERE key = 'replica_id')"
+HLC_NOW = (
+    "max(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER) * 65536, "
+    "coalesce((SELECT max(hlc) FROM sync_log), 0) + 1)"
+)
+# Writes that are not edits (applying a peer's changes, re-encrypting for a
+# key rotation) set this flag inside their transaction to bypass the triggers.
+QUIET = "NOT EXISTS (SELECT 1 FROM sync_state WHERE key = 'quiet')"
+
+SYNC_SCHEMA = [
+    f"""CREATE TRIGGER IF NOT EXISTS passwords_sync_insert AFTER INSERT ON passwords WHEN {QUIET} BEGIN
+        UPDATE passwords SET sync_id = coalesce(new.sync_id, lower(hex(randomblob(16)))), hlc = {HLC_NOW}, origin = {REPLICA_ID}
+            WHERE id = new.id;
+        INSERT INTO sync_log (sync_id, user_id, hlc, origin, deleted)
+            SELECT sync_id, user_id, hlc, origin, 0 FROM passwords WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS passwords_sync_update AFTER UPDATE OF website, username, password_hash, user_id ON passwords
+    WHEN {QUIET} BEGIN
+        UPDATE passwords SET hlc = {HLC_NOW}, origin = {REPLICA_ID} WHERE id = new.id;
+        INSERT INTO sync_log (sync_id, user_id, hlc, origin, deleted)
+            SELECT sync_id, user_id, hlc, origin, 0 FROM passwords WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS passwords_sync_delete AFTER DELETE ON passwords WHEN {QUIET} BEGIN
+        INSERT INTO sync_log (sync_id, user_id, hlc, origin, deleted)
+            VALUES (old.sync_id, old.user_id, {HLC_NOW}, {REPLICA_ID}, 1);
+    END""",
+]
+
+Change = collections.namedtuple('Change', 'sync_id hlc origin deleted website username password')
+SyncStats = collections.namedtuple('SyncStats', 'received applied sent seconds')
+
+
+class SyncError(Exception):
+    pass
+
+
+def ensure_sync_schema(engine):
+    """Give the database a replica id and create the triggers that feed sync_log."""
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as conn:
+        conn.execute(text("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('replica_id', lower(hex(randomblob(8))))"))
+        conn.execute(text("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('bundle_salt', lower(hex(randomblob(16))))"))
+        for statement in SYNC_SCHEMA:
+            conn.execute(text(statement))
+
+
+@contextlib.contextmanager
+def quiet(session):
+    """Keep writes made in the block (in session's transaction) out of the sync log."""
+    session.execute(insert(SyncState).values(key='quiet', value='1'))
+    try:
+        yield
+    finally:
+        session.execute(delete(SyncState).where(SyncState.key == 'quiet'))
+
+
+def _state(session, key):
+    return session.execute(select(SyncState.value).where(SyncState.key == key)).scalar()
+
+
+def replica_id(session):
+    return _state(session, 'replica_id')
+
+
+def _pool_workers(count, workers):
+    return 0 if count < POOL_THRESHOLD else workers
+
+
+def export_changes(session, user_id, since=0, workers=None):
+    """user_id's latest change per entry logged after seq since, and the highest seq logged for them."""
+    from vault_io import _export_batch, _init_worker
+    from workers import chunks, ordered_pool_map
+    import crypto
+
+    latest = (
+        select(SyncLog.sync_id, func.max(SyncLog.seq).label('seq'))
+        .where(SyncLog.user_id == user_id, SyncLog.seq > since)
+        .group_by(SyncLog.sync_id)
+        .subquery()
+    )
+    rows = session.execute(
+        select(SyncLog.sync_id, SyncLog.deleted, Password.hlc, Password.origin, SyncLog.hlc, SyncLog.origin,
+               Password.website, Password.username, Password.password_hash)
+        .join(latest, SyncLog.seq == latest.c.seq)
+        .outerjoin(Password, Password.sync_id == SyncLog.sync_id)
+    ).all()
+    upto = session.execute(select(func.max(SyncLog.seq)).where(SyncLog.user_id == user_id)).scalar() or 0
+
+    changes = []
+    puts = []
+    for sync_id, deleted, hlc, origin, log_hlc, log_origin, website, username, token in rows:
+        if deleted:
+            changes.append(Change(sync_id, log_hlc, log_origin, True, None, None, None))
+        elif token is not None:
+            # The entry itself carries its latest version, which may be newer
+            # than this log row if it changed again after since.
+            puts.append({'sync_id': sync_id, 'hlc': hlc, 'origin': origin, 'website': website, 'username': username, 'password': token})
+    batches = ordered_pool_map(_export_batch, chunks(puts, 1000), _pool_workers(len(puts), workers), _init_worker, (crypto.keys_for(user_id),))
+    for batch in batches:
+        changes.extend(Change(record['sync_id'], record['hlc'], record['origin'], False, record['website'], record['username'], record['password'])
+                       for record in batch)
+    return changes, upto
+
+
+def _local_versions(session, user_id, sync_ids):
+    """user_id's local versions of sync_ids, and the sync_ids held here by other users.
+
+    Versions map sync_id -> (row id, (hlc, origin)) for user_id's entries,
+    and (None, version) for those deleted here.
+    """
+    versions = {}
+    foreign = set()
+    for start in range(0, len(sync_ids), LOOKUP_CHUNK):
+        batch = sync_ids[start:start + LOOKUP_CHUNK]
+        for sync_id, row_id, owner, hlc, origin in session.execute(
+                select(Password.sync_id, Password.id, Password.user_id, Password.hlc, Password.origin).where(Password.sync_id.in_(batch))):
+            if owner == user_id:
+                versions[sync_id] = (row_id, (hlc, origin))
+            else:
+                foreign.add(sync_id)
+        missing = [sync_id for sync_id in batch if sync_id not in versions and sync_id not in foreign]
+        if missing:
+            latest = (
+                select(func.max(SyncLog.seq))
+                .where(SyncLog.user_id == user_id, SyncLog.sync_id.in_(missing))
+                .group_by(SyncLog.sync_id)
+            )
+            for sync_id, hlc, origin in session.execute(
+                    select(SyncLog.sync_id, SyncLog.hlc, SyncLog.origin).where(SyncLog.seq.in_(latest), SyncLog.deleted)):
+                versions[sync_id] = (None, (hlc, origin))
+    return versions, foreign
+
+
+def apply_changes(session, user_id, changes, workers=None):
+    """Merge a peer's changes into user_id's entries; returns how many won over the local copy.
+
+    A change applies only if its (hlc, origin) is greater than the local
+    version's, so applying the same changes twice, or in any order, ends in
+    the same state. Applied changes are logged with their original clock
+    reading and replica, to be passed on to other peers.
+    """
+    from vault_io import _encrypt_batch, _init_worker
+    from workers import chunks, ordered_pool_map
+    import crypto
+
+    versions, foreign = _local_versions(session, user_id, [change.sync_id for change in changes])
+    winners = {}
+    for change in changes:
+        if change.sync_id in foreign:
+            # Only a damaged or forged bundle names another user's entry.
+            continue
+        _, version = versions.get(change.sync_id, (None, None))
+        best = winners.get(change.sync_id)
+        if (version is None or (change.hlc, change.origin) > tuple(version)) and (best is None or (change.hlc, change.origin) > (best.hlc, best.origin)):
+            winners[change.sync_id] = change
+    puts = [change._asdict() for change in winners.values() if not change.deleted]
+    deletes = [change for change in winners.values() if change.deleted]
+
+    with quiet(session):
+        inserts, updates = [], []
+        batches = ordered_pool_map(_encrypt_batch, chunks(puts, 1000), _pool_workers(len(puts), workers), _init_worker, (crypto.keys_for(user_id),))
+        for batch in batches:
+            for record, token in batch:
+                row = {'website': record['website'], 'website_key': normalize_website(record['website']), 'username': record['username'],
+                       'password_hash': token, 'hlc': record['hlc'], 'origin': record['origin']}
+                row_id = versions.get(record['sync_id'], (None, None))[0]
+                if row_id is None:
+                    inserts.append(dict(row, sync_id=record['sync_id'], user_id=user_id))
+                else:
+                    updates.append(dict(row, row_id=row_id))
+        if inserts:
+            session.connection().execute(insert(Password.__table__), inserts)
+        if updates:
+            table = Password.__table__
+            session.connection().execute(
+                update(table).where(table.c.id == bindparam('row_id'), table.c.user_id == user_id).values(
+                    website=bindparam('website'), website_key=bindparam('website_key'), username=bindparam('username'),
+                    password_hash=bindparam('password_hash'), hlc=bindparam('hlc'), origin=bindparam('origin')),
+                [{'row_id': row['row_id'], **{key: row[key] for key in ('website', 'website_key', 'username', 'password_hash', 'hlc', 'origin')}}
+                 for row in updates],
+            )
+        doomed = [versions[change.sync_id][0] for change in deletes if versions.get(change.sync_id, (None, None))[0] is not None]
+        for start in range(0, len(doomed), LOOKUP_CHUNK):
+            session.execute(delete(Password).where(Password.user_id == user_id, Password.id.in_(doomed[start:start + LOOKUP_CHUNK])))
+        if winners:
+            session.connection().execute(insert(SyncLog.__table__), [
+                {'sync_id': change.sync_id, 'user_id': user_id, 'hlc': change.hlc, 'origin': change.origin, 'deleted': change.deleted}
+                for change in winners.values()
+            ])
+    session.commit()
+    if updates or doomed:
+        from cache import decryption_cache
+
+        decryption_cache.clear()
+    return len(winners)
+
+
+_bundle_keys = {}
+
+
+def _bundle_cipher(passphrase, salt, params):
+    from cryptography.fernet import Fernet
+
+    from vault_io import derive_key
+
+    cache_key = (passphrase, salt, tuple(sorted(params.items())))
+    if cache_key not in _bundle_keys:
+        _bundle_keys[cache_key] = Fernet(derive_key(passphrase, salt, **params))
+    return _bundle_keys[cache_key]
+
+
+def seal_bundle(payload, passphrase, salt):
+    from vault_io import SCRYPT_PARAMS
+
+    header = {'format': SYNC_FORMAT, 'version': BUNDLE_VERSION, 'salt': base64.b64encode(salt).decode('ascii'), 'scrypt': SCRYPT_PARAMS}
+    body = _bundle_cipher(passphrase, salt, SCRYPT_PARAMS).encrypt(zlib.compress(json.dumps(payload).encode('utf-8'), 1))
+    return json.dumps(header).encode('utf-8') + b'\n' + body
+
+
+def open_bundle(data, passphrase):
+    from cryptography.fernet import InvalidToken
+
+    header_line, _, body = data.partition(b'\n')
+    header = json.loads(header_line)
+    if header.get('format') != SYNC_FORMAT or header.get('version') != BUNDLE_VERSION:
+        raise SyncError("Not an Encrypto sync bundle")
+    try:
+        plaintext = _bundle_cipher(passphrase, base64.b64decode(header['salt']), header['scrypt']).decrypt(body)
+    except InvalidToken:
+        raise SyncError("Wrong sync passphrase, or the bundle is damaged")
+    return json.loads(zlib.decompress(plaintext))
+
+
+def account_tag(account):
+    """Short stand-in for a username in bundle file names."""
+    return hashlib.sha256(f"{SYNC_FORMAT}:{account}".encode('utf-8')).hexdigest()[:16]
+
+
+class FileTransport:
+    """Bundles as <replica id>.<account tag>.sync files in a shared directory."""
+
+    SUFFIX = '.sync'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def read(self, me, account):
+        """(replica id, bundle bytes) for account from every replica but me."""
+        ending = f".{account_tag(account)}{self.SUFFIX}"
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(ending) and name[:-len(ending)] != me:
+                with open(os.path.join(self.directory, name), 'rb') as file:
+                    yield name[:-len(ending)], file.read()
+
+    def write(self, me, account, data):
+        path = os.path.join(self.directory, f"{me}.{account_tag(account)}{self.SUFFIX}")
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+
+
+def receive(session, user_id, account, transport, passphrase, workers=None):
+    """Apply every peer's bundle for account (user_id here); returns (changes received, changes applied)."""
+    me = replica_id(session)
+    received = applied = 0
+    for peer_id, data in transport.read(me, account):
+        payload = open_bundle(data, passphrase)
+        if payload['replica'] != peer_id:
+            raise SyncError(f"Bundle from {peer_id} claims to be from {payload['replica']}")
+        if payload['account'] != account:
+            raise SyncError(f"Bundle from {peer_id} is for another account")
+        changes = [Change(*change) for change in payload['changes']]
+        received += len(changes)
+        applied += apply_changes(session, user_id, changes, workers)
+        peer = session.get(SyncPeer, (peer_id, user_id)) or SyncPeer(peer_id=peer_id, user_id=user_id, received_seq=0, acked_seq=0)
+        session.add(peer)
+        # Only a bundle that starts at or before what we already have from
+        # the peer leaves no gap; otherwise keep asking from the old point.
+        if payload['since'] <= peer.received_seq:
+            peer.received_seq = max(peer.received_seq, payload['upto'])
+        peer.acked_seq = payload['acks'].get(me, 0)
+        session.commit()
+    return received, applied
+
+
+def send(session, user_id, account, transport, passphrase, workers=None):
+    """Write this replica's bundle for account (user_id here); returns the number of changes in it."""
+    me = replica_id(session)
+    peers = session.query(SyncPeer).filter_by(user_id=user_id).all()
+    since = min((peer.acked_seq for peer in peers), default=0)
+    changes, upto = export_changes(session, user_id, since, workers)
+    payload = {
+        'replica': me,
+        'account': account,
+        'since': since,
+        'upto': upto,
+        'acks': {peer.peer_id: peer.received_seq for peer in peers},
+        'changes': [list(change) for change in changes],
+    }
+    transport.write(me, account, seal_bundle(payload, passphrase, bytes.fromhex(_state(session, 'bundle_salt'))))
+    return len(changes)
+
+
+def sync_user(session, user_id, account, transport, passphrase, workers=None):
+    """Take in every peer's changes for account, user_id here, then publish ours (including the ones just taken in)."""
+    started = time.perf_counter()
+    received, applied = receive(session, user_id, account, transport, passphrase, workers)
+    sent = send(session, user_id, account, transport, passphrase, workers)
+    return SyncStats(received, applied, sent, time.perf_counter() - started)
+
+
+def compact_log(session):
+    """Drop log rows superseded by a later change to the same entry; returns how many."""
+    latest = select(func.max(SyncLog.seq)).group_by(SyncLog.sync_id)
+    result = session.execute(delete(SyncLog).where(SyncLog.seq.not_in(latest)))
+    session.commit()
+    return result.rowcount
+
+
+def main():
+    import pwinput
+
+    from db import shards
+    from db.database import Session, init_db
+    from db.models import User
+    from userkeys import unlock
+
+    parser = argparse.ArgumentParser(description="Sync a user's passwords with other devices through a shared directory.")
+    parser.add_argument('directory', help="directory shared between the devices, e.g. on a USB stick or a synced folder")
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--compact', action='store_true', help="afterwards drop log entries superseded by later changes")
+    parser.add_argument('--workers', type=int, default=None, help="encryption processes for large syncs (0 for none)")
+    args = parser.parse_args()
+
+    init_db()
+    session = Session()
+    user = session.query(User).filter_by(username=args.user).first()
+    password = pwinput.pwinput("Password: ")
+    if not user or not user.check_password(password):
+        parser.exit(1, "Invalid username or password.\n")
+    passphrase = os.environ.get('ENCRYPTO_SYNC_PASSPHRASE') or pwinput.pwinput("Sync passphrase: ")
+    entries = shards.open_session(user.id)
+    unlock(session, user, password, entries)
+    try:
+        stats = sync_user(entries, user.id, user.username, FileTransport(args.directory), passphrase, args.workers)
+    except SyncError as exc:
+        parser.exit(1, f"{exc}\n")
+    except OperationalError as exc:
+        parser.exit(1, f"Sync needs an up-to-date SQLite database: {exc}\n")
+    print(f"Received {stats.received} changes ({stats.applied} applied), sent {stats.sent}, in {stats.seconds:.2f}s.")
+    if args.compact:
+        print(f"Compacted the change log: {compact_log(entries)} rows removed.")
+
+
+if __name__ == '__main__':
+    main()
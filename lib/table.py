@@ -0,0 +1,121 @@
+import itertools
+import json
+import sys
+
+# Streams rows to a text stream as they come, instead of collecting them
+# the way Texttable does and re-measuring every cell on each draw(). Column
+# widths are fixed up front from the headers and the first SAMPLE_ROWS rows,
+# and longer cells are cut to fit with an ellipsis, so a listing of any size
+# costs one pass and starts printing at once. 'tsv' and 'jsonl' print every
+# value in full for piping into other programs.
+
+FORMATS = ('table', 'tsv', 'jsonl')
+SAMPLE_ROWS = 200
+MAX_WIDTH = 40
+ELLIPSIS = '…'
+FLUSH_EVERY = 500
+# Cells never span lines, in any format.
+_CONTROL = {codepoint: ' ' for codepoint in range(32)}
+_TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+class TableRenderer:
+    """Write rows (sequences of cells) under headers to out in one of FORMATS.
+
+    masked names columns whose cells are replaced by mask in every format,
+    for listings that must not show passwords; max_width caps the width of
+    table columns (a dict maps header to width, an int applies to all).
+    """
+
+    def __init__(self, headers, out=None, fmt='table', masked=(), mask='********', max_width=MAX_WIDTH, sample=SAMPLE_ROWS):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown table format {fmt!r}; expected one of {', '.join(FORMATS)}")
+        self.headers = [str(header) for header in headers]
+        self.out = out or sys.stdout
+        self.fmt = fmt
+        self.masked = {self.headers.index(name) for name in masked}
+        self.mask = mask
+        if isinstance(max_width, dict):
+            self.max_widths = [max_width.get(header, MAX_WIDTH) for header in self.headers]
+        else:
+            self.max_widths = [max_width] * len(self.headers)
+        self.sample = sample
+
+    def render(self, rows):
+        """Write every row and return how many there were."""
+        rows = iter(rows)
+        if self.fmt == 'table':
+            return self._table(rows)
+        return self._lines(rows, self._tsv_line if self.fmt == 'tsv' else self._json_line)
+
+    def _cells(self, row):
+        return [self.mask if index in self.masked else ('' if cell is None else str(cell)) for index, cell in enumerate(row)]
+
+    def _write(self, lines):
+        self.out.write('\n'.join(lines) + '\n')
+
+    def _lines(self, rows, format_line):
+        if self.fmt == 'tsv':
+            self._write(['\t'.join(header.translate(_TSV_ESCAPES) for header in self.headers)])
+        count = 0
+        lines = []
+        for row in rows:
+            lines.append(format_line(row))
+            count += 1
+            if len(lines) >= FLUSH_EVERY:
+                self._write(lines)
+                lines = []
+        if lines:
+            self._write(lines)
+        return count
+
+    def _tsv_line(self, row):
+        return '\t'.join(cell.translate(_TSV_ESCAPES) for cell in self._cells(row))
+
+    def _json_line(self, row):
+        return json.dumps(dict(zip(self.headers, (self.mask if index in self.masked else cell for index, cell in enumerate(row)))),
+                          ensure_ascii=False)
+
+    def _table(self, rows):
+        sample = [self._cells(row) for row in itertools.islice(rows, self.sample)]
+        widths = [len(header) for header in self.headers]
+        numeric = [bool(sample)] * len(self.headers)
+        for cells in sample:
+            for index, cell in enumerate(cells):
+                cell = cell.translate(_CONTROL)
+                cells[index] = cell
+                widths[index] = max(widths[index], len(cell))
+                numeric[index] = numeric[index] and cell.isdigit()
+        # Numbers are never cut: a numeric column gets room to grow past its
+        # sample (row counters do) and overflows rather than truncates.
+        widths = [max(len(header), min(width, limit)) if not is_numeric else max(width, 6)
+                  for header, width, limit, is_numeric in zip(self.headers, widths, self.max_widths, numeric)]
+        rule = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+        templates = [('{:>%d}' if is_numeric else '{:<%d}') % width for width, is_numeric in zip(widths, numeric)]
+
+        def line(cells):
+            parts = []
+            for cell, width, template, is_numeric in zip(cells, widths, templates, numeric):
+                if len(cell) > width and not is_numeric:
+                    cell = cell[:width - len(ELLIPSIS)] + ELLIPSIS
+                parts.append(template.format(cell))
+            return '| ' + ' | '.join(parts) + ' |'
+
+        lines = [rule, line(self.headers), rule.replace('-', '=')]
+        count = 0
+        for cells in itertools.chain(sample, (self._cells(row) for row in rows)):
+            if count >= len(sample):
+                cells = [cell.translate(_CONTROL) for cell in cells]
+            lines.append(line(cells))
+            count += 1
+            if len(lines) >= FLUSH_EVERY:
+                self._write(lines)
+                lines = []
+        lines.append(rule)
+        self._write(lines)
+        return count
+
+
+def render_table(headers, rows, **options):
+    """Shortcut for TableRenderer(headers, **options).render(rows)."""
+    return TableRenderer(headers, **options).render(rows)
@@ -0,0 +1,253 @@
+import argparse
+import base64
+import os
+import time
+
+from cryptography.fernet import Fernet
+from sqlalchemy import bindparam, func, update
+
+import crypto
+from cache import decryption_cache
+
+# Per-user data keys. Each user's entries are encrypted with a random Fernet
+# key of their own, so key.key alone no longer reads them. The data key is
+# stored in users.data_key, wrapped (Fernet-encrypted) under a key derived
+# from the account password. Login derives that key once and puts the
+# unwrapped data key in cache.key_cache, so afterwards each entry costs one
+# Fernet operation, the same as with the shared keyring.
+#
+# ENCRYPTO_KDF sets the derivation used for new wrappings:
+#
+#   scrypt:n=32768,r=8,p=1        (default)
+#   argon2id:t=3,m=65536,p=1      (needs the argon2-cffi package)
+#
+# The parameters are stored with each wrapped key, so a change only applies
+# to keys wrapped afterwards; a user's key is rewrapped with the current
+# parameters at their next login, as bcrypt hashes are rehashed. Pick
+# parameters for this host with: python userkeys.py calibrate
+DEFAULT_KDF = 'scrypt:n=32768,r=8,p=1'
+KDF = os.environ.get('ENCRYPTO_KDF', DEFAULT_KDF)
+SALT_BYTES = 16
+BATCH_SIZE = 5000
+POOL_THRESHOLD = 5000  # entries below this are re-encrypted in-process rather than in a pool
+
+
+def parse_kdf(spec):
+    """('scrypt' or 'argon2id', {parameter: int}) from a spec like 'scrypt:n=32768,r=8,p=1'."""
+    name, _, params = spec.partition(':')
+    if name not in ('scrypt', 'argon2id'):
+        raise ValueError(f"Unknown key derivation {name!r}; expected scrypt or argon2id")
+    return name, {key: int(value) for key, value in (item.split('=') for item in params.split(',') if item)}
+
+
+def derive_wrapping_key(password, salt, spec):
+    """The Fernet key that wraps a data key, derived from password."""
+    name, params = parse_kdf(spec)
+    if name == 'scrypt':
+        from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+        material = Scrypt(salt=salt, length=32, n=params['n'], r=params['r'], p=params['p']).derive(password.encode('utf-8'))
+    else:
+        try:
+            from argon2.low_level import Type, hash_secret_raw
+        except ImportError:
+            raise RuntimeError("Argon2id key derivation needs the argon2-cffi package (pip install argon2-cffi)")
+        material = hash_secret_raw(password.encode('utf-8'), salt, time_cost=params['t'], memory_cost=params['m'],
+                                   parallelism=params['p'], hash_len=32, type=Type.ID)
+    return base64.urlsafe_b64encode(material)
+
+
+def wrap_key(data_key, password, spec=None):
+    """Column values storing data_key wrapped under password, with a fresh salt."""
+    spec = spec or KDF
+    salt = os.urandom(SALT_BYTES)
+    wrapped = Fernet(derive_wrapping_key(password, salt, spec)).encrypt(data_key)
+    return {'data_key': wrapped.decode('ascii'), 'key_salt': salt.hex(), 'key_kdf': spec}
+
+
+def unwrap_key(user, password):
+    """user's data key; raises InvalidToken if password is not the one it was wrapped under."""
+    wrapping_key = derive_wrapping_key(password, bytes.fromhex(user.key_salt), user.key_kdf)
+    return Fernet(wrapping_key).decrypt(user.data_key.encode('ascii'))
+
+
+def set_wrapped_key(user, data_key, password, spec=None):
+    for column, value in wrap_key(data_key, password, spec).items():
+        setattr(user, column, value)
+
+
+def needs_rewrap(user):
+    return user.data_key is not None and user.key_kdf != KDF
+
+
+def new_data_key(user, password):
+    """Give user a fresh data key wrapped under password; returns the key."""
+    data_key = Fernet.generate_key()
+    set_wrapped_key(user, data_key, password)
+    return data_key
+
+
+def claim_data_key(session, user, password):
+    """Give user a data key unless another process got there first; returns (key, created).
+
+    The key is stored with an UPDATE that only matches while users.data_key
+    is still empty, so when the CLI, the agent and a script log in at once
+    exactly one key is kept, and the others unwrap it instead of moving
+    entries to a key that is about to be overwritten.
+    """
+    from db.models import User
+
+    data_key = Fernet.generate_key()
+    result = session.execute(
+        update(User.__table__)
+        .where(User.__table__.c.id == user.id, User.__table__.c.data_key.is_(None))
+        .values(**wrap_key(data_key, password))
+    )
+    session.commit()
+    session.refresh(user)
+    if result.rowcount:
+        return data_key, True
+    return unwrap_key(user, password), False
+
+
+def migrate_entries(session, user_id, data_key, workers=None):
+    """Re-encrypt user_id's entries written under key.key with data_key; returns how many.
+
+    The passwords themselves are unchanged, so the writes are kept out of
+    the sync log.
+    """
+    from db.models import Password
+    from rotate_keys import _init_worker, _read_rows, _rotate_batch
+    from sync import quiet
+    from workers import chunks, ordered_pool_map
+
+    table = Password.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam('row_id'), table.c.password_hash == bindparam('old_hash'))
+        .values(password_hash=bindparam('new_hash'))
+    )
+    if workers is None and session.query(func.count(Password.id)).filter(Password.user_id == user_id).scalar() < POOL_THRESHOLD:
+        workers = 0
+    rows = _read_rows(session, 0, BATCH_SIZE, user_id)
+    # Rotating with the data key in front re-encrypts every entry under it;
+    # those still under key.key are read through the keyring behind it.
+    cipher_keys = [data_key] + crypto.get_keys()
+    migrated = 0
+    with quiet(session):
+        for _, batch in ordered_pool_map(_rotate_batch, chunks(rows, BATCH_SIZE), workers, _init_worker, (cipher_keys,)):
+            if batch:
+                session.connection().execute(statement, batch)
+                migrated += len(batch)
+    session.commit()
+    return migrated
+
+
+def unlock(session, user, password, entries=None, workers=None):
+    """Unlock user's data key for this process, creating it on first use; returns the key.
+
+    session holds user; entries is the session holding their entries (their
+    shard, or session itself). The first unlock gives the user a data key
+    and moves their entries to it. It is committed before the entries are
+    re-encrypted, so an interruption leaves entries under key.key, which
+    stays readable through the keyring behind every data key.
+    """
+    if user.data_key is None:
+        data_key, created = claim_data_key(session, user, password)
+        crypto.unlock_user(user.id, data_key)
+        if created:
+            migrate_entries(entries or session, user.id, data_key, workers)
+        return data_key
+    data_key = unwrap_key(user, password)
+    if needs_rewrap(user):
+        set_wrapped_key(user, data_key, password)
+        session.commit()
+    crypto.unlock_user(user.id, data_key)
+    return data_key
+
+
+def change_password(session, user, old_password, new_password):
+    """Set user's account password, rewrapping their data key under it."""
+    if user.data_key is not None:
+        data_key = crypto.key_cache.key(user.id) or unwrap_key(user, old_password)
+        set_wrapped_key(user, data_key, new_password)
+    user.set_password(new_password)
+    session.commit()
+
+
+def reset_password(session, user, new_password, entries=None):
+    """Set a forgotten account password; returns how many entries were lost.
+
+    Without the old password the data key cannot be unwrapped, so the
+    entries encrypted with it are deleted and the user starts over with a
+    fresh key. The deletes are kept out of the sync log, so the copies on
+    other devices, readable there with the old password, are kept. A user
+    without a data key yet keeps their entries, which their next login
+    moves to a new one.
+    """
+    from db.models import Password
+    from sync import quiet
+
+    lost = 0
+    if user.data_key is not None:
+        entries = entries or session
+        with quiet(entries):
+            lost = entries.query(Password).filter_by(user_id=user.id).delete(synchronize_session=False)
+        # A bulk delete skips the per-entry invalidation hook.
+        decryption_cache.clear()
+        entries.commit()
+        crypto.lock_user(user.id)
+        new_data_key(user, new_password)
+    user.set_password(new_password)
+    session.commit()
+    return lost
+
+
+def time_kdf(spec, samples=3):
+    salt = os.urandom(SALT_BYTES)
+    best = None
+    for _ in range(samples):
+        started = time.perf_counter()
+        derive_wrapping_key('calibration-password', salt, spec)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(target_ms=100, kdf='scrypt'):
+    """The strongest KDF spec whose derivation on this host stays within target_ms.
+
+    scrypt doubles n from 2**14 (r=8, p=1); argon2id raises t at 64 MiB of
+    memory and one lane.
+    """
+    if kdf == 'scrypt':
+        candidates = (f"scrypt:n={2 ** exponent},r=8,p=1" for exponent in range(14, 23))
+    else:
+        candidates = (f"argon2id:t={t},m=65536,p=1" for t in range(1, 11))
+    chosen = None
+    for spec in candidates:
+        if time_kdf(spec) * 1000 > target_ms:
+            return chosen or spec
+        chosen = spec
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-user data key tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help="pick the strongest key derivation that meets a latency target")
+    calibrate_parser.add_argument('--target-ms', type=float, default=100)
+    calibrate_parser.add_argument('--kdf', choices=['scrypt', 'argon2id'], default='scrypt')
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        try:
+            spec = calibrate(args.target_ms, args.kdf)
+        except RuntimeError as error:
+            parser.exit(1, f"{error}\n")
+        print(f"{spec} takes {time_kdf(spec) * 1000:.0f} ms per login on this host.")
+        print(f"export ENCRYPTO_KDF={spec}")
+
+
+if __name__ == '__main__':
+    main()
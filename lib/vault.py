@@ -0,0 +1,123 @@
+from sqlalchemy import bindparam, delete, insert, select, tuple_, update
+
+import crypto
+from cache import decryption_cache
+from db.models import Password, normalize_website
+
+PAGE_SIZE = 20
+MASK = '********'
+
+
+def password_page(session, user_id, after=None, page_size=PAGE_SIZE):
+    """Return the next page of user_id's entries ordered by website.
+
+    after is the (website_key, id) of the last row already shown. Seeking from
+    it walks the (user_id, website_key) index, so every page costs the same no
+    matter how deep into the vault it is.
+    """
+    return session.scalars(password_page_statement(user_id, after, page_size)).all()
+
+
+def password_page_statement(user_id, after=None, page_size=PAGE_SIZE):
+    statement = select(Password).where(Password.user_id == user_id)
+    if after is not None:
+        statement = statement.where(tuple_(Password.website_key, Password.id) > tuple_(*after))
+    return statement.order_by(Password.website_key, Password.id).limit(page_size)
+
+
+def iter_password_pages(session, user_id, page_size=PAGE_SIZE):
+    after = None
+    while True:
+        page = password_page(session, user_id, after, page_size)
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = (page[-1].website_key, page[-1].id)
+
+
+def rename_user(session, user, new_username):
+    """Rename user. Entries reference the user's integer id, so none of them change."""
+    user.username = new_username
+    session.commit()
+
+
+class WriteBatch:
+    """Collects password mutations and applies them in one transaction.
+
+    Use as a context manager; everything queued is encrypted, written with
+    one executemany per kind of change and committed once on exit, or
+    discarded if the block raises.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.creates = []
+        self.updates = {}
+        self.deletes = set()
+
+    def create(self, user_id, website, username, password):
+        self.creates.append({'user_id': user_id, 'website': website, 'username': username, 'password': password})
+
+    def update_password(self, user_id, entry_id, password):
+        self.updates[entry_id] = (user_id, password)
+
+    def delete(self, user_id, entry_id):
+        self.updates.pop(entry_id, None)
+        self.deletes.add((user_id, entry_id))
+
+    def __len__(self):
+        return len(self.creates) + len(self.updates) + len(self.deletes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.session.rollback()
+        return False
+
+    def commit(self):
+        table = Password.__table__
+        if self.creates:
+            self.session.execute(insert(Password), [
+                {
+                    'website': create['website'],
+                    'website_key': normalize_website(create['website']),
+                    'username': create['username'],
+                    'password_hash': crypto.encrypt_for(create['user_id'], create['password'].encode('utf-8')).decode('utf-8'),
+                    'user_id': create['user_id'],
+                }
+                for create in self.creates
+            ])
+        if self.updates:
+            self.session.connection().execute(
+                update(table)
+                .where(table.c.id == bindparam('entry_id'), table.c.user_id == bindparam('owner'))
+                .values(password_hash=bindparam('token')),
+                [
+                    {'entry_id': entry_id, 'owner': user_id, 'token': crypto.encrypt_for(user_id, password.encode('utf-8')).decode('utf-8')}
+                    for entry_id, (user_id, password) in self.updates.items()
+                ],
+            )
+        if self.deletes:
+            self.session.connection().execute(
+                delete(table).where(table.c.id == bindparam('entry_id'), table.c.user_id == bindparam('owner')),
+                [{'entry_id': entry_id, 'owner': user_id} for user_id, entry_id in self.deletes],
+            )
+        self.session.commit()
+        # The writes above bypass the ORM, so drop any stale copies of the
+        # touched rows from the session and the decryption cache.
+        deleted = {entry_id for _, entry_id in self.deletes}
+        for entry_id in set(self.updates) | deleted:
+            decryption_cache.invalidate(entry_id)
+            loaded = self.session.identity_map.get(self.session.identity_key(Password, entry_id))
+            if loaded is not None:
+                if entry_id in deleted:
+                    self.session.expunge(loaded)
+                else:
+                    self.session.expire(loaded)
+        self.creates, self.updates, self.deletes = [], {}, set()
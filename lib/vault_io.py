@@ -0,0 +1,294 @@
+import argparse
+import base64
+import collections
+import csv
+import json
+import os
+import re
+import time
+from urllib.parse import urlsplit
+
+import pwinput
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from sqlalchemy import insert
+
+import crypto
+from db import shards
+from db.database import Session, init_db
+from db.models import User, Password, normalize_website
+from userkeys import unlock
+from workers import chunks, ordered_pool_map
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 1 << 16
+SEPARATORS = re.compile(r'[ \t\r\n,]*')  # between JSON array elements
+EXPORT_FORMAT = 'encrypto-export'
+SCRYPT_PARAMS = {'n': 2 ** 15, 'r': 8, 'p': 1}
+
+# Column names used by the CSV exports of common browsers and managers
+# (Chrome, Firefox, Bitwarden, LastPass, 1Password), most specific first.
+URL_COLUMNS = ('url', 'login_uri', 'origin_url', 'website')
+NAME_COLUMNS = ('name', 'title')
+USERNAME_COLUMNS = ('username', 'login_username', 'user', 'email')
+PASSWORD_COLUMNS = ('password', 'login_password')
+
+TransferStats = collections.namedtuple('TransferStats', 'rows seconds')
+
+
+def rows_per_second(stats):
+    return stats.rows / stats.seconds if stats.seconds else float(stats.rows)
+
+
+def derive_key(passphrase, salt, n=SCRYPT_PARAMS['n'], r=SCRYPT_PARAMS['r'], p=SCRYPT_PARAMS['p']):
+    """Derive a Fernet key from a passphrase with scrypt."""
+    kdf = Scrypt(salt=salt, length=32, n=n, r=r, p=p)
+    return base64.urlsafe_b64encode(kdf.derive(passphrase.encode('utf-8')))
+
+
+def _first(row, columns):
+    for column in columns:
+        value = row.get(column)
+        if value:
+            return value.strip()
+    return ''
+
+
+def _website(url, name):
+    if url:
+        host = urlsplit(url if '//' in url else '//' + url).hostname
+        if host:
+            return host[4:] if host.startswith('www.') else host
+    return name
+
+
+def _normalize_row(row):
+    row = {column.strip().lower(): value for column, value in row.items() if column}
+    password = _first(row, PASSWORD_COLUMNS)
+    if not password:
+        return None
+    return {
+        'website': _website(_first(row, URL_COLUMNS), _first(row, NAME_COLUMNS)),
+        'username': _first(row, USERNAME_COLUMNS),
+        'password': password,
+    }
+
+
+def _normalize_item(item):
+    login = item.get('login')
+    if isinstance(login, dict):
+        # Bitwarden JSON export
+        uris = login.get('uris') or [{}]
+        item = {
+            'url': uris[0].get('uri') or '',
+            'name': item.get('name') or '',
+            'username': login.get('username') or '',
+            'password': login.get('password') or '',
+        }
+    return _normalize_row({column: value for column, value in item.items() if isinstance(value, str)})
+
+
+def _iter_json_array(file, key=None):
+    """Yield the elements of a JSON array one at a time without loading the file.
+
+    With key, the array is the value of that member of the top-level object.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key) if key else r'^\s*\[')
+    buffer = file.read(CHUNK_SIZE)
+    while True:
+        match = start.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("No JSON array found in import file.")
+        buffer = buffer[-64:] + chunk
+
+    # idx walks the buffer; it is only sliced when a chunk is appended, so
+    # each chunk is copied once however many elements it holds.
+    idx = 0
+    while True:
+        idx = SEPARATORS.match(buffer, idx).end()
+        if buffer.startswith(']', idx):
+            return
+        try:
+            element, idx = decoder.raw_decode(buffer, idx)
+        except json.JSONDecodeError:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer = buffer[idx:] + chunk
+            idx = 0
+            continue
+        yield element
+
+
+def read_records(path, passphrase=None):
+    """Yield {'website', 'username', 'password'} dicts from a CSV, JSON or JSON lines file."""
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        head = file.read(CHUNK_SIZE)
+        file.seek(0)
+        first = head.lstrip()[:1]
+
+        if head.startswith('{"format": "%s"' % EXPORT_FORMAT):
+            yield from _read_encrypted(file, passphrase)
+        elif first == '[':
+            for item in _iter_json_array(file):
+                record = _normalize_item(item)
+                if record:
+                    yield record
+        elif first == '{' and path.endswith('.json'):
+            for item in _iter_json_array(file, key='items'):
+                record = _normalize_item(item)
+                if record:
+                    yield record
+        elif first == '{':
+            for line in file:
+                if line.strip():
+                    record = _normalize_item(json.loads(line))
+                    if record:
+                        yield record
+        else:
+            for row in csv.DictReader(file):
+                record = _normalize_row(row)
+                if record:
+                    yield record
+
+
+def _read_encrypted(file, passphrase):
+    if passphrase is None:
+        raise ValueError("This export is encrypted; a passphrase is required.")
+    header = json.loads(file.readline())
+    export_cipher = Fernet(derive_key(passphrase, base64.b64decode(header['salt']), **header['scrypt']))
+    for line in file:
+        if line.strip():
+            try:
+                plaintext = export_cipher.decrypt(line.strip().encode('utf-8'))
+            except InvalidToken:
+                raise ValueError("wrong passphrase or corrupt export") from None
+            yield json.loads(plaintext)
+
+
+_worker_ciphers = {}
+
+
+def _init_worker(vault_keys, export_key=None):
+    _worker_ciphers['vault'] = crypto.build_cipher(vault_keys)
+    _worker_ciphers['export'] = Fernet(export_key) if export_key else None
+
+
+def _encrypt_batch(records):
+    vault_cipher = _worker_ciphers['vault']
+    return [
+        (record, vault_cipher.encrypt(record['password'].encode('utf-8')).decode('utf-8'))
+        for record in records
+    ]
+
+
+def _export_batch(records):
+    vault_cipher = _worker_ciphers['vault']
+    export_cipher = _worker_ciphers['export']
+    lines = []
+    for record in records:
+        record['password'] = vault_cipher.decrypt(record['password'].encode('utf-8')).decode('utf-8')
+        if export_cipher:
+            lines.append(export_cipher.encrypt(json.dumps(record).encode('utf-8')).decode('utf-8'))
+        else:
+            lines.append(record)
+    return lines
+
+
+def import_passwords(session, user_id, records, batch_size=BATCH_SIZE, workers=None):
+    """Encrypt and insert records for user_id, committing every batch_size rows."""
+    started = time.perf_counter()
+    rows = 0
+    batches = ordered_pool_map(_encrypt_batch, chunks(records, batch_size), workers, _init_worker, (crypto.keys_for(user_id),))
+    for batch in batches:
+        session.execute(insert(Password), [
+            {
+                'website': record['website'],
+                'website_key': normalize_website(record['website']),
+                'username': record['username'],
+                'password_hash': token,
+                'user_id': user_id,
+            }
+            for record, token in batch
+        ])
+        session.commit()
+        rows += len(batch)
+    return TransferStats(rows, time.perf_counter() - started)
+
+
+def export_passwords(session, user_id, path, passphrase=None, batch_size=BATCH_SIZE, workers=None):
+    """Stream user_id's entries to path, as CSV or, with a passphrase, an encrypted export."""
+    started = time.perf_counter()
+    rows = 0
+    export_key = None
+    query = (
+        session.query(Password.website, Password.username, Password.password_hash)
+        .filter(Password.user_id == user_id)
+        .order_by(Password.id)
+        .yield_per(batch_size)
+    )
+    records = (
+        {'website': website, 'username': username, 'password': password_hash}
+        for website, username, password_hash in query
+    )
+
+    # Only the owner may read the file: without a passphrase it holds every
+    # password in plain text. fchmod covers a file that already existed.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as file:
+        if passphrase:
+            salt = os.urandom(16)
+            export_key = derive_key(passphrase, salt)
+            header = {'format': EXPORT_FORMAT, 'version': 1, 'salt': base64.b64encode(salt).decode('ascii'), 'scrypt': SCRYPT_PARAMS}
+            file.write(json.dumps(header) + '\n')
+        else:
+            writer = csv.DictWriter(file, fieldnames=['website', 'username', 'password'])
+            writer.writeheader()
+        batches = ordered_pool_map(_export_batch, chunks(records, batch_size), workers, _init_worker, (crypto.keys_for(user_id), export_key))
+        for lines in batches:
+            if passphrase:
+                file.writelines(line + '\n' for line in lines)
+            else:
+                writer.writerows(lines)
+            rows += len(lines)
+    return TransferStats(rows, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export stored passwords.")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('path')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--encrypted', action='store_true', help="prompt for a passphrase to encrypt the export or decrypt the import")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="encryption processes (0 to encrypt in this process)")
+    args = parser.parse_args()
+
+    init_db()
+    session = Session()
+    user = session.query(User).filter_by(username=args.user).first()
+    password = pwinput.pwinput("Password: ")
+    if not user or not user.check_password(password):
+        parser.exit(1, "Invalid username or password.\n")
+    passphrase = pwinput.pwinput("Export passphrase: ") if args.encrypted else None
+
+    entries = shards.open_session(user.id)
+    unlock(session, user, password, entries)
+    if args.action == 'import':
+        try:
+            stats = import_passwords(entries, user.id, read_records(args.path, passphrase), args.batch_size, args.workers)
+        except ValueError as exc:
+            parser.exit(1, f"Import failed: {exc}\n")
+    else:
+        stats = export_passwords(entries, user.id, args.path, passphrase, args.batch_size, args.workers)
+    print(f"{args.action.capitalize()}ed {stats.rows} passwords in {stats.seconds:.2f}s ({rows_per_second(stats):.0f} rows/sec).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+import argparse
+import collections
+import getpass
+import hashlib
+import hmac
+import mmap
+import os
+import struct
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+from db.models import normalize_website
+from vault_io import SCRYPT_PARAMS
+
+# Single-file vault, an alternative to the SQLite + Fernet store.
+#
+#   header   magic, version, scrypt parameters and salt, a password check,
+#            and where the index block sits
+#   records  append-only frames: length, kind (put/delete), entry id, a
+#            16-byte HMAC tag of (user_id, website), a nonce and the AES-GCM
+#            ciphertext of the entry; the frame header and the file salt are
+#            the associated data, so frames cannot be edited or moved
+#            between vaults
+#   index    two open-addressing hash tables written by compact(): entry id
+#            -> frame offset and website tag -> frame offset
+#   tail     frames appended since the last compaction
+#
+# Lookups hash straight into the memory-mapped index, so opening the file
+# and finding an entry never parse the record region. Frames in the tail
+# are scanned into a small in-memory overlay at open; compact() folds them
+# (and drops replaced or deleted frames) into a freshly indexed file once
+# the tail grows past COMPACT_THRESHOLD or a quarter of the live entries.
+# One AES-256-GCM key and one HMAC key come from the master password with
+# scrypt, so no key file is stored next to the vault.
+
+MAGIC = b'ENCVAULT'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIII16s16sQQ')  # magic, version, flags, n, r, p, salt, check, index offset, index end
+FRAME = struct.Struct('<IBQ16s12s')  # frame length, kind, entry id, website tag, nonce
+INDEX = struct.Struct('<QQQQ')  # id slots, website slots, live entries, highest id
+ID_SLOT = struct.Struct('<QQ')  # entry id (0 = empty), frame offset
+SITE_SLOT = struct.Struct('<16sQ')  # website tag, frame offset (0 = empty)
+FIELDS = struct.Struct('<HHHH')
+PUT, DELETE = 1, 2
+COMPACT_THRESHOLD = 1024
+
+VaultEntry = collections.namedtuple('VaultEntry', 'id user_id website username password')
+
+
+class VaultFileError(Exception):
+    pass
+
+
+def derive_keys(master_password, salt, n=SCRYPT_PARAMS['n'], r=SCRYPT_PARAMS['r'], p=SCRYPT_PARAMS['p']):
+    material = Scrypt(salt=salt, length=64, n=n, r=r, p=p).derive(master_password.encode('utf-8'))
+    return material[:32], material[32:]
+
+
+def _pack_entry(user_id, website, username, password):
+    fields = [value.encode('utf-8') for value in (user_id, website, username, password)]
+    return FIELDS.pack(*map(len, fields)) + b''.join(fields)
+
+
+def _unpack_entry(plaintext):
+    lengths = FIELDS.unpack_from(plaintext)
+    fields, position = [], FIELDS.size
+    for length in lengths:
+        fields.append(plaintext[position:position + length].decode('utf-8'))
+        position += length
+    return fields
+
+
+def _id_slot(entry_id, bits):
+    # Fibonacci hashing spreads sequential ids across the table.
+    return ((entry_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - bits) if bits else 0
+
+
+def _table_bits(count):
+    # Keep both tables at most half full so probes stay short.
+    return max(1, (2 * count - 1).bit_length())
+
+
+class VaultFile:
+    """A memory-mapped, append-only vault file; open with create() or open()."""
+
+    def __init__(self, path, file, header, aead_key, mac_key):
+        self.path = path
+        self.file = file
+        self.salt = header['salt']
+        self.header = header
+        self.aead = AESGCM(aead_key)
+        self.mac_key = mac_key
+        self.auto_compact = True
+        self.map = None
+        self._load()
+
+    @classmethod
+    def create(cls, path, master_password, n=SCRYPT_PARAMS['n'], r=SCRYPT_PARAMS['r'], p=SCRYPT_PARAMS['p']):
+        salt = os.urandom(16)
+        aead_key, mac_key = derive_keys(master_password, salt, n, r, p)
+        header = {'n': n, 'r': r, 'p': p, 'salt': salt, 'index_offset': 0, 'index_end': 0}
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        file = os.fdopen(fd, 'r+b')
+        file.write(cls._header_bytes(header, mac_key))
+        file.flush()
+        return cls(path, file, header, aead_key, mac_key)
+
+    @classmethod
+    def open(cls, path, master_password):
+        file = open(path, 'r+b')
+        magic, version, _, n, r, p, salt, check, index_offset, index_end = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            file.close()
+            raise VaultFileError(f"{path} is not an Encrypto vault file")
+        aead_key, mac_key = derive_keys(master_password, salt, n, r, p)
+        if not hmac.compare_digest(check, cls._check(mac_key)):
+            file.close()
+            raise VaultFileError("Wrong master password")
+        header = {'n': n, 'r': r, 'p': p, 'salt': salt, 'index_offset': index_offset, 'index_end': index_end}
+        return cls(path, file, header, aead_key, mac_key)
+
+    @staticmethod
+    def _check(mac_key):
+        return hmac.new(mac_key, b'encrypto vault check', hashlib.sha256).digest()[:16]
+
+    @classmethod
+    def _header_bytes(cls, header, mac_key):
+        return HEADER.pack(MAGIC, VERSION, 0, header['n'], header['r'], header['p'], header['salt'],
+                           cls._check(mac_key), header['index_offset'], header['index_end'])
+
+    def website_tag(self, user_id, website):
+        message = (user_id + '\0' + normalize_website(website)).encode('utf-8')
+        return hmac.new(self.mac_key, message, hashlib.sha256).digest()[:16]
+
+    def _load(self):
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        index_offset, index_end = self.header['index_offset'], self.header['index_end']
+        if index_offset:
+            id_slots, site_slots, self.indexed, self.next_id = INDEX.unpack_from(self.map, index_offset)
+            self.id_bits, self.site_bits = id_slots.bit_length() - 1, site_slots.bit_length() - 1
+            self.id_table = index_offset + INDEX.size
+            self.site_table = self.id_table + id_slots * ID_SLOT.size
+            tail = index_end
+        else:
+            self.indexed, self.next_id = 0, 0
+            tail = HEADER.size
+        # Tail overlay: id -> offset of its latest frame (None once deleted),
+        # and website tag -> ids put in the tail.
+        self.tail_ids = {}
+        self.tail_sites = collections.defaultdict(set)
+        self.tail_frames = 0
+        position = tail
+        while position + FRAME.size <= size:
+            length, kind, entry_id, tag, _ = FRAME.unpack_from(self.map, position)
+            if length < FRAME.size or position + length > size:
+                break
+            self._apply(kind, entry_id, tag, position)
+            position += length
+        if position < size:
+            # A torn frame from an interrupted append; drop it.
+            self.map.close()
+            self.file.truncate(position)
+            self.map = mmap.mmap(self.file.fileno(), position, access=mmap.ACCESS_READ)
+
+    def _apply(self, kind, entry_id, tag, offset):
+        self.tail_frames += 1
+        self.next_id = max(self.next_id, entry_id)
+        if kind == PUT:
+            self.tail_ids[entry_id] = offset
+            self.tail_sites[tag].add(entry_id)
+        else:
+            self.tail_ids[entry_id] = None
+            self.tail_sites[tag].discard(entry_id)
+
+    def _indexed_offset(self, entry_id):
+        if not self.header['index_offset']:
+            return 0
+        slot = _id_slot(entry_id, self.id_bits)
+        mask = (1 << self.id_bits) - 1
+        while True:
+            found, offset = ID_SLOT.unpack_from(self.map, self.id_table + slot * ID_SLOT.size)
+            if found == entry_id:
+                return offset
+            if found == 0:
+                return 0
+            slot = (slot + 1) & mask
+
+    def _indexed_site_offsets(self, tag):
+        if not self.header['index_offset']:
+            return
+        mask = (1 << self.site_bits) - 1
+        slot = int.from_bytes(tag[:8], 'little') & mask
+        while True:
+            found, offset = SITE_SLOT.unpack_from(self.map, self.site_table + slot * SITE_SLOT.size)
+            if offset == 0:
+                return
+            if found == tag:
+                yield offset
+            slot = (slot + 1) & mask
+
+    def _offset(self, entry_id):
+        if entry_id in self.tail_ids:
+            return self.tail_ids[entry_id]
+        return self._indexed_offset(entry_id) or None
+
+    def _frame(self, offset):
+        if offset + FRAME.size > len(self.map):
+            # Appended since the map was made.
+            self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        length = FRAME.unpack_from(self.map, offset)[0]
+        return self.map[offset:offset + length]
+
+    def _decrypt(self, frame):
+        _, kind, entry_id, tag, nonce = FRAME.unpack_from(frame)
+        plaintext = self.aead.decrypt(nonce, frame[FRAME.size:], self.salt + frame[4:FRAME.size - 12])
+        return VaultEntry(entry_id, *_unpack_entry(plaintext))
+
+    def _append(self, kind, entry_id, tag, plaintext):
+        nonce = os.urandom(12)
+        associated = struct.pack('<BQ16s', kind, entry_id, tag)
+        ciphertext = self.aead.encrypt(nonce, plaintext, self.salt + associated)
+        frame = FRAME.pack(FRAME.size + len(ciphertext), kind, entry_id, tag, nonce) + ciphertext
+        offset = self.file.seek(0, os.SEEK_END)
+        self.file.write(frame)
+        self.file.flush()
+        self._apply(kind, entry_id, tag, offset)
+        if self.auto_compact and self.tail_frames > max(COMPACT_THRESHOLD, self.indexed // 4):
+            self.compact()
+
+    def get(self, entry_id):
+        offset = self._offset(entry_id)
+        return self._decrypt(self._frame(offset)) if offset else None
+
+    def find(self, user_id, website):
+        """Entries of user_id for website (matched after normalizing), in id order."""
+        tag = self.website_tag(user_id, website)
+        ids = set(self.tail_sites.get(tag, ()))
+        for offset in self._indexed_site_offsets(tag):
+            entry_id = FRAME.unpack_from(self.map, offset)[2]
+            if entry_id not in self.tail_ids:
+                ids.add(entry_id)
+        entries = (self.get(entry_id) for entry_id in sorted(ids))
+        # Tags are truncated HMACs; compare in full after decrypting.
+        key = normalize_website(website)
+        return [entry for entry in entries if entry.user_id == user_id and normalize_website(entry.website) == key]
+
+    def put(self, user_id, website, username, password, entry_id=None):
+        if entry_id is None:
+            entry_id = self.next_id + 1
+        else:
+            previous = self.get(entry_id)
+            if previous is not None and (previous.user_id, normalize_website(previous.website)) != (user_id, normalize_website(website)):
+                # Moving to another website: retire the old tag's index entry.
+                self._append(DELETE, entry_id, self.website_tag(previous.user_id, previous.website), b'')
+        self._append(PUT, entry_id, self.website_tag(user_id, website), _pack_entry(user_id, website, username, password))
+        return entry_id
+
+    def delete(self, entry_id):
+        entry = self.get(entry_id)
+        if entry is None:
+            return False
+        self._append(DELETE, entry_id, self.website_tag(entry.user_id, entry.website), b'')
+        return True
+
+    def live_offsets(self):
+        """Offsets of the current frame of every live entry, in id order."""
+        offsets = {}
+        if self.header['index_offset']:
+            for slot in range(1 << self.id_bits):
+                entry_id, offset = ID_SLOT.unpack_from(self.map, self.id_table + slot * ID_SLOT.size)
+                if entry_id:
+                    offsets[entry_id] = offset
+        offsets.update(self.tail_ids)
+        return [(entry_id, offsets[entry_id]) for entry_id in sorted(offsets) if offsets[entry_id]]
+
+    def entries(self, user_id=None):
+        for _, offset in self.live_offsets():
+            entry = self._decrypt(self._frame(offset))
+            if user_id is None or entry.user_id == user_id:
+                yield entry
+
+    def __len__(self):
+        return len(self.live_offsets())
+
+    def compact(self):
+        """Rewrite the file with only live frames and a fresh index, then swap it in.
+
+        Frames are copied as they are; nothing is decrypted or re-encrypted.
+        """
+        live = self.live_offsets()
+        tmp_path = self.path + '.tmp'
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'r+b') as out:
+            out.write(b'\0' * HEADER.size)
+            placed = []
+            for entry_id, offset in live:
+                frame = self._frame(offset)
+                placed.append((entry_id, frame[13:29], out.tell()))
+                out.write(frame)
+            index_offset = out.tell()
+            id_bits = site_bits = _table_bits(len(placed))
+            id_table = bytearray(ID_SLOT.size << id_bits)
+            site_table = bytearray(SITE_SLOT.size << site_bits)
+            mask = (1 << id_bits) - 1
+            for entry_id, tag, offset in placed:
+                slot = _id_slot(entry_id, id_bits)
+                while ID_SLOT.unpack_from(id_table, slot * ID_SLOT.size)[0]:
+                    slot = (slot + 1) & mask
+                ID_SLOT.pack_into(id_table, slot * ID_SLOT.size, entry_id, offset)
+                slot = int.from_bytes(tag[:8], 'little') & mask
+                while SITE_SLOT.unpack_from(site_table, slot * SITE_SLOT.size)[1]:
+                    slot = (slot + 1) & mask
+                SITE_SLOT.pack_into(site_table, slot * SITE_SLOT.size, tag, offset)
+            out.write(INDEX.pack(1 << id_bits, 1 << site_bits, len(placed), self.next_id))
+            out.write(id_table)
+            out.write(site_table)
+            header = dict(self.header, index_offset=index_offset, index_end=out.tell())
+            out.seek(0)
+            out.write(self._header_bytes(header, self.mac_key))
+            out.flush()
+            os.fsync(out.fileno())
+        self.map.close()
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, 'r+b')
+        self.header = header
+        self._load()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def from_sqlite(session, path, master_password, batch_size=1000):
+    """Write every entry in the SQLite vault to a new vault file at path, keeping ids.
+
+    Entries are keyed by their owner's username in the vault file. With
+    per-user shards, ids are only unique within a shard, so shard entries
+    get fresh ids. Users with a data key of their own must be unlocked
+    first (see userkeys.unlock); their entries raise cache.KeyLocked
+    otherwise.
+    """
+    import crypto
+    from db import shards
+    from db.models import Password, User
+
+    owners = dict(session.query(User.id, User.username))
+    vault = VaultFile.create(path, master_password)
+    # Fold the whole copy into one compaction at the end rather than many.
+    vault.auto_compact = False
+    for entries in shards.entry_sessions():
+        with entries:
+            query = (
+                entries.query(Password.id, Password.user_id, Password.website, Password.username, Password.password_hash)
+                .order_by(Password.id)
+                .yield_per(batch_size)
+            )
+            sharded = entries.get_bind() is not session.get_bind()
+            for entry_id, user_id, website, username, token in query:
+                password = crypto.decrypt_for(user_id, token.encode('utf-8')).decode('utf-8')
+                vault.put(owners[user_id], website or '', username or '', password, None if sharded else entry_id)
+    vault.compact()
+    vault.auto_compact = True
+    return vault
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-file encrypted vault.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert_parser = commands.add_parser('convert', help="copy the SQLite vault into a vault file")
+    convert_parser.add_argument('path')
+    get_parser = commands.add_parser('get')
+    get_parser.add_argument('path')
+    get_parser.add_argument('user')
+    get_parser.add_argument('website')
+    compact_parser = commands.add_parser('compact')
+    compact_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        from db.database import Session, init_db
+        from db.models import User
+        from userkeys import unlock
+
+        init_db()
+        master_password = getpass.getpass("New master password: ")
+        if master_password != getpass.getpass("Confirm master password: "):
+            parser.exit(1, "Passwords do not match.\n")
+        with Session() as session:
+            # Entries under a user's own data key need that user's password.
+            for user in session.query(User).filter(User.data_key.isnot(None)).all():
+                password = getpass.getpass(f"Password for {user.username}: ")
+                if not user.check_password(password):
+                    parser.exit(1, f"Invalid password for {user.username}.\n")
+                unlock(session, user, password)
+            with from_sqlite(session, args.path, master_password) as vault:
+                print(f"Wrote {len(vault)} entries to {args.path} ({os.path.getsize(args.path)} bytes)")
+        return
+    try:
+        with VaultFile.open(args.path, getpass.getpass("Master password: ")) as vault:
+            if args.command == 'get':
+                for entry in vault.find(args.user, args.website):
+                    print(f"{entry.website}\t{entry.username}\t{entry.password}")
+            else:
+                before = os.path.getsize(args.path)
+                vault.compact()
+                print(f"Compacted {args.path}: {before} -> {os.path.getsize(args.path)} bytes")
+    except VaultFileError as exc:
+        parser.exit(1, f"{exc}\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ordered_pool_map(fn, batches, workers=None, initializer=None, initargs=()):
+    """Run fn over batches in a process pool, yielding results in input order.
+
+    At most two batches per worker are in flight, so memory stays bounded
+    however long the input is. workers=0 runs everything in this process.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    if workers == 0:
+        if initializer:
+            initializer(*initargs)
+        for batch in batches:
+            yield fn(batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(fn, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
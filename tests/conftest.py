@@ -0,0 +1,82 @@
+import os
+import sys
+
+# The app reads these at import time: cheap bcrypt and scrypt settings keep
+# logins fast, and no test may touch the developer's own database or shards.
+os.environ['ENCRYPTO_BCRYPT_ROUNDS'] = '4'
+os.environ['ENCRYPTO_KDF'] = 'scrypt:n=1024,r=8,p=1'
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.pop('ENCRYPTO_SHARD_DIR', None)
+os.environ.pop('ENCRYPTO_PROFILE', None)
+
+# The modules import each other as top-level names, as when run from lib.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+
+import pytest
+
+PASSWORD = 'Abcd12345'
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """A fresh database and key.key in tmp_path, used by every entry point."""
+    import cli
+    import crypto
+    from cache import decryption_cache, key_cache
+    from db import database
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(crypto, '_keys', None)
+    monkeypatch.setattr(crypto, '_cipher', None)
+    monkeypatch.setattr(cli, 'session', None)
+    url = f"sqlite:///{tmp_path / 'passwords.db'}"
+    monkeypatch.setattr(database, 'DATABASE_URL', url)
+    engine = database.make_engine(url)
+    monkeypatch.setattr(database, '_engine', engine)
+    database.Session.configure(bind=engine)
+    database.init_db(engine)
+    yield engine
+    key_cache.clear()
+    decryption_cache.clear()
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    from db.database import Session
+
+    session = Session()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_user(session):
+    """Create an account (with its data key unlocked) and return it."""
+    from db.models import User
+    from userkeys import unlock
+
+    def make_user(username, password=PASSWORD, unlocked=True):
+        user = User(username=username)
+        user.set_password(password)
+        session.add(user)
+        session.commit()
+        if unlocked:
+            unlock(session, user, password)
+        return user
+
+    return make_user
+
+
+@pytest.fixture
+def add_entry(session):
+    from db.models import Password
+
+    def add_entry(user, website, password, username='me'):
+        entry = Password(website=website, username=username, user_id=user.id)
+        entry.set_password(password)
+        session.add(entry)
+        session.commit()
+        return entry
+
+    return add_entry
@@ -0,0 +1,63 @@
+import hashlib
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from db.backup import BackupError, Repository
+from db.database import make_engine
+from db.models import Password
+
+PASSPHRASE = 'backup passphrase'
+
+
+def checksum(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def entries_in(path):
+    engine = make_engine(f"sqlite:///{path}")
+    try:
+        with sessionmaker(bind=engine)() as session:
+            return {entry.website: entry.get_decrypted_password() for entry in session.query(Password)}
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture
+def repository(tmp_path):
+    with Repository.init(str(tmp_path / 'repo'), PASSPHRASE, n=1024) as repository:
+        yield repository
+
+
+def test_backup_and_restore_round_trip(tmp_path, session, make_user, add_entry, repository):
+    alice = make_user('alice')
+    add_entry(alice, 'mail.com', 'first')
+    files = [('passwords.db', str(tmp_path / 'passwords.db')), ('key.key', str(tmp_path / 'key.key'))]
+
+    first = repository.backup(files).snapshot
+    key_checksum = checksum(tmp_path / 'key.key')
+    add_entry(alice, 'bank.com', 'second')
+    second = repository.backup(files)
+    assert second.new_chunks < second.chunks
+    assert repository.snapshots() == [first, second.snapshot]
+    assert repository.find_snapshot() == second.snapshot
+    assert repository.verify(first, integrity=True) == []
+
+    restored = repository.restore(first, str(tmp_path / 'restored'))
+    assert restored == [str(tmp_path / 'restored' / name) for name, path in files]
+    assert checksum(tmp_path / 'restored' / 'key.key') == key_checksum
+    assert entries_in(tmp_path / 'restored' / 'passwords.db') == {'mail.com': 'first'}
+
+    with pytest.raises(BackupError, match="overwrite"):
+        repository.restore(first, str(tmp_path / 'restored'))
+    repository.restore(second.snapshot, str(tmp_path / 'latest'))
+    assert entries_in(tmp_path / 'latest' / 'passwords.db') == {'mail.com': 'first', 'bank.com': 'second'}
+
+
+def test_open_needs_the_passphrase(tmp_path, repository):
+    with pytest.raises(BackupError, match="Wrong backup passphrase"):
+        Repository.open(str(tmp_path / 'repo'), 'not the passphrase')
+    with pytest.raises(BackupError, match="not a backup repository"):
+        Repository.open(str(tmp_path / 'elsewhere'), PASSPHRASE)
+    with Repository.open(str(tmp_path / 'repo'), PASSPHRASE) as reopened:
+        assert reopened.snapshots() == []
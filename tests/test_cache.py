@@ -0,0 +1,79 @@
+from cache import DecryptionCache, KeyCache, decryption_cache
+from db.models import Password
+from vault import WriteBatch
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_decryption_cache_expires_and_evicts_least_recently_used():
+    clock = Clock()
+    cache = DecryptionCache(max_size=2, ttl=10, clock=clock)
+    cache.put(1, 'token-1', 'one')
+    cache.put(2, 'token-2', 'two')
+    assert cache.get(1, 'token-1') == 'one'
+    cache.put(3, 'token-3', 'three')
+    assert cache.get(2, 'token-2') is None
+    assert cache.get(1, 'token-1') == 'one'
+    assert cache.get(1, 'another token') is None
+    clock.now = 11
+    assert cache.get(3, 'token-3') is None
+
+
+def test_evicted_plaintext_is_zeroed():
+    cache = DecryptionCache()
+    cache.put(1, 'token', 'secret')
+    plaintext = cache._entries[1][2]
+    cache.invalidate(1)
+    assert plaintext == bytearray(len('secret'))
+
+
+def test_updating_an_entry_drops_its_cached_plaintext(session, make_user, add_entry):
+    entry = add_entry(make_user('alice'), 'a.com', 'first')
+    assert entry.get_decrypted_password() == 'first'
+    assert decryption_cache.get(entry.id, entry.password_hash) == 'first'
+
+    entry.set_password('second')
+    session.commit()
+    assert entry.get_decrypted_password() == 'second'
+
+    with WriteBatch(session) as batch:
+        batch.update_password(entry.user_id, entry.id, 'third')
+    assert decryption_cache.stats()['size'] == 0
+    assert session.get(Password, entry.id).get_decrypted_password() == 'third'
+
+
+def test_deleting_an_entry_drops_its_cached_plaintext(session, make_user, add_entry):
+    alice = make_user('alice')
+    orm_deleted = add_entry(alice, 'a.com', 'one')
+    batch_deleted = add_entry(alice, 'b.com', 'two')
+    for entry in (orm_deleted, batch_deleted):
+        entry.get_decrypted_password()
+    assert decryption_cache.stats()['size'] == 2
+
+    session.delete(orm_deleted)
+    session.commit()
+    assert decryption_cache.stats()['size'] == 1
+    with WriteBatch(session) as batch:
+        batch.delete(alice.id, batch_deleted.id)
+    assert decryption_cache.stats()['size'] == 0
+
+
+def test_key_cache_slides_expiry_and_bounds_its_size():
+    clock = Clock()
+    cache = KeyCache(max_size=2, ttl=10, clock=clock)
+    for user_id in (1, 2):
+        cache.put(user_id, b'key-%d' % user_id, object())
+    clock.now = 8
+    assert cache.key(1) == b'key-1'
+    clock.now = 15
+    assert cache.key(1) == b'key-1'
+    assert cache.key(2) is None
+    cache.put(3, b'key-3', object())
+    cache.put(4, b'key-4', object())
+    assert cache.key(1) is None and cache.cipher(1) is None
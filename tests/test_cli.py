@@ -0,0 +1,66 @@
+import cli
+from cache import key_cache
+from tests.conftest import PASSWORD
+from db.models import Password, User
+from userkeys import unlock
+
+SIGN_UP = ['1', 'alice', PASSWORD, PASSWORD]
+LOG_IN = ['2', 'alice', PASSWORD]
+
+
+def stored():
+    """alice's entries, unlocking her data key again since quitting drops it."""
+    session = cli.db_session()
+    session.expire_all()
+    alice = session.query(User).filter_by(username='alice').one()
+    assert key_cache.key(alice.id) is None
+    unlock(session, alice, PASSWORD)
+    return {entry.website: entry.get_decrypted_password() for entry in session.query(Password)}
+
+
+def test_add_view_and_delete(engine, capsys):
+    cli.run_script(SIGN_UP + LOG_IN + [
+        '1', 'mail.com', 'alice@mail.com', '2', 'Mail-pass-1', '',  # store a password of our own
+        '1', 'bank.com', 'alice', '1', '',  # and a generated one
+        '2', '1', 'a', '', '',  # view, revealing the page
+        '3', 'mail.com', '',  # delete
+        '7', '5',
+    ])
+    output = capsys.readouterr().out
+    assert 'Account created successfully.' in output and 'Login successful!' in output
+    assert 'Mail-pass-1' in output
+    assert 'Password deleted successfully!' in output
+    entries = stored()
+    assert list(entries) == ['bank.com'] and len(entries['bank.com']) == 12
+
+
+def test_edit_and_view_one_row(engine, capsys):
+    cli.run_script(SIGN_UP + LOG_IN + [
+        '1', 'mail.com', 'alice', '2', 'Old-pass-1', '',
+        '2', '2', 'mail.com', 'New-pass-1', '',  # update
+        '1', '1', '', '',  # view, revealing row 1
+        '7', '5',
+    ])
+    output = capsys.readouterr().out
+    assert 'New-pass-1' in output and 'Old-pass-1' not in output
+    assert stored() == {'mail.com': 'New-pass-1'}
+
+
+def test_wrong_password_and_unknown_entries_are_retried(engine, capsys):
+    cli.run_script(SIGN_UP + ['2', 'bob', 'alice', 'Wrong-pass-1', PASSWORD, '2', '3', 'nowhere.com'])
+    output = capsys.readouterr().out
+    assert 'Invalid username. Please try again.' in output
+    assert 'Invalid password. Please try again.' in output
+    assert 'Password not found. Please try again.' in output
+
+
+def test_expired_session_returns_to_login(engine, capsys):
+    cli.run_script(SIGN_UP + LOG_IN + ['1', 'mail.com', 'alice', '2', 'Mail-pass-1', ''])
+    user = cli.db_session().query(User).filter_by(username='alice').one()
+    key_cache.clear()
+    capsys.readouterr()
+
+    cli.run_script(['2', '1', 'a', 'alice', PASSWORD, '2', '1', 'a', '', ''], cli.menu, user)
+    output = capsys.readouterr().out
+    assert 'Your session has expired. Please log in again.' in output
+    assert output.index('Login successful!') < output.index('Mail-pass-1')
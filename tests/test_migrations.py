@@ -0,0 +1,92 @@
+import sqlite3
+
+from sqlalchemy import inspect, text
+
+from tests.conftest import PASSWORD
+
+
+def baseline_database(path, keyring):
+    """A database as the app created it before migrations were tracked."""
+    import hashing
+
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (username VARCHAR PRIMARY KEY, password_hash VARCHAR);
+        CREATE TABLE passwords (id INTEGER PRIMARY KEY, website VARCHAR, username VARCHAR,
+                                password_hash VARCHAR, user_id VARCHAR REFERENCES users(username));
+    """)
+    conn.executemany("INSERT INTO users VALUES (?, ?)", [
+        ('stephy_kamau', hashing.hash_password(PASSWORD)),
+        ('joseph_wanini', hashing.hash_password(PASSWORD)),
+    ])
+    conn.executemany("INSERT INTO passwords (website, username, password_hash, user_id) VALUES (?, ?, ?, ?)", [
+        ('GitHub.com', 'stephy', keyring.encrypt(b'gh-pass').decode(), 'stephy_kamau'),
+        ('test.com', 'joe', keyring.encrypt(b'test-pass').decode(), 'joseph_wanini'),
+        ('twitter.com', 'maina', keyring.encrypt(b'tw-pass').decode(), 'stephy_maina'),
+    ])
+    conn.commit()
+    conn.close()
+
+
+def migrate(tmp_path, monkeypatch):
+    import crypto
+    from db import database
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(crypto, '_keys', None)
+    monkeypatch.setattr(crypto, '_cipher', None)
+    baseline_database(tmp_path / 'old.db', crypto.get_cipher())
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    database.init_db(engine)
+    return engine
+
+
+def test_upgrade_from_baseline_reaches_current_revision(tmp_path, monkeypatch):
+    from db.database import SCHEMA_REVISION
+
+    engine = migrate(tmp_path, monkeypatch)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT version_num FROM alembic_version")).scalar() == SCHEMA_REVISION
+        user_columns = {column['name'] for column in inspect(conn).get_columns('users')}
+        entry_columns = {column['name'] for column in inspect(conn).get_columns('passwords')}
+    assert {'id', 'data_key', 'key_salt', 'key_kdf'} <= user_columns
+    assert {'website_key', 'sync_id', 'hlc', 'origin'} <= entry_columns
+    engine.dispose()
+
+
+def test_upgrade_keeps_every_entry_with_its_owner(tmp_path, monkeypatch):
+    from sqlalchemy.orm import Session
+
+    from db.models import Password, User
+    from search import search_passwords
+
+    engine = migrate(tmp_path, monkeypatch)
+    with Session(engine) as session:
+        owners = {entry.website: entry.user.username for entry in session.query(Password)}
+        assert owners == {'GitHub.com': 'stephy_kamau', 'test.com': 'joseph_wanini', 'twitter.com': 'orphaned-entries'}
+        stephy = session.query(User).filter_by(username='stephy_kamau').one()
+        assert stephy.check_password(PASSWORD)
+        found = search_passwords(session, stephy.id, 'github')
+        assert [entry.get_decrypted_password() for entry in found] == ['gh-pass']
+        orphans = session.query(User).filter_by(username='orphaned-entries').one()
+        assert not orphans.check_password(PASSWORD)
+        assert [entry.website for entry in search_passwords(session, orphans.id, 'twitt')] == ['twitter.com']
+    engine.dispose()
+
+
+def test_downgrade_and_upgrade_round_trip(tmp_path, monkeypatch):
+    from alembic import command
+
+    from db.database import SCHEMA_REVISION, alembic_config
+
+    engine = migrate(tmp_path, monkeypatch)
+    with engine.begin() as conn:
+        command.downgrade(alembic_config(conn), '0001')
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT user_id FROM passwords WHERE website = 'test.com'")).scalar() == 'joseph_wanini'
+    with engine.begin() as conn:
+        command.upgrade(alembic_config(conn), 'head')
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT version_num FROM alembic_version")).scalar() == SCHEMA_REVISION
+        assert conn.execute(text("SELECT count(*) FROM passwords")).scalar() == 3
+    engine.dispose()
@@ -0,0 +1,114 @@
+import time
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from tests.conftest import PASSWORD
+from db.database import init_db, make_engine
+from db.models import Password, User
+from sync import FileTransport, SyncError, account_tag, sync_user
+from userkeys import unlock
+
+PASSPHRASE = 'shared sync passphrase'
+
+
+@pytest.fixture
+def devices(tmp_path, session, make_user):
+    """Alice's vault on two devices, where her user id differs: 1 on A and 2 on B."""
+    make_user('alice')
+    make_user('bob', unlocked=False)
+    engine = make_engine(f"sqlite:///{tmp_path / 'device-b.db'}")
+    init_db(engine)
+    other = sessionmaker(bind=engine)()
+    for username in ('bob', 'alice'):
+        user = User(username=username)
+        user.set_password(PASSWORD)
+        other.add(user)
+    other.commit()
+    unlock(other, other.query(User).filter_by(username='alice').one(), PASSWORD)
+    yield session, other
+    other.close()
+    engine.dispose()
+
+
+def alice(session):
+    return session.query(User).filter_by(username='alice').one()
+
+
+def sync(session, transport):
+    return sync_user(session, alice(session).id, 'alice', transport, PASSPHRASE, workers=0)
+
+
+def vault(session):
+    session.expire_all()
+    return {
+        entry.website: (entry.username, entry.get_decrypted_password())
+        for entry in session.query(Password).filter_by(user_id=alice(session).id)
+    }
+
+
+def add(session, website, password):
+    entry = Password(website=website, username='alice', user_id=alice(session).id)
+    entry.set_password(password)
+    session.add(entry)
+    session.commit()
+
+
+def edit(session, website, password):
+    session.query(Password).filter_by(website=website).one().set_password(password)
+    session.commit()
+
+
+def test_two_replicas_converge(tmp_path, devices):
+    a, b = devices
+    transport = FileTransport(tmp_path / 'shared')
+    add(a, 'mail.com', 'from-a')
+    add(a, 'bank.com', 'bank-a')
+    add(b, 'news.com', 'from-b')
+
+    for device in (a, b, a):
+        sync(device, transport)
+    assert vault(a) == vault(b) == {
+        'mail.com': ('alice', 'from-a'), 'bank.com': ('alice', 'bank-a'), 'news.com': ('alice', 'from-b'),
+    }
+
+    # Both edit mail.com; the later edit wins everywhere. A deletes bank.com.
+    edit(a, 'mail.com', 'edited-on-a')
+    time.sleep(0.01)
+    edit(b, 'mail.com', 'edited-on-b')
+    a.delete(a.query(Password).filter_by(website='bank.com').one())
+    a.commit()
+
+    for device in (a, b, a):
+        sync(device, transport)
+    assert vault(a) == vault(b) == {'mail.com': ('alice', 'edited-on-b'), 'news.com': ('alice', 'from-b')}
+    assert sync(b, transport).applied == 0
+
+
+def test_bundles_never_cross_accounts(tmp_path, devices):
+    a, b = devices
+    transport = FileTransport(tmp_path / 'shared')
+    add(a, 'mail.com', 'alices')
+    sync(a, transport)
+
+    bob = b.query(User).filter_by(username='bob').one()
+    assert sync_user(b, bob.id, 'bob', transport, PASSPHRASE, workers=0).received == 0
+    assert b.query(Password).filter_by(user_id=bob.id).count() == 0
+
+    # Alice's bundle renamed to look like bob's is refused, not applied to him.
+    shared = tmp_path / 'shared'
+    (bundle,) = shared.glob(f"*.{account_tag('alice')}.sync")
+    bundle.rename(shared / bundle.name.replace(account_tag('alice'), account_tag('bob')))
+    with pytest.raises(SyncError, match="another account"):
+        sync_user(b, bob.id, 'bob', transport, PASSPHRASE, workers=0)
+    assert b.query(Password).filter_by(user_id=bob.id).count() == 0
+
+
+def test_wrong_passphrase_is_refused(tmp_path, devices):
+    a, b = devices
+    transport = FileTransport(tmp_path / 'shared')
+    add(a, 'mail.com', 'alices')
+    sync(a, transport)
+    with pytest.raises(SyncError):
+        sync_user(b, alice(b).id, 'alice', transport, 'not the passphrase', workers=0)
+    assert vault(b) == {}
@@ -0,0 +1,122 @@
+import pytest
+from cryptography.fernet import InvalidToken
+
+import crypto
+import rotate_keys
+import userkeys
+from cache import KeyLocked, key_cache
+from tests.conftest import PASSWORD
+from db.database import Session
+from db.models import Password, User
+
+
+def legacy_entry(session, user, website, password):
+    """An entry written under key.key, as before users had data keys."""
+    entry = Password(website=website, username='me', user_id=user.id,
+                     password_hash=crypto.encrypt(password.encode('utf-8')).decode('utf-8'))
+    session.add(entry)
+    session.commit()
+    return entry
+
+
+def test_entries_need_the_unlocked_data_key(session, make_user, add_entry):
+    alice = make_user('alice')
+    entry = add_entry(alice, 'a.com', 'secret')
+    with pytest.raises(InvalidToken):
+        crypto.decrypt(entry.password_hash.encode('utf-8'))
+
+    key_cache.clear()
+    with pytest.raises(KeyLocked):
+        entry.get_decrypted_password()
+    with pytest.raises(InvalidToken):
+        userkeys.unlock(session, alice, 'wrong password')
+
+    userkeys.unlock(session, alice, PASSWORD)
+    assert entry.get_decrypted_password() == 'secret'
+
+
+def test_first_unlock_moves_legacy_entries_to_the_data_key(session, make_user):
+    bob = make_user('bob', unlocked=False)
+    entries = [legacy_entry(session, bob, f"site{number}.com", f"pw{number}") for number in range(5)]
+
+    userkeys.unlock(session, bob, PASSWORD)
+    assert bob.data_key is not None
+    for number, entry in enumerate(entries):
+        session.refresh(entry)
+        with pytest.raises(InvalidToken):
+            crypto.decrypt(entry.password_hash.encode('utf-8'))
+        assert entry.get_decrypted_password() == f"pw{number}"
+
+
+def test_concurrent_first_unlocks_keep_one_key(engine, make_user):
+    make_user('carol', unlocked=False)
+    first, second = Session(), Session()
+    carol_first = first.query(User).filter_by(username='carol').one()
+    carol_second = second.query(User).filter_by(username='carol').one()
+    legacy_entry(first, carol_first, 'c.com', 'carols')
+
+    kept = userkeys.unlock(first, carol_first, PASSWORD)
+    key_cache.clear()
+    assert userkeys.unlock(second, carol_second, PASSWORD) == kept
+    assert first.query(Password).one().get_decrypted_password() == 'carols'
+
+
+def test_key_is_rewrapped_when_the_kdf_changes(session, make_user, add_entry, monkeypatch):
+    alice = make_user('alice')
+    entry = add_entry(alice, 'a.com', 'secret')
+    wrapped = alice.data_key
+
+    monkeypatch.setattr(userkeys, 'KDF', 'scrypt:n=2048,r=8,p=1')
+    assert userkeys.needs_rewrap(alice)
+    key_cache.clear()
+    userkeys.unlock(session, alice, PASSWORD)
+    assert alice.key_kdf == 'scrypt:n=2048,r=8,p=1' and alice.data_key != wrapped
+    assert not userkeys.needs_rewrap(alice)
+    assert entry.get_decrypted_password() == 'secret'
+
+
+def test_change_password_rewraps_the_key(session, make_user, add_entry):
+    alice = make_user('alice')
+    entry = add_entry(alice, 'a.com', 'secret')
+
+    userkeys.change_password(session, alice, PASSWORD, 'New-pass-1')
+    key_cache.clear()
+    with pytest.raises(InvalidToken):
+        userkeys.unlock(session, alice, PASSWORD)
+    userkeys.unlock(session, alice, 'New-pass-1')
+    assert alice.check_password('New-pass-1')
+    assert entry.get_decrypted_password() == 'secret'
+
+
+def test_reset_password_deletes_entries_it_cannot_read(session, make_user, add_entry):
+    alice = make_user('alice')
+    add_entry(alice, 'a.com', 'secret')
+
+    assert userkeys.reset_password(session, alice, 'New-pass-1') == 1
+    assert session.query(Password).count() == 0
+    userkeys.unlock(session, alice, 'New-pass-1')
+
+
+def test_rotation_reencrypts_keyring_entries_and_skips_data_key_entries(session, make_user, add_entry):
+    alice = make_user('alice')
+    keyed = add_entry(alice, 'keyed.com', 'keyed-secret')
+    bob = make_user('bob', unlocked=False)
+    legacy = legacy_entry(session, bob, 'legacy.com', 'legacy-secret')
+    keyed_token = keyed.password_hash
+
+    rotation = rotate_keys.start_rotation(session)
+    rotate_keys.run_rotation(session, rotation, workers=0, report=lambda *args: None)
+    rotate_keys.retire_old_keys()
+
+    assert len(crypto.get_keys()) == 1
+    session.refresh(legacy)
+    session.refresh(keyed)
+    assert crypto.decrypt(legacy.password_hash.encode('utf-8')) == b'legacy-secret'
+    assert keyed.password_hash == keyed_token
+    assert keyed.get_decrypted_password() == 'keyed-secret'
+
+
+def test_calibrate_falls_back_to_the_weakest_candidate():
+    assert userkeys.calibrate(target_ms=0) == 'scrypt:n=16384,r=8,p=1'
+    with pytest.raises(ValueError):
+        userkeys.parse_kdf('md5:rounds=1')
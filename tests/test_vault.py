@@ -0,0 +1,61 @@
+import pytest
+
+from db.models import Password
+from vault import WriteBatch, iter_password_pages, password_page
+
+
+def test_write_batch_commits_everything_on_exit(session, make_user, add_entry):
+    alice = make_user('alice')
+    kept = add_entry(alice, 'kept.com', 'old')
+    doomed = add_entry(alice, 'doomed.com', 'gone')
+
+    with WriteBatch(session) as batch:
+        batch.create(alice.id, 'new.com', 'me', 'fresh')
+        batch.update_password(alice.id, kept.id, 'changed')
+        batch.delete(alice.id, doomed.id)
+
+    entries = {entry.website: entry.get_decrypted_password() for entry in session.query(Password)}
+    assert entries == {'kept.com': 'changed', 'new.com': 'fresh'}
+
+
+def test_write_batch_discards_everything_if_the_block_raises(session, make_user, add_entry):
+    alice = make_user('alice')
+    kept = add_entry(alice, 'kept.com', 'old')
+
+    with pytest.raises(RuntimeError):
+        with WriteBatch(session) as batch:
+            batch.create(alice.id, 'new.com', 'me', 'fresh')
+            batch.update_password(alice.id, kept.id, 'changed')
+            batch.delete(alice.id, kept.id)
+            raise RuntimeError("interrupted")
+
+    session.expire_all()
+    entries = {entry.website: entry.get_decrypted_password() for entry in session.query(Password)}
+    assert entries == {'kept.com': 'old'}
+
+
+def test_write_batch_only_touches_the_owners_entries(session, make_user, add_entry):
+    alice = make_user('alice')
+    bob = make_user('bob')
+    bobs = add_entry(bob, 'bank.com', 'bobs-secret')
+
+    with WriteBatch(session) as batch:
+        batch.update_password(alice.id, bobs.id, 'hijacked')
+        batch.delete(alice.id, bobs.id)
+
+    session.expire_all()
+    assert session.get(Password, bobs.id).get_decrypted_password() == 'bobs-secret'
+
+
+def test_pages_walk_every_entry_in_website_order(session, make_user):
+    alice = make_user('alice')
+    with WriteBatch(session) as batch:
+        for number in range(45):
+            batch.create(alice.id, f"site{number:02d}.com", 'me', 'pw')
+
+    pages = list(iter_password_pages(session, alice.id, page_size=20))
+    assert [len(page) for page in pages] == [20, 20, 5]
+    websites = [entry.website for page in pages for entry in page]
+    assert websites == sorted(websites) and len(set(websites)) == 45
+    last = pages[0][-1]
+    assert password_page(session, alice.id, (last.website_key, last.id), 1)[0].website == 'site20.com'